@@ -0,0 +1,209 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from utils.rs_backend import rs
+
+from utils import mesh_io, shape_files
+from utils.mesh_snapshot import MeshSnapshot
+from utils.topology_cache import TopologyCache
+
+""" Runs a flow over many shapes and step sizes in parallel, outside Rhinoceros.
+
+Usage: python batch.py FLOW "INPUT_GLOB" [INPUT_GLOB ...] --iterations N --steps S1,S2,...
+                       --output DIR [--workers N] [--arg NAME=VALUE ...]
+
+e.g. python batch.py face_flow "../shapes/meshes/*.3dm" "meshes/*.ply" --iterations 100 \\
+         --steps 0.01,0.03,0.1 --output results
+
+Each (input file, step size) pair is a job; the jobs are run by a pool of processes
+(one per CPU by default). The inputs may be mesh files (PLY, STL, OBJ; see mesh_io.py),
+polyline point files (.txt, .xyz, .csv; see shape_files.py) or .3dm files (which require
+the rhino3dm package). Every shape of every job is written to the output directory
+(meshes as PLY, polylines as .txt), and results.json lists the jobs with their timings
+and errors. Only the module of the requested flow is imported (by the workers), so
+the startup is cheap.
+"""
+
+
+# Flow name -> (module, function, kind of shape, name of the step argument)
+FLOWS = {
+    "face_flow": ("meshes.face_flow", "flow", "mesh", "step"),
+    "harmonic_flow": ("meshes.harmonic_flow", "flow", "mesh", "step"),
+    "edgeflow": ("curves.edgeflow", "edgeflow", "curve", "step"),
+    "isometricflow": ("curves.isometricflow", "isometricflow", "curve", "t"),
+}
+
+timer = getattr(time, "perf_counter", time.time)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs a flow over many shapes and step sizes.")
+    parser.add_argument("flow", choices=sorted(FLOWS), help="the flow to run")
+    parser.add_argument("inputs", nargs="+", help="glob patterns of the input files")
+    parser.add_argument("--iterations", type=int, default=1, help="iterations per job")
+    parser.add_argument("--steps", help="comma-separated step sizes (default: the flow's default); "
+                                        "edgeflow takes step types, e.g. unit,curvature")
+    parser.add_argument("--output", required=True, help="the directory to write the results to")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: the number of CPUs)")
+    parser.add_argument("--arg", action="append", default=[], metavar="NAME=VALUE",
+                        help="an extra keyword argument of the flow, e.g. implicit=True")
+    args = parser.parse_args(argv)
+
+    paths = sorted(set(path for pattern in args.inputs for path in glob.glob(pattern)))
+    if not paths:
+        parser.error("no input files match %s" % " ".join(args.inputs))
+    steps = [_parse_value(step) for step in args.steps.split(",")] if args.steps else [None]
+    options = dict(_parse_option(option) for option in args.arg)
+    results = run(args.flow, paths, args.iterations, steps, args.output, args.workers, options)
+    failed = [job for job in results["jobs"] if _errors(job)]
+    sys.stderr.write("%d jobs done in %.1f s, %d failed; see %s\n" %
+                     (len(results["jobs"]), results["seconds"], len(failed),
+                      os.path.join(args.output, "results.json")))
+    return 1 if failed else 0
+
+
+def run(flow, paths, iterations, steps, output_dir, workers=None, options=None):
+    """Runs the flow on every input file with every step size (None standing for the flow's
+    default) in a process pool, writes the results to output_dir and returns the summary
+    that is also written to output_dir/results.json.
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    jobs = [(flow, path, step, iterations, output_dir, options or {}) for path in paths for step in steps]
+    workers = min(workers or multiprocessing.cpu_count(), len(jobs))
+    start = timer()
+    results = []
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            for result in pool.imap_unordered(run_job, jobs):
+                results.append(result)
+                _progress(result, len(results), len(jobs))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            results.append(run_job(job))
+            _progress(results[-1], len(results), len(jobs))
+    results.sort(key=lambda result: (result["input"], str(result["step"])))
+    summary = {"flow": flow, "iterations": iterations, "steps": steps, "options": options or {},
+               "workers": workers, "seconds": timer() - start, "jobs": results}
+    with open(os.path.join(output_dir, "results.json"), "w") as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+    return summary
+
+
+def run_job(job):
+    """Runs one (flow, input file, step size) job in the current process and returns
+    its results; the errors are reported in the results rather than raised.
+    """
+    flow, path, step, iterations, output_dir, options = job
+    result = {"input": path, "step": step, "shapes": []}
+    start = timer()
+    try:
+        module_name, function_name, kind, step_argument = FLOWS[flow]
+        flow_func = getattr(__import__(module_name, fromlist=[function_name]), function_name)
+        kwargs = dict(options)
+        if step is not None:
+            kwargs[step_argument] = step
+        name = "%s_%s%s" % (os.path.splitext(os.path.basename(path))[0], flow,
+                            "" if step is None else "_step%s" % step)
+        for index, shape in enumerate(_load(path, kind)):
+            output = os.path.join(output_dir, "%s%s.%s" % (name, "_%d" % index if index else "",
+                                                           "ply" if kind == "mesh" else "txt"))
+            result["shapes"].append(_run_shape(flow_func, kind, shape, iterations, kwargs, output))
+    except Exception as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    # The worker processes are reused for the next jobs: leave their document empty.
+    rs.DeleteObjects(rs.AllObjects())
+    result["seconds"] = timer() - start
+    return result
+
+
+def _run_shape(flow_func, kind, shape, iterations, kwargs, output):
+    """Runs the flow on one shape (a MeshSnapshot or a polyline id) and writes the result."""
+    result = {"output": output}
+    seconds = []
+    try:
+        if kind == "mesh":
+            result.update(vertices=shape.vertex_count, faces=shape.face_count)
+            kwargs = dict(kwargs, commit=False, topology_cache=TopologyCache())
+            for _ in range(iterations):
+                iteration_start = timer()
+                shape = flow_func(shape, **kwargs)
+                seconds.append(timer() - iteration_start)
+            mesh_io.write(output, shape)
+        else:
+            result["vertices"] = len(rs.PolylineVertices(shape)) - 1
+            others = set(rs.AllObjects()) - set([shape])
+            for _ in range(iterations):
+                iteration_start = timer()
+                shape = flow_func(shape, **kwargs)
+                seconds.append(timer() - iteration_start)
+                # The curve flows keep the previous polylines and draw their motion vectors.
+                rs.DeleteObjects([object_id for object_id in rs.AllObjects()
+                                  if object_id not in others and object_id != shape])
+            shape_files.write_polyline(output, rs.PolylineVertices(shape))
+    except Exception as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    result["seconds_per_iteration"] = seconds
+    return result
+
+
+def _load(path, kind):
+    """Returns the shapes of the given kind stored in the file: MeshSnapshots for meshes,
+    polyline ids (in the in-memory document) for curves.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".3dm":
+        ids = shape_files.import_3dm(path, kind)
+        if ids is None:
+            raise Exception("Reading .3dm files outside Rhinoceros requires rhino3dm.")
+        if not ids:
+            raise Exception("There are no %ses in %s." % (kind, path))
+        return [MeshSnapshot(object_id) for object_id in ids] if kind == "mesh" else ids
+    if kind == "mesh":
+        return [mesh_io.load(path)]
+    if shape_files.is_polyline_file(path):
+        return [shape_files.add_polyline(path)]
+    raise Exception("Not a %s file: %s" % (kind, path))
+
+
+def _errors(result):
+    errors = [result.get("error")] + [shape.get("error") for shape in result["shapes"]]
+    return [error for error in errors if error]
+
+
+def _progress(result, done, total):
+    errors = _errors(result)
+    sys.stderr.write("[%d/%d] %s, step %s: %.2f s%s\n" %
+                     (done, total, result["input"], result["step"], result["seconds"],
+                      " (%s)" % errors[0] if errors else ""))
+
+
+def _parse_value(text):
+    for parse in (int, float):
+        try:
+            return parse(text)
+        except ValueError:
+            pass
+    if text in ("True", "False"):
+        return text == "True"
+    return text
+
+
+def _parse_option(option):
+    if "=" not in option:
+        raise Exception("Expected NAME=VALUE: %s" % option)
+    name, value = option.split("=", 1)
+    return name, _parse_value(value)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
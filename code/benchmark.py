@@ -0,0 +1,286 @@
+import argparse
+import glob
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 (e.g. IronPython in Rhinoceros): no memory measurements.
+    tracemalloc = None
+
+from utils.rs_backend import rs, headless
+
+from curves import edgeflow, isometricflow, laplace
+from meshes import face_flow, harmonic_flow
+from utils import generators, mesh_utils as mu, shape_files
+from utils.mesh_snapshot import MeshSnapshot
+from utils.topology_cache import TopologyCache
+
+""" Benchmarks of the flows on the shapes/ library and on synthetic shapes of growing size.
+
+Usage: python benchmark.py [--output results.json] [--compare baseline.json] ...
+(see "python benchmark.py --help"). The results are written as JSON: for each case
+(flow, shape, size), the wall time of every iteration and the peak memory allocated
+during one iteration; for each flow and each family of synthetic shapes, the exponents
+of the power laws fitted to the time and memory as functions of the number of vertices.
+"""
+
+
+SHAPES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shapes")
+
+MESH_FLOWS = ["harmonic_flow", "face_flow"]
+CURVE_FLOWS = ["edgeflow", "isometricflow", "laplace"]
+MESH_FAMILIES = {"sphere": generators.uv_sphere_with_vertices,
+                 "torus": generators.torus_with_vertices}
+CURVE_FAMILIES = {"circle": lambda n: generators.circle(n, radius=n)}
+
+timer = getattr(time, "perf_counter", time.time)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the curve and mesh flows.")
+    parser.add_argument("--output", help="the JSON file to write the results to (default: stdout)")
+    parser.add_argument("--compare", help="a JSON file with earlier results to compare against")
+    parser.add_argument("--flows", default=",".join(MESH_FLOWS + CURVE_FLOWS),
+                        help="comma-separated flows to benchmark")
+    parser.add_argument("--iterations", type=int, default=3, help="timed iterations per case")
+    parser.add_argument("--mesh-sizes", default="100,1000,10000,100000,1000000",
+                        help="vertex counts of the synthetic meshes")
+    parser.add_argument("--curve-sizes", default="100,1000,10000",
+                        help="vertex counts of the synthetic polylines")
+    parser.add_argument("--time-limit", type=float, default=30.0,
+                        help="skip the larger sizes of a family once an iteration takes longer")
+    parser.add_argument("--in-memory", action="store_true",
+                        help="run the mesh flows in memory (commit=False)")
+    parser.add_argument("--no-shapes", action="store_true", help="skip the shapes/ library")
+    args = parser.parse_args(argv)
+
+    results = run(args.flows.split(","), args.iterations,
+                  [int(float(n)) for n in args.mesh_sizes.split(",") if n],
+                  [int(float(n)) for n in args.curve_sizes.split(",") if n],
+                  args.time_limit, args.in_memory, not args.no_shapes)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            sys.stderr.write(compare(json.load(f), results))
+
+
+def run(flows, iterations, mesh_sizes, curve_sizes, time_limit=30.0, in_memory=False, shapes=True):
+    """Runs all the benchmark cases and returns the results as a JSON-serializable dict."""
+    cases = []
+    for flow in flows:
+        kind = "mesh" if flow in MESH_FLOWS else "curve"
+        if shapes:
+            folder = "meshes" if kind == "mesh" else "curves"
+            for path in sorted(glob.glob(os.path.join(SHAPES_DIR, folder, "*.3dm"))):
+                cases.extend(_run_shape_file(flow, kind, path, iterations, in_memory))
+        families = MESH_FAMILIES if kind == "mesh" else CURVE_FAMILIES
+        for family in sorted(families):
+            too_slow = False
+            for size in (mesh_sizes if kind == "mesh" else curve_sizes):
+                case = {"flow": flow, "shape": family, "source": "synthetic"}
+                if too_slow:
+                    case.update(vertices=size, skipped="an iteration of a smaller %s took more "
+                                                        "than %g s" % (family, time_limit))
+                else:
+                    shape = families[family](size)
+                    case.update(_run_case(flow, kind, _add_shape(kind, shape), iterations, in_memory))
+                    too_slow = case.get("median_seconds", 0) > time_limit
+                cases.append(case)
+    return {
+        "environment": _environment(in_memory),
+        "cases": cases,
+        "scaling": scaling_exponents(cases),
+    }
+
+
+def scaling_exponents(cases):
+    """Fits time ~ vertices^a and memory ~ vertices^b to the synthetic cases of each flow
+    and family (by least squares on the logarithms) and returns the exponents a and b.
+    """
+    groups = {}
+    for case in cases:
+        if case["source"] == "synthetic" and "median_seconds" in case:
+            groups.setdefault((case["flow"], case["shape"]), []).append(case)
+    exponents = []
+    for (flow, shape), group in sorted(groups.items()):
+        sizes = [case["vertices"] for case in group]
+        exponents.append({
+            "flow": flow,
+            "shape": shape,
+            "vertices": sizes,
+            "time_exponent": _fit_exponent(sizes, [case["median_seconds"] for case in group]),
+            "memory_exponent": _fit_exponent(sizes, [case.get("peak_memory_bytes") for case in group]),
+        })
+    return exponents
+
+
+def compare(baseline, results):
+    """Returns a text table comparing the median iteration times of the common cases."""
+    def key(case):
+        return case["flow"], case["shape"], case.get("vertices")
+    before = dict((key(case), case) for case in baseline["cases"] if "median_seconds" in case)
+    lines = ["%-14s %-14s %9s %12s %12s %7s" % ("flow", "shape", "vertices", "before, s", "after, s", "ratio")]
+    for case in results["cases"]:
+        if "median_seconds" in case and key(case) in before:
+            old = before[key(case)]["median_seconds"]
+            lines.append("%-14s %-14s %9d %12.6f %12.6f %7.2f" %
+                         (case["flow"], case["shape"], case["vertices"], old, case["median_seconds"],
+                          case["median_seconds"] / old if old > 0 else float("inf")))
+    return "\n".join(lines) + "\n"
+
+
+def _run_shape_file(flow, kind, path, iterations, in_memory):
+    shape = os.path.splitext(os.path.basename(path))[0]
+    ids = shape_files.import_3dm(path, kind)
+    if ids is None:
+        return [{"flow": flow, "shape": shape, "source": "shapes",
+                 "skipped": "reading .3dm files outside Rhinoceros requires rhino3dm"}]
+    cases = []
+    for object_id in ids:
+        case = {"flow": flow, "shape": shape, "source": "shapes"}
+        case.update(_run_case(flow, kind, object_id, iterations, in_memory))
+        cases.append(case)
+    return cases
+
+
+def _run_case(flow, kind, object_id, iterations, in_memory):
+    """Runs the flow on the given object, timing each iteration, and then measures
+    the peak memory allocated during one more iteration. All the objects created
+    by the case are deleted from the document afterwards.
+    """
+    if flow == "laplace" and not headless:
+        rs.DeleteObject(object_id)
+        return {"skipped": "Laplacemotion() selects its polyline interactively in Rhinoceros"}
+    existing = set(rs.AllObjects()) - set([object_id])
+    if kind == "mesh":
+        snapshot = MeshSnapshot(object_id)
+        result = {"vertices": snapshot.vertex_count, "faces": snapshot.face_count}
+        step_size = 0.01 * _min_edge_length(snapshot)
+        if in_memory:
+            object_id = snapshot
+    else:
+        result = {"vertices": len(rs.PolylineVertices(object_id)) - 1}
+    iterate = _flow_step(flow, step_size if kind == "mesh" else None, in_memory)
+
+    seconds = []
+    current = object_id
+    try:
+        for _ in range(iterations):
+            start = timer()
+            current = iterate(current)
+            seconds.append(timer() - start)
+            _delete_new_objects(existing, current)
+        if tracemalloc is not None:
+            tracemalloc.start()
+            current = iterate(current)
+            result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    except Exception as e:
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    _delete_new_objects(existing, None)
+    if seconds:
+        result["seconds_per_iteration"] = seconds
+        result["median_seconds"] = _median(seconds)
+    return result
+
+
+def _flow_step(flow, step_size, in_memory):
+    """Returns a function performing one iteration of the flow on an object."""
+    if flow in MESH_FLOWS:
+        flow_func = harmonic_flow.flow if flow == "harmonic_flow" else face_flow.flow
+        topology_cache = TopologyCache()
+        return lambda mesh: flow_func(mesh, step=step_size, topology_cache=topology_cache,
+                                      commit=not in_memory)
+    elif flow == "edgeflow":
+        return lambda polyline: edgeflow.edgeflow(polyline, "unit")
+    elif flow == "isometricflow":
+        return lambda polyline: isometricflow.isometricflow(polyline, 0.1)
+    elif flow == "laplace":
+        # NOTE: Laplacemotion() takes the polyline from rs.GetObject(), which outside
+        #       Rhinoceros returns the last curve added, i.e. the current polyline
+        #       (the vectors drawn by the previous iteration are deleted after it).
+        return lambda polyline: laplace.Laplacemotion()
+    raise Exception("Unknown flow: %s" % flow)
+
+
+def _delete_new_objects(existing, keep):
+    """Deletes the objects added to the document since 'existing', except 'keep'
+    (e.g. the vectors drawn by the curve flows and the previous polylines).
+    """
+    keep = keep.mesh_id if isinstance(keep, MeshSnapshot) else keep
+    rs.DeleteObjects([object_id for object_id in rs.AllObjects()
+                      if object_id not in existing and object_id != keep])
+
+
+def _add_shape(kind, shape):
+    if kind == "curve":
+        return rs.AddPolyline(shape.tolist())
+    return mu.add_mesh(*shape)
+
+
+def _min_edge_length(snapshot):
+    mesh = snapshot.mesh
+    edges = mesh.vertices[mesh.he_target()] - mesh.vertices[mesh.he_origin()]
+    lengths = (edges ** 2).sum(axis=1) ** 0.5
+    return float(lengths[lengths > 0].min())
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _fit_exponent(sizes, values):
+    points = [(math.log(n), math.log(v)) for n, v in zip(sizes, values) if v and v > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def _environment(in_memory):
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.STDOUT,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        commit = commit.decode("ascii").strip()
+    except Exception:
+        commit = None
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": numpy_version,
+        "rhinoscriptsyntax": rs.__name__,
+        "in_memory": in_memory,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+if __name__ == "__main__":
+    main()
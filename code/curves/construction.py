@@ -3,7 +3,7 @@
 # 2015-11-24
 
 from math import pi, radians
-import rhinoscriptsyntax as rs
+from utils.rs_backend import rs
 
 
 # Some shortcuts for vector operations to improve code readability
@@ -49,4 +49,4 @@ def construct(lengths, angles):
     pass
 
 if __name__ == "__main__":
-    print decompose()
+    print(decompose())
@@ -3,7 +3,7 @@
 # 2015-11-24
 
 from math import pi, sin, tan, degrees
-import rhinoscriptsyntax as rs
+from utils.rs_backend import rs
 
 from utils import vector_utils as vu
 
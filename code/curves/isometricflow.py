@@ -3,7 +3,7 @@
 # 2015-11-24
 
 from math import radians, pi, sin, tan
-import rhinoscriptsyntax as rs
+from utils.rs_backend import rs
 
 
 # Some shortcuts for vector operations to improve code readability
@@ -74,7 +74,7 @@ def isometricflow(polyline=None, t=0.1):
     
 def iterate(flow_func, iterations, *args):
     pl_id = None
-    for i in xrange(iterations):
+    for i in range(iterations):
         pl_id = flow_func(pl_id, *args)
     return pl_id
 
@@ -3,7 +3,7 @@
 # 2015-09-09 
 
 from math import pi
-import rhinoscriptsyntax as rs
+from utils.rs_backend import rs
     
 def AddVector(vecdir, base_point=[0,0,0]):
     tip_point = rs.PointAdd(base_point, vecdir)
@@ -1,6 +1,6 @@
 from meshes import harmonic_flow, face_flow
-from utils import flow_utils
-import rhinoscriptsyntax as rs
+from utils import acceleration, flow_utils, mesh_io, mesh_utils, trajectory
+from utils.rs_backend import headless
 
 
 """ The entry point to be launched in Rhinoceros. """
@@ -15,16 +15,49 @@ if __name__ == '__main__':
     #   3. Load & run this python module
     #   4. Click on the shape loaded to the Rhinoceros editor
     #      to apply the corresponding transformation to it.
+    #
+    # Outside Rhinoceros (e.g. "python launcher.py"), rhinoscriptsyntax is replaced by
+    # the in-memory stand-in from utils/headless_rs.py. There is nothing to click there:
+    # the commands pick the shape created last, so the shape should be created here first.
+    if headless:
+        mesh_utils.add_cube()
 
     # ===== MESHES =====
 
     # --- Harmonic flow (a.k.a. Mean Curvature flow) ---
     #harmonic_flow.draw_motion_vectors(step=10)
     #flow_utils.iterate(harmonic_flow.flow, 100, step=0.03)
+    # Implicit (backward Euler) version: a few large, unconditionally stable steps.
+    #flow_utils.iterate(harmonic_flow.flow, 5, step=1.0, implicit=True)
+    # Until the vertices stop moving (by less than 1e-4 per step), adapting the step so that
+    # no vertex moves by more than 0.5 times the shortest edge in one step:
+    #flow_utils.iterate(harmonic_flow.flow, None, normalize=False, tolerance=1e-4, cfl=0.5)
+    # The same, converging to the limit shape (rescaled to the initial size) in fewer steps:
+    #flow_utils.iterate(acceleration.AndersonAcceleration(harmonic_flow.flow, scale=True), None,
+    #                   normalize=False, step=0.1, tolerance=1e-6, commit_every=50)
+    # A long run saving its state every 1000 iterations; run it again after a crash
+    # and it continues from the last checkpoint (the shape is added to the document again):
+    #flow_utils.iterate(harmonic_flow.flow, 100000, step=0.001, commit_every=1000,
+    #                   checkpoint="path/to/run.ckpt", checkpoint_every=1000, resume=True)
 
     # ---               Face flow                    ---
     #face_flow.draw_motion_vectors(step=10)
     flow_utils.iterate(face_flow.flow, 100, step=0.03)
+    # The same run, keeping the mesh in memory and updating the Rhino object every 10 steps:
+    #flow_utils.iterate(face_flow.flow, 100, step=0.03, commit_every=10)
+    # The same 100 iterations computed at once in closed form:
+    #face_flow.flow_iterations(step=0.03, iterations=100)
+    # Mesh files (binary/ASCII PLY and STL, OBJ) can be processed without the document:
+    #mesh_io.flow_file(face_flow.flow, 100, "path/to/mesh.ply", "path/to/result.ply", step=0.03)
+    # Timing of each phase of the flow (a summary table is printed at the end), written as
+    # a trace that can be opened in chrome://tracing or https://ui.perfetto.dev:
+    #flow_utils.iterate(face_flow.flow, 100, step=0.03, profile="path/to/trace.json")
+    # The rhinoscriptsyntax calls made by the flow, ranked by their time per call site:
+    #flow_utils.iterate(face_flow.flow, 100, step=0.03, trace_rs=True)
+    # The shape after every iteration, recorded to a file; e.g. iteration 50 can then be added
+    # to the document with mesh_utils.add_mesh(t.frame(50), t.face_offsets, t.face_indices),
+    # where t = trajectory.Trajectory("path/to/flow.traj"):
+    #flow_utils.iterate(face_flow.flow, 100, step=0.03, trajectory="path/to/flow.traj")
 
 
     # To record the flow animation into a gif file, just provide the path to the file
@@ -33,3 +66,6 @@ if __name__ == '__main__':
     # If the Pillow package is missing, this code will not fail but no GIF file will be produced.
     #flow_utils.iterate(face_flow.flow, 100, step=0.03,
     #                   gif_path="path/to/your/animation.gif")
+    # The same, encoding the frames while the flow runs (the gif is ready right after it):
+    #flow_utils.iterate(face_flow.flow, 100, step=0.03,
+    #                   gif_path="path/to/your/animation.gif", gif_pipeline=True)
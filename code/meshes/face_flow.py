@@ -1,62 +1,199 @@
-import rhinoscriptsyntax as rs
+from utils.rs_backend import rs
 from utils import vector_utils as vu
 from utils import mesh_utils as mu
 from utils import math_utils as maths
+from utils import halfedge_mesh as hem
+from utils import planes
+from utils import profiling
+from utils.halfedge_mesh import HalfEdgeMesh
+from utils.mesh_snapshot import MeshSnapshot
 
 """ Face Flow (3D analog of the Edge Flow for curves) """
     
 
-def flow(mesh_id=None, step=1):
+def flow(mesh_id=None, step=1, topology_cache=None, commit=True, max_residual=None):
     """Performs one step of the face flow of the given mesh,
-    replacing that mesh with a new one.
+    replacing that mesh with a new one. If a TopologyCache is given,
+    the mesh connectivity is looked up there instead of being rebuilt.
+    If commit is False, the Rhino document is not modified and the updated
+    MeshSnapshot is returned instead of a new mesh id (see harmonic_flow.flow()).
+    With NumPy, the vertices whose shifted planes do not meet in a point (e.g. those with
+    more than three faces) get the least-squares points, and the per-vertex residuals
+    are kept in the 'residuals' attribute of the snapshot (see get_new_vertices()).
+    If max_residual is given, an exception is raised instead when a residual exceeds
+    max_residual times the size (the bounding box diagonal) of the mesh.
     """
     # If mesh_id is None, then get the mesh from the user.
     # Check that all its faces are correctly set up.
-    mesh_id = mu.get_and_check_mesh(mesh_id)
-    
-    # Various precomputations (including motion vectors for each face)
-    normals = get_motion_vectors(mesh_id, step)
-    adj_faces = adjacent_faces(mesh_id)
-    n = len(rs.MeshVertices(mesh_id))
-    face_planes = mu.get_face_planes(mesh_id)
-    
-    # Shift all the planes by their normal vectors.
-    # NOTE(mikhaildubov): This computation relies on the fact that normals are
-    #                     listed in the same order as the corresponding faces.
-    face_planes_translated = [translate_plane(face_planes[i], normals[i])
-                              for i in xrange(len(face_planes))]
-
-    # Calculate the intersections of the shifted planes.
-    # Those are going to be the vertices of the updated mesh.
-    new_vertices = []
-    for i in xrange(n):
-        adj_planes = [face_planes_translated[j] for j in adj_faces[i]]
-        adj_planes_eq = [rs.PlaneEquation(plane) for plane in adj_planes]
-        intersection_point = planes_intersection(adj_planes_eq)
-        new_vertices.append(intersection_point)
+    # The snapshot is the only place where the mesh geometry is fetched from Rhino.
+    snapshot = mu.get_and_check_snapshot(mesh_id, topology_cache=topology_cache)
+
+    if hem.available():
+        # Everything is computed on the arrays of the snapshot.
+        mesh = snapshot.mesh
+        with profiling.span("motion vectors"):
+            motion_vectors = get_motion_vectors(mesh, step)
+        new_vertices, residuals = get_new_vertices(mesh, motion_vectors)
+        if max_residual is not None and len(residuals):
+            worst = int(residuals.argmax())
+            size = hem.np.sqrt(((mesh.vertices.max(axis=0) - mesh.vertices.min(axis=0)) ** 2).sum())
+            if residuals[worst] > max_residual * size:
+                raise Exception("The motion of planes is incompatible (vertex %d is %g away from "
+                                "its shifted planes)" % (worst, residuals[worst]))
+    else:
+        residuals = None
+        # Various precomputations (including motion vectors for each face)
+        # NOTE: The face planes are fitted once in the snapshot (during the check)
+        #       and then reused here and in adjacent_faces().
+        with profiling.span("motion vectors"):
+            normals = get_motion_vectors(snapshot, step)
+        with profiling.span("adjacency"):
+            adj_faces = adjacent_faces(snapshot)
+        n = snapshot.vertex_count
+        face_planes = mu.get_face_planes(snapshot)
+
+        with profiling.span("plane solve"):
+            # Shift all the planes by their normal vectors.
+            # NOTE(mikhaildubov): This computation relies on the fact that normals are
+            #                     listed in the same order as the corresponding faces.
+            face_planes_translated = [translate_plane(face_planes[i], normals[i])
+                                      for i in range(len(face_planes))]
+
+            # Calculate the intersections of the shifted planes.
+            # Those are going to be the vertices of the updated mesh.
+            new_vertices = []
+            for i in range(n):
+                adj_planes = [face_planes_translated[j] for j in adj_faces[i]]
+                adj_planes_eq = [rs.PlaneEquation(plane) for plane in adj_planes]
+                intersection_point = planes_intersection(adj_planes_eq)
+                new_vertices.append(intersection_point)
 
     # Update the mesh
-    new_mesh_id = rs.AddMesh(new_vertices, rs.MeshFaceVertices(mesh_id))
-    rs.DeleteObject(mesh_id)
+    new_mesh = mu.update_mesh(snapshot, new_vertices, commit)
+    if not commit:
+        # The snapshot with the new vertices also gets their residuals.
+        new_mesh.residuals = residuals
+    return new_mesh
+
+
+def get_new_vertices(mesh, motion_vectors):
+    """Computes the vertices of a HalfEdgeMesh after one face flow step, i.e. the
+    intersections of the face planes shifted by the given motion vectors, for all
+    the vertices at once (see planes.intersect_planes()).
+    Returns a pair (new_vertices, residuals) of NumPy arrays, residuals[i] measuring
+    how far new_vertices[i] is from lying on all the shifted planes adjacent to it
+    (it may be non-zero for vertices with more than three adjacent planes).
+    """
+    np = hem.np
+    normals, offsets = planes.face_planes(mesh)
+    # The plane n . x + d = 0 shifted by the vector v is n . x + (d - n . v) = 0.
+    shifted_offsets = offsets - np.einsum("ij,ij->i", normals, np.asarray(motion_vectors))
+    with profiling.span("adjacency"):
+        adj_offsets, adj_indices = adjacent_faces_csr(mesh, normals, offsets)
+    with profiling.span("plane solve"):
+        return planes.intersect_planes(np.column_stack([normals, shifted_offsets]),
+                                       adj_offsets, adj_indices, reference=mesh.vertices)
+
+
+def flow_iterations(mesh_id=None, step=1, iterations=1):
+    """Replaces the given mesh with the result of the given number of face flow steps,
+    computed in closed form (requires NumPy).
+
+    As every face plane moves along its own fixed normal, the system of plane
+    equations of each vertex keeps the same matrix from one step to the next, and only
+    the right-hand side changes (linearly in the total offset k * step). So the vertex
+    positions after k steps are x_i(k) = origins[i] + k * velocities[i], where both
+    arrays are computed once (see vertex_trajectories()).
+    Raises an exception if some face collapses before the last iteration.
+    """
+    snapshot = mu.get_and_check_snapshot(mesh_id)
+    mesh = snapshot.mesh
+    origins, velocities = vertex_trajectories(mesh, step)
+    collapses = collapse_iterations(mesh, origins, velocities)
+    first_collapse = collapses.min() if len(collapses) else hem.np.inf
+    if first_collapse <= iterations:
+        raise Exception("Face %d collapses at iteration %d" %
+                        (collapses.argmin(), first_collapse))
+    new_vertices = origins + iterations * velocities
+    new_mesh_id = rs.AddMesh(new_vertices.tolist(), mesh.face_vertex_lists())
+    rs.DeleteObject(snapshot.mesh_id)
     return new_mesh_id
 
 
+def vertex_trajectories(mesh, step):
+    """Returns a pair of (n, 3) arrays (origins, velocities) such that the vertices
+    of the mesh after k face flow steps are origins + k * velocities.
+    """
+    normals, offsets = planes.face_planes(mesh)
+    adj_offsets, adj_indices = adjacent_faces_csr(mesh, normals, offsets)
+    equations = hem.np.column_stack([normals, offsets])
+    origins, _ = planes.intersect_planes(equations, adj_offsets, adj_indices, mesh.vertices)
+    # Moving the plane n . x + d = 0 by -step * n turns it into n . x + (d + step) = 0.
+    equations[:, 3] += step
+    shifted, _ = planes.intersect_planes(equations, adj_offsets, adj_indices, mesh.vertices)
+    return origins, shifted - origins
+
+
+def collapse_iterations(mesh, origins, velocities):
+    """Returns, for each face, the first face flow iteration at which the face
+    degenerates (its signed area along the original normal drops to zero),
+    given the vertex trajectories origins + k * velocities. Faces which never
+    collapse get infinity.
+    """
+    np = hem.np
+    normals, _ = planes.face_planes(mesh)
+    a, b = origins[mesh.face_indices], velocities[mesh.face_indices]
+    targets = mesh.he_target()
+    a_next, b_next = origins[targets], velocities[targets]
+    n = normals[mesh.he_face]
+    # Twice the signed area: sum over the edges of (x_i(k) x x_j(k)) . n = c0 + c1 * k + c2 * k^2
+    c0 = planes.group_sum(np.einsum("ij,ij->i", np.cross(a, a_next), n), mesh.face_offsets)
+    c1 = planes.group_sum(np.einsum("ij,ij->i", np.cross(a, b_next) + np.cross(b, a_next), n),
+                          mesh.face_offsets)
+    c2 = planes.group_sum(np.einsum("ij,ij->i", np.cross(b, b_next), n), mesh.face_offsets)
+    return np.ceil(_first_positive_root(c0, c1, c2))
+
+
+def _first_positive_root(c0, c1, c2):
+    """Returns the smallest positive root of c0 + c1 * k + c2 * k^2 for each element
+    (infinity if there is none)."""
+    np = hem.np
+    roots = np.full(len(c0), np.inf)
+    scale = np.maximum(np.abs(c0), 1e-300)
+    linear = np.abs(c2) <= 1e-12 * scale
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.where(linear & (c1 != 0), -c0 / np.where(c1 != 0, c1, 1), np.inf)
+        roots = np.where(linear & (r > 0), r, roots)
+        discriminant = c1 ** 2 - 4 * c0 * c2
+        # Faces shrinking to a point (e.g. the faces of a cube) give a double root,
+        # so the discriminant may be slightly negative due to rounding errors.
+        touching = discriminant >= -1e-9 * (c1 ** 2 + np.abs(4 * c0 * c2))
+        sqrt_d = np.sqrt(np.maximum(discriminant, 0))
+        for sign in (-1, 1):
+            r = (-c1 + sign * sqrt_d) / np.where(linear, 1, 2 * c2)
+            valid = ~linear & touching & (r > 0)
+            roots = np.where(valid & (r < roots), r, roots)
+    return roots
+
+
 def get_motion_vectors(mesh_id, step):
     """Returns a list of motion vectors (for face flow, they are just normals)
     in the same order as the faces in the Rhino representation of the input mesh.
+    For a HalfEdgeMesh, returns an (f, 3) array instead.
     """
-    normals = rs.MeshFaceNormals(mesh_id)
-    for i in xrange(len(normals)):
-        normals[i] = vu.VectorResize(normals[i], -step)
-    return normals
+    if isinstance(mesh_id, HalfEdgeMesh):
+        normals, _ = planes.face_planes(mesh_id)
+        return -step * normals
+    normals = MeshSnapshot.of(mesh_id).face_normals
+    return [vu.VectorResize(normal, -step) for normal in normals]
 
 
 def draw_motion_vectors(mesh_id=None, step=1):
     """Draws the motion vectors for the face flow of the given mesh."""
-    mesh_id = mu.get_and_check_mesh(mesh_id)
-    normals = get_motion_vectors(mesh_id, step)
-    centers = rs.MeshFaceCenters(mesh_id)
-    for i in xrange(len(normals)):
+    snapshot = mu.get_and_check_snapshot(mesh_id)
+    normals = get_motion_vectors(snapshot, step)
+    centers = snapshot.face_centers
+    for i in range(len(normals)):
         vu.VectorDraw(normals[i], centers[i])
 
 
@@ -74,13 +211,17 @@ def adjacent_faces(mesh_id):
           [1]: [face_index_1, ...]
                ...
         ]
+    The mesh may be given as a Rhino object id, a MeshSnapshot or a HalfEdgeMesh.
     """
-    vertices = rs.MeshVertices(mesh_id)
-    face_vertices = rs.MeshFaceVertices(mesh_id)
-    adjacency_list = [[] for _ in xrange(len(vertices))]
-    face_planes = [rs.PlaneFitFromPoints(mu.get_face_points(mesh_id, face))
-                   for face in xrange(len(face_vertices))]
-    for next_face in xrange(len(face_vertices)):
+    if isinstance(mesh_id, HalfEdgeMesh):
+        offsets, indices = adjacent_faces_csr(mesh_id)
+        indices = indices.tolist()
+        return [indices[offsets[i]:offsets[i + 1]] for i in range(mesh_id.vertex_count)]
+    snapshot = MeshSnapshot.of(mesh_id)
+    face_vertices = snapshot.face_vertices
+    adjacency_list = [[] for _ in range(snapshot.vertex_count)]
+    face_planes = mu.get_face_planes(snapshot)
+    for next_face in range(len(face_vertices)):
         for vertex_index in face_vertices[next_face]:
             for face in adjacency_list[vertex_index]:
                 # NOTE(mikhaildubov): we have to check the face planes as well because
@@ -92,7 +233,37 @@ def adjacent_faces(mesh_id):
                 adjacency_list[vertex_index].append(next_face)
     return adjacency_list
 
-    
+
+def adjacent_faces_csr(mesh, normals=None, offsets=None, tolerance=1e-6):
+    """Array-based version of adjacent_faces() for a HalfEdgeMesh, running in
+    O(|F| log |F|) time. Returns (adj_offsets, adj_indices) in the CSR format: the
+    faces kept for vertex i are adj_indices[adj_offsets[i]:adj_offsets[i + 1]].
+
+    Instead of intersecting the face planes pairwise, all the faces are grouped by
+    their planes at once (see planes.coplanar_groups()), so that coplanar faces (e.g.
+    the two halves of a triangulated quad) get the same plane id; then only the first
+    face of each plane is kept for each vertex. The tolerance is relative to the size
+    of the mesh for the plane offsets.
+    """
+    np = hem.np
+    if normals is None:
+        normals, offsets = planes.face_planes(mesh)
+    size = np.sqrt(((mesh.vertices.max(axis=0) - mesh.vertices.min(axis=0)) ** 2).sum())
+    plane_ids = planes.coplanar_groups(normals, offsets, tolerance, tolerance * max(size, 1e-300))
+    vertices, faces = mesh.face_indices, mesh.he_face
+    # Sort the (vertex, plane, face) triples and keep the first face for each (vertex, plane).
+    order = np.lexsort((faces, plane_ids[faces], vertices))
+    vertices, faces = vertices[order], faces[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (vertices[1:] != vertices[:-1]) | (plane_ids[faces][1:] != plane_ids[faces][:-1])
+    vertices, faces = vertices[first], faces[first]
+    # List the faces of each vertex in the increasing order, as adjacent_faces() does.
+    order = np.lexsort((faces, vertices))
+    adj_offsets = np.zeros(mesh.vertex_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(vertices, minlength=mesh.vertex_count), out=adj_offsets[1:])
+    return adj_offsets, faces[order]
+
+
 def planes_intersection(plane_eqs):
     """Computes the intersection point for n >= 3 planes."""
 
@@ -1,45 +1,95 @@
-import rhinoscriptsyntax as rs
+from utils.rs_backend import rs
 
 from utils.math_utils import cotan
 from utils import mesh_utils as mu
 from utils import vector_utils as vu
+from utils import halfedge_mesh as hem
+from utils import laplacian
+from utils import profiling
+from utils.halfedge_mesh import HalfEdgeMesh
+from utils.mesh_snapshot import MeshSnapshot
+from utils.topology_cache import faces_key
 
 """ Harmonic Flow a.k.a. Mean Curvature Flow (MCF) """
 
 
-def flow(mesh_id=None, step=1):
+def flow(mesh_id=None, step=1, weights="uniform", implicit=False, preconditioner="jacobi",
+         topology_cache=None, commit=True, normalize=True):
     """Performs one step of the harmonic flow of the given mesh,
-    replacing that mesh with a new one.
+    replacing that mesh with a new one. The Laplacian weights may be either
+    "uniform" or "cotan" (the latter requires NumPy and SciPy).
+
+    By default, every vertex moves by exactly 'step' along its Laplacian vector.
+    If normalize is False, the vertices move by step times their Laplacian vectors
+    instead (an explicit Euler step), so the motion slows down as the mesh gets smooth
+    and the flow can be run to convergence (see convergence.Controller).
+
+    If implicit is True, performs a backward Euler step of time 'step' instead
+    (requires NumPy and SciPy). With uniform weights, the system
+    (I - step * L) * X_new = X is factorized once per topology and reused by the
+    subsequent steps, so large steps can be taken safely. With cotangent weights,
+    this is a true mean curvature flow step (M - step * L) * X_new = M * X, solved
+    by the conjugate gradient method with the given preconditioner ("jacobi" or "ilu"),
+    warm-started from the current positions.
+
+    If a TopologyCache is given, the connectivity-derived structures (adjacency,
+    Laplacians, factorizations) are looked up there instead of being rebuilt.
+
+    If commit is False, the Rhino document is not modified: the flow returns the
+    updated MeshSnapshot instead of a new mesh id, and the next step can be performed
+    on it directly, in memory (see flow_utils.iterate()).
     """
     # TODO(mikhaildubov): This flow results in a degenerate case at the poles of sphere134.3dm.
     #                     Fix this by making it a true MCF (i.e. by using the angles).
+    #                     The implicit mode with weights="cotan" is such a true MCF
+    #                     (non-triangular faces are fan-triangulated for it).
     
     # If mesh_id is None, then get the mesh from the user.
     # Check that all its faces are correctly set up.
-    mesh_id = mu.get_and_check_mesh(mesh_id)
-    
-    # Various precomputations (including motion vectors for each vertex)
-    v = rs.MeshVertices(mesh_id)
-    n = len(v)
-    harmonic_vectors = get_motion_vectors(mesh_id, step)
-    
-    # Move each vertex by its motion vector
-    new_vertices = []
-    for i in xrange(n):
-        new_vertices.append(rs.PointAdd(v[i], harmonic_vectors[i]))
+    # The snapshot is the only place where the mesh geometry is fetched from Rhino.
+    snapshot = mu.get_and_check_snapshot(mesh_id, topology_cache=topology_cache)
+
+    if implicit:
+        if not laplacian.available():
+            raise Exception("The implicit harmonic flow requires NumPy and SciPy.")
+        mesh = snapshot.mesh
+        with profiling.span("linear solve"):
+            if weights == "uniform":
+                new_vertices = laplacian.implicit_uniform_step(mesh, step)
+            elif weights == "cotan":
+                new_vertices, _ = laplacian.mean_curvature_step(mesh, step, preconditioner)
+            else:
+                raise Exception("Unknown Laplacian weights: %s" % weights)
+    elif hem.available():
+        # Everything is computed on the arrays of the snapshot.
+        mesh = snapshot.mesh
+        with profiling.span("motion vectors"):
+            harmonic_vectors = get_motion_vectors(mesh, step, weights, normalize=normalize)
+        new_vertices = mesh.vertices + harmonic_vectors
+    else:
+        # Various precomputations (including motion vectors for each vertex)
+        v = snapshot.vertices
+        n = len(v)
+        with profiling.span("motion vectors"):
+            harmonic_vectors = get_motion_vectors(snapshot, step, weights, topology_cache, normalize)
+
+        # Move each vertex by its motion vector
+        new_vertices = []
+        for i in range(n):
+            new_vertices.append(rs.PointAdd(v[i], harmonic_vectors[i]))
 
     # Update the mesh
-    new_mesh_id = rs.AddMesh(new_vertices, rs.MeshFaceVertices(mesh_id))
-    rs.DeleteObject(mesh_id)
-    return new_mesh_id
+    return mu.update_mesh(snapshot, new_vertices, commit)
 
 
 def adjacency_list(mesh_id):
     """Builds an adjacency list of the mesh, taking O(|V|+|E|) space."""
-    n = rs.MeshVertexCount(mesh_id)
-    adj = [set() for _ in xrange(n)]
-    for face in rs.MeshFaceVertices(mesh_id):
-        for i in xrange(len(face)):
+    if isinstance(mesh_id, HalfEdgeMesh):
+        return [set(mesh_id.neighbors(i).tolist()) for i in range(mesh_id.vertex_count)]
+    snapshot = MeshSnapshot.of(mesh_id)
+    adj = [set() for _ in range(snapshot.vertex_count)]
+    for face in snapshot.face_vertices:
+        for i in range(len(face)):
             a = face[i]
             b = face[(i + 1) % len(face)]
             # NOTE: Rhinoceros occasionally has duplicate vertices in face representations,
@@ -52,18 +102,28 @@ def adjacency_list(mesh_id):
 
 def vertex_face_index(mesh_id):
     """Returns an auxiliary index containing sets of adjacent faces for each vertex."""
-    n = rs.MeshVertexCount(mesh_id)
-    adj = [set() for _ in xrange(n)]
-    for face_index, face_vertices in enumerate(rs.MeshFaceVertices(mesh_id)):
+    if isinstance(mesh_id, HalfEdgeMesh):
+        return [set(mesh_id.vertex_faces(i).tolist()) for i in range(mesh_id.vertex_count)]
+    snapshot = MeshSnapshot.of(mesh_id)
+    adj = [set() for _ in range(snapshot.vertex_count)]
+    for face_index, face_vertices in enumerate(snapshot.face_vertices):
         for vertex_index in face_vertices:
             adj[vertex_index].add(face_index)
     return adj
 
 
-def get_adjacent_vertices_in_order(mesh_id, adj_list, vertex_face_ind, i):
+def get_adjacent_vertices_in_order(mesh_id, adj_list, vertex_face_ind, i, face_vertices=None):
+    """Returns the vertices adjacent to vertex i in cyclic order. For a HalfEdgeMesh,
+    this is just a lookup in its precomputed one-rings (see HalfEdgeMesh.one_rings()).
+    Otherwise, face_vertices (as returned from rs.MeshFaceVertices()) may be passed
+    to avoid refetching them on each call.
+    """
+    if isinstance(mesh_id, HalfEdgeMesh):
+        return mesh_id.one_ring(i)[0].tolist()
     adj_vertices = adj_list[i].copy()
     adj_vertices_in_order = [adj_vertices.pop()]
-    face_vertices = rs.MeshFaceVertices(mesh_id)
+    if face_vertices is None:
+        face_vertices = MeshSnapshot.of(mesh_id).face_vertices
 
     def get_next_vertex(last_vertex):
         for adj_face in vertex_face_ind[last_vertex]:
@@ -84,23 +144,54 @@ def get_adjacent_vertices_in_order(mesh_id, adj_list, vertex_face_ind, i):
     return adj_vertices_in_order
 
 
-def get_motion_vectors(mesh_id, step):
+def ordered_one_rings(mesh_id, topology_cache=None):
+    """Returns the list of adjacent vertices in order for each vertex of the mesh.
+    If a TopologyCache is given, the result is computed only once per topology.
+    """
+    if isinstance(mesh_id, HalfEdgeMesh):
+        ring_offsets, ring_vertices, _ = mesh_id.one_rings()
+        ring_vertices = ring_vertices.tolist()
+        return [ring_vertices[ring_offsets[i]:ring_offsets[i + 1]]
+                for i in range(mesh_id.vertex_count)]
+
+    snapshot = MeshSnapshot.of(mesh_id)
+
+    def build():
+        adj_list = adjacency_list(snapshot)
+        vertex_face_ind = vertex_face_index(snapshot)
+        return [get_adjacent_vertices_in_order(snapshot, adj_list, vertex_face_ind, i,
+                                               snapshot.face_vertices)
+                for i in range(len(adj_list))]
+    if topology_cache is None:
+        return build()
+    key = faces_key(snapshot.vertex_count, snapshot.face_vertices)
+    return topology_cache.get(key, "ordered_one_rings", build)
+
+
+def get_motion_vectors(mesh_id, step, weights="uniform", topology_cache=None, normalize=True):
     """Returns a list of motion vectors in the same order as the vertices in the
     Rhino representation of the input mesh. Uses adjacency list instead of adjacency
     matrix, thus improving the running time from O(|V|^2) to O(|V|+|E|).
+    The mesh may be given as a Rhino object id, a MeshSnapshot or a HalfEdgeMesh.
+    The vectors have the length 'step', or if normalize is False, they are the
+    Laplacian vectors multiplied by 'step'.
     """
-    adj_list = adjacency_list(mesh_id)
-    vertex_face_ind = vertex_face_index(mesh_id)
-    v = rs.MeshVertices(mesh_id)
+    if isinstance(mesh_id, HalfEdgeMesh):
+        return _get_motion_vectors_array(mesh_id, step, weights, normalize)
+    if weights != "uniform":
+        raise Exception("Only uniform weights are supported without NumPy and SciPy.")
+    snapshot = MeshSnapshot.of(mesh_id)
+    one_rings = ordered_one_rings(snapshot, topology_cache)
+    v = snapshot.vertices
     n = len(v)
     harmonic_vectors = []
-    for i in xrange(n):
+    for i in range(n):
         p = v[i]
         # Initialize the harmonic vector as a zero vector
         harmonic_vector = rs.VectorCreate([0, 0, 0], [0, 0, 0])
         # Sum up all the vectors pointing to adjacent vertices
-        adj = get_adjacent_vertices_in_order(mesh_id, adj_list, vertex_face_ind, i)
-        for j in xrange(len(adj)):
+        adj = one_rings[i]
+        for j in range(len(adj)):
             # q_j vertices
             q_prev = v[adj[(j - 1) % len(adj)]]
             q_curr = v[adj[j]]
@@ -121,18 +212,46 @@ def get_motion_vectors(mesh_id, step):
             harmonic_coeff = 1 #(cotan(alpha) + cotan(beta)) / 2
             harmonic_vector = rs.VectorScale(rs.VectorAdd(harmonic_vector, pq), harmonic_coeff)
         # Rescale
-        # TODO(mikhaildubov): use this for true MCF:
-        #harmonic_vector = rs.VectorScale(harmonic_vector, step)
-        harmonic_vector = vu.VectorResize(harmonic_vector, step)
+        if normalize:
+            harmonic_vector = vu.VectorResize(harmonic_vector, step)
+        else:
+            harmonic_vector = rs.VectorScale(harmonic_vector, step)
         harmonic_vectors.append(harmonic_vector)
     return harmonic_vectors
 
 
-def draw_motion_vectors(mesh_id=None, step=1):
+def _get_motion_vectors_array(mesh, step, weights, normalize=True):
+    """Array-based version of get_motion_vectors() for a HalfEdgeMesh.
+    Returns an (n, 3) array of motion vectors.
+    """
+    if laplacian.available():
+        # One sparse matrix-vector product with the Laplacian assembled once per mesh.
+        return laplacian.motion_vectors(mesh, step, weights, normalize)
+    if weights != "uniform":
+        raise Exception("Cotangent weights require SciPy.")
+    # Without SciPy, sum up the vectors pointing to adjacent vertices directly
+    # on the CSR adjacency arrays (this is the same uniform Laplacian).
+    np = hem.np
+    v = mesh.vertices
+    degrees = np.diff(mesh.vv_offsets)
+    sums = np.zeros_like(v)
+    has_neighbors = degrees > 0
+    sums[has_neighbors] = np.add.reduceat(v[mesh.vv_indices], mesh.vv_offsets[:-1][has_neighbors])
+    harmonic_vectors = sums - degrees[:, None] * v
+    if not normalize:
+        return step * harmonic_vectors
+    lengths = np.sqrt((harmonic_vectors ** 2).sum(axis=1))
+    return harmonic_vectors * (step / np.where(lengths > 0, lengths, 1))[:, None]
+
+
+def draw_motion_vectors(mesh_id=None, step=1, weights="uniform"):
     """Draws the motion vectors for the harmonic flow of the given mesh."""
-    mesh_id = mu.get_and_check_mesh(mesh_id)
-    harmonic_vectors = get_motion_vectors(mesh_id, step)
-    v = rs.MeshVertices(mesh_id)
+    snapshot = mu.get_and_check_snapshot(mesh_id)
+    if hem.available():
+        harmonic_vectors = get_motion_vectors(snapshot.mesh, step, weights).tolist()
+    else:
+        harmonic_vectors = get_motion_vectors(snapshot, step, weights)
+    v = snapshot.vertices
     n = len(v)
-    for i in xrange(n):
+    for i in range(n):
         vu.VectorDraw(harmonic_vectors[i], v[i])
@@ -0,0 +1,197 @@
+from utils.rs_backend import rs
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils import convergence
+from utils import mesh_utils as mu
+from utils import mesh_validation
+from utils.mesh_snapshot import MeshSnapshot
+
+""" Anderson acceleration of the flows converging to a limit shape (requires NumPy). """
+
+
+def available():
+    """Returns True if NumPy is available."""
+    return np is not None
+
+
+class AndersonAcceleration(object):
+    """Wraps a flow function (e.g. face_flow.flow), taking and returning a shape the same
+    way, so that it can be passed to flow_utils.iterate() instead of the flow:
+
+        flow_utils.iterate(AndersonAcceleration(harmonic_flow.flow, scale=True), None,
+                           normalize=False, step=0.1, tolerance=1e-6, commit_every=50)
+
+    A flow step is a fixed-point map x -> G(x) of the vertex positions. Instead of
+    moving to G(x_k), each call moves to the Anderson mixing x_k+1 = G(x_k) - dG * gamma,
+    where dG and dF hold the differences of the last 'depth' values of G and of the
+    residuals f = G(x) - x, and gamma minimizes |f_k - dF * gamma|; with damping b < 1,
+    x_k+1 = x_k + b * f_k - (dX + b * dF) * gamma instead.
+
+    As the mixing is only an extrapolation, it is safeguarded: if the residual grows to
+    more than 'safeguard' times the residual of the previous call, the history is cleared
+    (restart) and the plain step G(x_k) is taken. (The residuals of the mixed iterates are
+    not monotone, so they are not compared with the smallest one, which would restart
+    after almost every step.) The plain step is also taken, keeping the history, if the
+    mixed iterate would degenerate a face of a mesh (or an edge of a polyline), or move
+    the shape farther than max_extrapolation times the plain step would. Columns are
+    dropped from the history while the least squares problem has a condition number
+    above max_condition, and the history is also cleared every 'restart' calls if that
+    is given. 'depth' should be at least 1.
+
+    Most flows shrink the shape (to a point, in the limit). With scale=True, G(x) is
+    rescaled about its centroid to the centroid and the size (root mean square distance
+    from the centroid) of the initial shape, so the iterations converge to the limit
+    shape instead. The flow should be run with a fixed step, as the mixing assumes
+    the same map G on every call.
+
+    'residuals' holds the norms of the residuals f_k (the distances between the shapes
+    before and after the flow step), 'restarts' the number of times the history was cleared
+    and 'rejected' the number of mixed iterates replaced by the plain step.
+    """
+
+    def __init__(self, flow_func, depth=5, damping=1.0, scale=False, safeguard=2.0,
+                 max_extrapolation=100.0, restart=None, max_condition=1e10):
+        if depth < 1:
+            raise Exception("The depth of the Anderson acceleration should be at least 1.")
+        self.__wrapped__ = flow_func
+        self.__name__ = getattr(flow_func, "__name__", "flow")
+        self.depth = depth
+        self.damping = damping
+        self.scale = scale
+        self.safeguard = safeguard
+        self.max_extrapolation = max_extrapolation
+        self.restart = restart
+        self.max_condition = max_condition
+        self.residuals = []
+        self.restarts = 0
+        self.rejected = 0
+        self._reference = None
+        self._previous = None
+        self._delta_x = []
+        self._delta_f = []
+
+    def __call__(self, shape=None, *args, **kwargs):
+        shape = shape or rs.GetObject("Select a curve or a mesh", rs.filter.curve | rs.filter.mesh,
+                                      True, True)
+        x = np.array(convergence.shape_vertices(shape), dtype=float)
+        if self._reference is None:
+            center = x.mean(axis=0)
+            self._reference = (center, _size(x, center))
+        shape = self.__wrapped__(shape, *args, **kwargs)
+        g = np.asarray(convergence.shape_vertices(shape), dtype=float)
+        if self.scale:
+            g = self._rescale(g)
+        f = g - x
+        self.residuals.append(float(np.sqrt((f ** 2).sum())))
+        return _set_vertices(shape, self._mix(x, f, g, shape))
+
+    def summary(self):
+        """Returns a one-line report of the acceleration."""
+        return "Anderson acceleration: %d steps, %d restarts, %d rejected, last residual %g" % (
+            len(self.residuals), self.restarts, self.rejected, self.residuals[-1] if self.residuals else 0)
+
+    def get_state(self):
+        """Returns the state of the acceleration, for a checkpoint (see utils/checkpoint.py):
+        a JSON-serializable dictionary and a dictionary of arrays.
+        """
+        state = {"restarts": self.restarts, "rejected": self.rejected, "size": None}
+        arrays = {"residuals": self.residuals}
+        if self._reference is not None:
+            arrays["center"], state["size"] = self._reference
+        if self._previous is not None:
+            arrays["previous_x"], arrays["previous_f"] = self._previous
+        if self._delta_f:
+            arrays["delta_x"], arrays["delta_f"] = np.array(self._delta_x), np.array(self._delta_f)
+        return state, arrays
+
+    def set_state(self, state, arrays):
+        """Restores the state saved by get_state()."""
+        self.residuals = [float(residual) for residual in arrays["residuals"]]
+        self.restarts = state["restarts"]
+        self.rejected = state["rejected"]
+        self._reference = (arrays["center"], state["size"]) if "center" in arrays else None
+        self._previous = (arrays["previous_x"], arrays["previous_f"]) if "previous_x" in arrays else None
+        self._delta_x = list(arrays.get("delta_x", []))
+        self._delta_f = list(arrays.get("delta_f", []))
+
+    def _mix(self, x, f, g, shape):
+        """Returns the next iterate, given the current one, its residual, G(x) and the
+        shape returned by the flow."""
+        residual = self.residuals[-1]
+        if self._previous is not None:
+            previous_x, previous_f = self._previous
+            if (residual > self.safeguard * self.residuals[-2] or
+                    (self.restart and len(self.residuals) % self.restart == 0)):
+                self._clear()
+            else:
+                self._delta_x.append((x - previous_x).ravel())
+                self._delta_f.append((f - previous_f).ravel())
+                del self._delta_x[:-self.depth]
+                del self._delta_f[:-self.depth]
+        self._previous = (x, f)
+        plain = x + self.damping * f
+        if not self._delta_f:
+            return plain
+
+        while self._delta_f:
+            delta_f = np.column_stack(self._delta_f)
+            singular_values = np.linalg.svd(delta_f, compute_uv=False)
+            if singular_values[-1] * self.max_condition > singular_values[0]:
+                break
+            # Ill-conditioned: drop the oldest column.
+            del self._delta_x[0]
+            del self._delta_f[0]
+        if not self._delta_f:
+            return plain
+        gamma = np.linalg.lstsq(delta_f, f.ravel(), rcond=None)[0]
+        delta_x = np.column_stack(self._delta_x)
+        correction = (delta_x + self.damping * delta_f).dot(gamma).reshape(x.shape)
+        mixed = plain - correction
+        if (not np.isfinite(correction).all() or
+                np.sqrt((correction ** 2).sum()) > self.max_extrapolation * self.damping * residual or
+                _degenerate(shape, mixed)):
+            self.rejected += 1
+            return plain
+        return mixed
+
+    def _clear(self):
+        self.restarts += 1
+        self._delta_x = []
+        self._delta_f = []
+
+    def _rescale(self, vertices):
+        center, size = self._reference
+        own_center = vertices.mean(axis=0)
+        own_size = _size(vertices, own_center)
+        if own_size == 0:
+            raise Exception("The shape has collapsed to a point.")
+        return center + (vertices - own_center) * (size / own_size)
+
+
+def _size(vertices, center):
+    return float(np.sqrt(((vertices - center) ** 2).sum(axis=1).mean()))
+
+
+def _degenerate(shape, vertices):
+    """Checks whether the vertices would degenerate a face of the shape (a MeshSnapshot,
+    a mesh id or a polyline id): a face without a plane, or a polyline edge of zero length."""
+    if isinstance(shape, MeshSnapshot) or rs.IsMesh(shape):
+        mesh = MeshSnapshot.of(shape).mesh.with_vertices(vertices)
+        return bool(mesh_validation.validate(mesh).degenerate.any())
+    lengths = np.sqrt((np.diff(vertices, axis=0) ** 2).sum(axis=1))
+    return bool((lengths <= 1e-12 * lengths.max()).any()) if len(lengths) else False
+
+
+def _set_vertices(shape, vertices):
+    """Moves the vertices of the shape (a MeshSnapshot, a mesh id or a polyline id)
+    and returns the shape (its new id for a mesh in the document)."""
+    if isinstance(shape, MeshSnapshot):
+        shape.set_vertices(vertices)
+        return shape
+    if rs.IsMesh(shape):
+        return mu.update_mesh(MeshSnapshot(shape), vertices)
+    return rs.AddPolyline(vertices.tolist(), shape)
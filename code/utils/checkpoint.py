@@ -0,0 +1,295 @@
+import json
+import os
+import struct
+import sys
+import threading
+from array import array
+from utils.rs_backend import rs
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils import convergence
+from utils.halfedge_mesh import HalfEdgeMesh
+from utils.mesh_snapshot import MeshSnapshot
+
+""" Checkpoints of long flow runs, to resume them after a crash (see flow_utils.iterate()).
+
+A checkpoint file holds, after the magic bytes and the length of the header, a JSON header
+(the flow and its JSON-serializable arguments, the number of iterations done, the state of the step controller
+and of the flow wrapper, the kind of the shape and the list of the arrays) followed by
+the arrays themselves as raw little-endian doubles and 32-bit integers: the vertex positions, the faces of a mesh
+(face_offsets, face_indices, as in HalfEdgeMesh) and the arrays of the states.
+The files are written to a temporary file first and then renamed, so a checkpoint is
+either complete or absent, never half-written.
+"""
+
+
+MAGIC = b"FLOWCKPT"
+VERSION = 1
+
+# Array type codes: array module code, NumPy dtype (little-endian), item size
+_TYPES = {"d": ("d", "<f8", 8), "i": ("i", "<i4", 4)}
+
+
+class Checkpoint(object):
+    """The state of a flow run: 'header' (a JSON-serializable dictionary) and 'arrays'
+    (name -> list or NumPy array of doubles or integers).
+    """
+
+    def __init__(self, header, arrays):
+        self.header = header
+        self.arrays = arrays
+
+    @property
+    def iteration(self):
+        """The number of iterations done."""
+        return self.header["iteration"]
+
+
+def capture(shape, iteration, flow, arguments, controller=None):
+    """Returns a Checkpoint of the shape (a mesh or polyline id, or a MeshSnapshot) after the
+    given number of iterations of the flow. The flow (or its wrapper, e.g. an
+    AndersonAcceleration) and the controller may save their state with a get_state() method
+    returning (header, arrays). The arrays are copied, so the shape may change afterwards.
+    """
+    vertices = convergence.shape_vertices(shape)
+    header = {"iteration": iteration, "flow": flow_name(flow), "arguments": arguments}
+    arrays = {"vertices": _copy(vertices)}
+    if isinstance(shape, MeshSnapshot) or rs.IsMesh(shape):
+        header["kind"] = "mesh"
+        arrays["face_offsets"], arrays["face_indices"] = _face_arrays(MeshSnapshot.of(shape))
+    else:
+        header["kind"] = "curve"
+    for name, owner in (("controller", controller), ("flow_state", flow)):
+        if owner is not None and hasattr(owner, "get_state"):
+            state, state_arrays = owner.get_state()
+            header[name] = state
+            for key, value in state_arrays.items():
+                arrays["%s.%s" % (name, key)] = _copy(value)
+    return Checkpoint(header, arrays)
+
+
+def restore(checkpoint, flow=None, controller=None, in_memory=False, topology_cache=None):
+    """Recreates the shape of the checkpoint and returns it: a detached MeshSnapshot
+    if in_memory is True, or else a new object in the document. The states of the flow
+    and of the controller are restored by their set_state(header, arrays) methods.
+    """
+    vertices = checkpoint.arrays["vertices"]
+    if checkpoint.header["kind"] == "mesh":
+        face_offsets, face_indices = checkpoint.arrays["face_offsets"], checkpoint.arrays["face_indices"]
+        if in_memory and np is not None:
+            mesh = HalfEdgeMesh(vertices, face_offsets, face_indices, topology_cache=topology_cache)
+            shape = MeshSnapshot(None, topology_cache, mesh)
+        else:
+            offsets, indices = _tolist(face_offsets), _tolist(face_indices)
+            shape = rs.AddMesh(_tolist(vertices), [indices[offsets[f]:offsets[f + 1]]
+                                                   for f in range(len(offsets) - 1)])
+            if in_memory:
+                shape = MeshSnapshot(shape, topology_cache)
+    else:
+        shape = rs.AddPolyline(_tolist(vertices))
+    for name, owner in (("controller", controller), ("flow_state", flow)):
+        if owner is not None and name in checkpoint.header:
+            prefix = name + "."
+            owner.set_state(checkpoint.header[name],
+                            dict((key[len(prefix):], value) for key, value in checkpoint.arrays.items()
+                                 if key.startswith(prefix)))
+    return shape
+
+
+def write(path, checkpoint):
+    """Writes the checkpoint to the given file atomically."""
+    names = sorted(checkpoint.arrays)
+    header = dict(checkpoint.header, version=VERSION, arrays=[])
+    blobs = []
+    for name in names:
+        values = checkpoint.arrays[name]
+        code = "d" if _is_float(values) else "i"
+        shape = list(values.shape) if hasattr(values, "shape") else _shape(values)
+        header["arrays"].append([name, code, shape])
+        blobs.append(_pack(values, code))
+    header_bytes = json.dumps(header, sort_keys=True).encode("utf-8")
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    _replace(temp_path, path)
+
+
+def read(path):
+    """Reads a checkpoint written by write()."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise Exception("Not a checkpoint file: %s" % path)
+        header_size, = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_size).decode("utf-8"))
+        if header.pop("version") != VERSION:
+            raise Exception("Unsupported checkpoint version: %s" % path)
+        arrays = {}
+        for name, code, shape in header.pop("arrays"):
+            count = 1
+            for size in shape:
+                count *= size
+            arrays[name] = _unpack(f.read(count * _TYPES[code][2]), code, shape)
+    return Checkpoint(header, arrays)
+
+
+def arguments(args, kwargs):
+    """Returns the arguments of a flow that can be saved in a checkpoint (and compared
+    with those of the run resuming from it): those that are JSON-serializable.
+    """
+    return json.loads(json.dumps({"args": [value for value in args if _serializable(value)],
+                                  "kwargs": dict((name, value) for name, value in kwargs.items()
+                                                 if _serializable(value))}))
+
+
+def flow_name(flow):
+    """Returns the name of the flow function, e.g. "meshes.face_flow.flow", prefixed by
+    the names of its wrappers, e.g. "AndersonAcceleration(meshes.face_flow.flow)".
+    """
+    if hasattr(flow, "__wrapped__"):
+        return "%s(%s)" % (type(flow).__name__, flow_name(flow.__wrapped__))
+    return "%s.%s" % (getattr(flow, "__module__", "?"), getattr(flow, "__name__", "?"))
+
+
+class Writer(object):
+    """Writes checkpoints in a background thread, so that the flow does not wait for the
+    disk. If the thread falls behind, only the latest checkpoint is written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.error = None
+        self._pending = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def save(self, checkpoint):
+        """Schedules the checkpoint to be written (replacing any pending one)."""
+        with self._condition:
+            self._pending = checkpoint
+            self._condition.notify()
+
+    def close(self):
+        """Writes the pending checkpoint, stops the thread and raises its error, if any."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                checkpoint, self._pending = self._pending, None
+                if checkpoint is None:
+                    return
+            try:
+                write(self.path, checkpoint)
+            except Exception as e:
+                self.error = e
+
+
+def _serializable(value):
+    try:
+        json.dumps(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _face_arrays(snapshot):
+    """Returns the faces of the snapshot as (face_offsets, face_indices), dropping the
+    repeated last vertex of Rhino triangles, like HalfEdgeMesh.from_faces() does."""
+    if np is not None:
+        mesh = snapshot.mesh
+        return mesh.face_offsets.copy(), mesh.face_indices.copy()
+    offsets, indices = [0], []
+    for face in snapshot.face_vertices:
+        for k, index in enumerate(face):
+            if k == 0 or index != face[k - 1]:
+                indices.append(index)
+        offsets.append(len(indices))
+    return offsets, indices
+
+
+def _is_float(values):
+    if hasattr(values, "dtype"):
+        return values.dtype.kind == "f"
+    return any(isinstance(value, float) for value in _flatten(values))
+
+
+def _shape(values):
+    if values and isinstance(values[0], (list, tuple)):
+        return [len(values), len(values[0])]
+    return [len(values)]
+
+
+def _copy(values):
+    if np is not None:
+        return np.array(values)
+    return [list(value) if isinstance(value, (list, tuple)) else value for value in values]
+
+
+def _flatten(values):
+    for value in values:
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                yield item
+        else:
+            yield value
+
+
+def _pack(values, code):
+    typecode, dtype, _ = _TYPES[code]
+    if np is not None:
+        return np.ascontiguousarray(values, dtype=dtype).tobytes()
+    data = array(typecode, _flatten(values))
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tostring() if sys.version_info[0] == 2 else data.tobytes()
+
+
+def _unpack(data, code, shape):
+    typecode, dtype, _ = _TYPES[code]
+    if np is not None:
+        return np.frombuffer(data, dtype=dtype).astype(float if code == "d" else np.int64).reshape(shape)
+    values = array(typecode)
+    if sys.version_info[0] == 2:
+        values.fromstring(data)
+    else:
+        values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    values = values.tolist()
+    if len(shape) == 2:
+        return [values[k:k + shape[1]] for k in range(0, len(values), shape[1])]
+    return values
+
+
+def _tolist(values):
+    return values.tolist() if hasattr(values, "tolist") else values
+
+
+def _replace(source, destination):
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+    else:
+        # Python 2: os.rename() does not overwrite an existing file on Windows.
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
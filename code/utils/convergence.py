@@ -0,0 +1,213 @@
+import math
+from utils.rs_backend import rs
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils import planes
+from utils.mesh_snapshot import MeshSnapshot
+
+""" Adaptive step sizes and convergence-based stopping of the flows (see flow_utils.iterate()). """
+
+
+class Controller(object):
+    """Chooses the step of each iteration of a flow and decides when to stop it.
+
+    If 'cfl' is given, the step is adapted so that no vertex moves by more than cfl times
+    the shortest edge of the shape in one iteration (a CFL-like stability condition).
+    The speed of the vertices (displacement per unit step) is measured on the previous
+    iteration, so this works for any flow, whether its motion vectors are normalized to
+    the step length (speed 1) or not. The step grows by at most the 'growth' factor per
+    iteration and stays below max_step; the first step is 'step', or cfl times the
+    shortest edge if it is not given.
+
+    The flow is stopped when:
+      - the largest displacement of a vertex in an iteration drops below 'tolerance';
+      - the relative change of metric(shape) (e.g. area()) drops below 'metric_tolerance';
+      - the step would drop below min_step, e.g. because an edge has collapsed;
+      - the vertices are no longer finite.
+    After the run, 'reason' tells why it stopped (None if it ran all its iterations),
+    and 'steps', 'displacements' and 'metrics' hold the history of the iterations.
+    """
+
+    def __init__(self, tolerance=None, metric=None, metric_tolerance=None, cfl=None,
+                 step=None, min_step=1e-12, max_step=None, growth=2.0):
+        if metric_tolerance is not None and metric is None:
+            metric = area
+        self.tolerance = tolerance
+        self.metric = metric
+        self.metric_tolerance = metric_tolerance
+        self.cfl = cfl
+        self.step = step
+        self.min_step = min_step
+        self.max_step = max_step
+        self.growth = growth
+        self.steps = []
+        self.displacements = []
+        self.metrics = []
+        self.reason = None
+        self._vertices = None
+
+    @property
+    def iterations(self):
+        return len(self.displacements)
+
+    def start(self, shape):
+        """Records the initial shape (a mesh or curve id, or a MeshSnapshot) and
+        chooses the first step. Returns False if the shape is already degenerate.
+        """
+        self._vertices = shape_vertices(shape)
+        if self.metric is not None:
+            self.metrics.append(self.metric(shape))
+        if self.cfl is not None:
+            bound = self.cfl * min_edge_length(shape)
+            self.step = bound if self.step is None else min(self.step, bound)
+            if self.max_step is not None:
+                self.step = min(self.step, self.max_step)
+            if not self.step > self.min_step:
+                self.reason = "degenerate shape: the stable step %g is below %g" % (self.step, self.min_step)
+                return False
+        return True
+
+    def update(self, shape):
+        """Records the shape after an iteration made with the current step, chooses the
+        next step and returns True if the flow should stop (see 'reason').
+        """
+        self.steps.append(self.step)
+        vertices = shape_vertices(shape)
+        displacement = max_displacement(self._vertices, vertices)
+        self.displacements.append(displacement)
+        self._vertices = vertices
+        if not is_finite(displacement):
+            self.reason = "diverged: the vertices are no longer finite"
+            return True
+        if self.tolerance is not None and displacement < self.tolerance:
+            self.reason = "converged: max displacement %g < %g" % (displacement, self.tolerance)
+            return True
+        if self.metric is not None:
+            self.metrics.append(self.metric(shape))
+            previous, current = self.metrics[-2], self.metrics[-1]
+            change = abs(current - previous) / max(abs(previous), 1e-300)
+            if not is_finite(current):
+                self.reason = "diverged: the metric is no longer finite"
+                return True
+            if self.metric_tolerance is not None and change < self.metric_tolerance:
+                self.reason = "converged: relative metric change %g < %g" % (change, self.metric_tolerance)
+                return True
+        if self.cfl is not None:
+            bound = self.cfl * min_edge_length(shape)
+            speed = displacement / self.step if self.step else 0
+            step = self.step * self.growth
+            if speed > 0:
+                step = min(step, bound / speed)
+            if self.max_step is not None:
+                step = min(step, self.max_step)
+            if not step > self.min_step:
+                self.reason = "degenerate shape: the stable step %g is below %g" % (step, self.min_step)
+                return True
+            self.step = step
+        return False
+
+    def get_state(self):
+        """Returns the state of the run, for a checkpoint (see utils/checkpoint.py):
+        a JSON-serializable dictionary and a dictionary of arrays.
+        """
+        arrays = {"vertices": self._vertices, "steps": self.steps,
+                  "displacements": self.displacements, "metrics": self.metrics}
+        return {"step": self.step, "reason": self.reason}, arrays
+
+    def set_state(self, state, arrays):
+        """Restores the state of a run saved by get_state(), instead of start()."""
+        self.step = state["step"]
+        self.steps = [float(step) for step in arrays["steps"]]
+        self.displacements = [float(displacement) for displacement in arrays["displacements"]]
+        self.metrics = [float(metric) for metric in arrays["metrics"]]
+        self.reason = state["reason"]
+        self._vertices = arrays["vertices"]
+
+    def summary(self):
+        """Returns a one-line report of the run."""
+        text = "%d iterations" % self.iterations
+        if self.displacements:
+            text += ", last max displacement %g" % self.displacements[-1]
+        if self.steps and self.cfl is not None:
+            text += ", steps %g..%g" % (min(self.steps), max(self.steps))
+        return "%s: %s" % (text, self.reason or "iteration limit reached")
+
+
+def shape_vertices(shape):
+    """Returns the vertices of a mesh (id or MeshSnapshot) or of a polyline (id),
+    as an (n, 3) array if NumPy is available.
+    """
+    if isinstance(shape, MeshSnapshot):
+        vertices = shape.vertices
+    elif rs.IsMesh(shape):
+        vertices = rs.MeshVertices(shape)
+    else:
+        vertices = rs.PolylineVertices(shape)
+    if np is not None:
+        return np.asarray(vertices, dtype=float)
+    return [list(vertex) for vertex in vertices]
+
+
+def max_displacement(old_vertices, new_vertices):
+    """Returns the largest distance between the old and the new position of a vertex."""
+    if np is not None:
+        return float(np.sqrt(((np.asarray(new_vertices) - old_vertices) ** 2).sum(axis=1)).max())
+    return max(_distance(p, q) for p, q in zip(old_vertices, new_vertices))
+
+
+def min_edge_length(shape):
+    """Returns the length of the shortest edge of a mesh (id or MeshSnapshot) or polyline
+    (id). Rhino triangles, being quads with the last vertex repeated, are taken care of.
+    """
+    if isinstance(shape, MeshSnapshot) or rs.IsMesh(shape):
+        snapshot = MeshSnapshot.of(shape)
+        if np is not None:
+            mesh = snapshot.mesh
+            edges = mesh.vertices[mesh.he_target()] - mesh.vertices[mesh.he_origin()]
+            return float(np.sqrt((edges ** 2).sum(axis=1)).min())
+        vertices = snapshot.vertices
+        return min(_distance(vertices[face[k]], vertices[face[(k + 1) % len(face)]])
+                   for face in snapshot.face_vertices for k in range(len(face))
+                   if face[k] != face[(k + 1) % len(face)])
+    points = rs.PolylineVertices(shape)
+    return min(_distance(points[k], points[k + 1]) for k in range(len(points) - 1))
+
+
+def area(shape):
+    """A shape metric: the surface area of a mesh (id or MeshSnapshot), or the area
+    enclosed by a closed planar polyline (id).
+    """
+    if isinstance(shape, MeshSnapshot) or rs.IsMesh(shape):
+        snapshot = MeshSnapshot.of(shape)
+        if np is not None:
+            # Twice the vector area of each face is the sum of the cross products of its edges.
+            mesh = snapshot.mesh
+            vertices = mesh.vertices
+            cross = np.cross(vertices[mesh.he_origin()], vertices[mesh.he_target()])
+            vector_areas = planes.group_sum(cross, mesh.face_offsets)
+            return float(np.sqrt((vector_areas ** 2).sum(axis=1)).sum() / 2)
+        return sum(_polygon_area(points) for points in snapshot.face_points)
+    return _polygon_area(rs.PolylineVertices(shape)[:-1])
+
+
+def is_finite(value):
+    return not (math.isinf(value) or math.isnan(value))
+
+
+def _distance(p, q):
+    return math.sqrt((p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2 + (p[2] - q[2]) ** 2)
+
+
+def _polygon_area(points):
+    """Half the length of the sum of the cross products of the consecutive points."""
+    normal = [0.0, 0.0, 0.0]
+    for i in range(len(points)):
+        p, q = points[i], points[(i + 1) % len(points)]
+        normal[0] += p[1] * q[2] - p[2] * q[1]
+        normal[1] += p[2] * q[0] - p[0] * q[2]
+        normal[2] += p[0] * q[1] - p[1] * q[0]
+    return math.sqrt(normal[0] ** 2 + normal[1] ** 2 + normal[2] ** 2) / 2
@@ -1,41 +1,433 @@
-import os
-import rhinoscriptsyntax as rs
-import shutil
-import tempfile
-
-
-def iterate(flow_func, iterations, gif_path=None, *args, **kwargs):
-    """Performs the given number of iterations of an arbitrary flow function,
-    passing specific arguments to that function (those may include the curve/mesh id).
-    Useful for animated flow rendering in RhinoPython.
-    """
-    can_generate_gif = gif_path is not None
-    
-    if can_generate_gif:
-        # Generate a temporary folder to store frames captured during each iteration.
-        temp_dir = tempfile.mkdtemp()
-
-    # Iterate the flow function. If the user wants to generate the gif animation,
-    # capture each frame into a file in the temporary folder.
-    obj_id = None
-    for i in range(iterations):
-        if can_generate_gif:
-            rs.Command("-ViewCaptureToFile %s _Enter" % os.path.join(temp_dir, "%08i.png" % i))
-        obj_id = flow_func(obj_id, *args, **kwargs)
-
-    if can_generate_gif:
-        # Don't forget to capture the last frame.
-        rs.Command("-ViewCaptureToFile %s _Enter" % os.path.join(temp_dir, "%08i.png" % i))
-
-        # NOTE(mikhaildubov): The Pillow (PIL) package should be installed to generate gif animation.
-        # NOTE(mikhaildubov): We make a system call to the python interpreter to launch the gif
-        #                     compilation script here. That's because Rhinoceros 5 uses its own
-        #                     IronPython interpreter, and it may be rather difficult to make 
-        #                     third-party libraries available to it.
-        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "create_gif.py")
-        os.system('python "%s" "%s" "%s"' % (script, gif_path, temp_dir))
-
-        # Delete the temporary folder with all the frames inside it.
-        shutil.rmtree(temp_dir)
-
-    return obj_id
+import inspect
+import itertools
+import os
+from utils.rs_backend import rs
+import shutil
+import tempfile
+
+from utils import checkpoint
+from utils import convergence
+from utils import gif_encoder
+from utils import profiling
+from utils import rs_trace
+from utils import trajectory
+from utils.topology_cache import TopologyCache
+
+# The keyword arguments of iterate() which configure a convergence.Controller.
+CONTROLLER_OPTIONS = ("tolerance", "metric", "metric_tolerance", "cfl", "min_step", "max_step", "growth")
+
+
+def iterate(flow_func, iterations, gif_path=None, *args, **kwargs):
+    """Performs the given number of iterations of an arbitrary flow function,
+    passing specific arguments to that function (those may include the curve/mesh id).
+    Useful for animated flow rendering in RhinoPython.
+
+    If the flow function accepts a 'topology_cache' argument, one TopologyCache
+    is shared by all the iterations, so that the connectivity-derived structures
+    are computed once per run rather than once per iteration.
+
+    If a 'commit_every' keyword argument k is given and the flow function accepts
+    a 'commit' argument (as the mesh flows do), the flow runs in memory: each step
+    gets the result of the previous one (e.g. a MeshSnapshot) instead of a Rhino object,
+    and the object in the Rhino document is updated (via its commit() method) only every
+    k-th iteration, before each captured frame and after the last iteration. This avoids
+    adding and deleting a document object (with its undo record) on every iteration.
+
+    If a 'profile' keyword argument is given, the iterations and the phases of the flow
+    are timed (see utils/profiling.py) and a summary table is printed at the end;
+    if it is a path (rather than True), a Chrome/Perfetto trace is also written there.
+    With 'profile_memory=True', the memory peak of each iteration is recorded as well.
+
+    If 'trace_rs=True' is given, the rhinoscriptsyntax calls are counted and timed per
+    call site (see utils/rs_trace.py) and a ranked report is printed at the end.
+
+    The step size can be adapted and the flow stopped on convergence by a
+    convergence.Controller, given as 'controller' or configured by the keyword arguments
+    'tolerance', 'metric', 'metric_tolerance', 'cfl', 'min_step', 'max_step' and 'growth'
+    (see convergence.Controller). The controller sets the 'step' (or 't') argument of
+    the flow before every iteration, and 'iterations' may then be None to run the flow
+    until it converges. Why the flow stopped is printed at the end (and kept in the
+    'reason' attribute of the controller).
+
+    With 'checkpoint=PATH', the state of the run (the shape, the iteration counter, the
+    state of the controller and of an acceleration wrapper) is saved to that file every
+    'checkpoint_every' iterations (100 by default) and at the end, by a background thread
+    (see utils/checkpoint.py). With 'resume=True' as well, the run continues from the
+    checkpoint if the file exists: the saved shape is added to the document and flowed,
+    and the result is the same as that of an uninterrupted run. The checkpoint must have
+    been written by the same flow with the same arguments.
+
+    With 'trajectory=PATH', the vertex positions of the shape before the first iteration and
+    after every iteration are recorded to that file (see utils/trajectory.py; requires NumPy),
+    so that any of them can be read back later with trajectory.Trajectory(PATH).
+
+    With 'gif_pipeline=True', the gif animation is encoded while the flow runs: the gif
+    script is started once, at the beginning, and each frame is sent to it as soon as it
+    is captured (see utils/gif_encoder.py), instead of being encoded after the last iteration.
+
+    Each of these options is handled by a Hook (see HOOKS below), so that the loop itself
+    only calls the flow function and the hooks around it.
+    """
+    run = FlowRun(flow_func, gif_path, args, kwargs)
+    hooks = [hook for hook in (hook_class.of(run) for hook_class in HOOKS) if hook is not None]
+    if iterations is None and run.controller is None:
+        raise Exception("Running a flow until it converges requires a tolerance.")
+
+    if "topology_cache" not in kwargs and accepts_argument(flow_func, "topology_cache"):
+        kwargs["topology_cache"] = TopologyCache()
+
+    started = []
+    failed = True
+    try:
+        for hook in hooks:
+            hook.start(run)
+            started.append(hook)
+        if not run.stopped:
+            steps = range(run.done, iterations) if iterations is not None else itertools.count(run.done)
+            for i in steps:
+                with profiling.iteration(i):
+                    for hook in hooks:
+                        hook.before_step(run, i)
+                    run.shape = flow_func(run.shape, *args, **kwargs)
+                    run.done = i + 1
+                    for hook in reversed(hooks):
+                        hook.after_step(run)
+                if run.stopped:
+                    break
+        for hook in hooks:
+            hook.finish(run)
+        failed = False
+    finally:
+        for hook in reversed(started):
+            hook.close(run, failed)
+    return run.shape
+
+
+class FlowRun(object):
+    """The state of an iterate() call shared by its hooks: the flow function and its
+    arguments ('kwargs' may be changed by the hooks, e.g. the step size), the shape (the
+    id of the curve or mesh, or a MeshSnapshot for a flow running in memory), the number
+    of iterations done, and whether the run was resumed from a checkpoint or should stop.
+    """
+
+    def __init__(self, flow_func, gif_path, args, kwargs):
+        self.flow_func = flow_func
+        self.gif_path = gif_path
+        self.args = args
+        self.kwargs = kwargs
+        self.shape = None
+        self.done = 0
+        self.resumed = False
+        self.stopped = False
+        self.in_memory = False
+        self.controller = None
+        # The keyword arguments which configured the controller.
+        self.options = {}
+
+    def require_shape(self):
+        """Returns the shape, asking the user to select it if no iteration has run yet."""
+        if self.shape is None:
+            self.shape = rs.GetObject("Select a curve or a mesh", rs.filter.curve | rs.filter.mesh, True, True)
+        return self.shape
+
+
+class Hook(object):
+    """An option of iterate(). The class method of() pops the keyword arguments of the
+    option from run.kwargs and returns a hook, or None if the option is not used.
+    Then the hooks are called in the order of HOOKS: start() before the first iteration,
+    before_step() before every iteration and finish() after the last one. Like nested
+    wrappers of the flow, they are called in the reverse order on the way out:
+    after_step() after every iteration (setting run.stopped stops the run) and close(),
+    always, even after an error (if the hook has started).
+    """
+
+    @classmethod
+    def of(cls, run):
+        return None
+
+    def start(self, run):
+        pass
+
+    def before_step(self, run, i):
+        pass
+
+    def after_step(self, run):
+        pass
+
+    def finish(self, run):
+        pass
+
+    def close(self, run, failed):
+        pass
+
+
+class RsTraceHook(Hook):
+    """'trace_rs=True': counts and times the rhinoscriptsyntax calls (see utils/rs_trace.py)."""
+
+    @classmethod
+    def of(cls, run):
+        if run.kwargs.pop("trace_rs", False) and not rs_trace.installed():
+            return cls()
+
+    def start(self, run):
+        rs_trace.install()
+
+    def close(self, run, failed):
+        print(rs_trace.uninstall().report())
+
+
+class ProfileHook(Hook):
+    """'profile' (True or a trace path) and 'profile_memory': times the iterations and
+    the phases of the flow (see utils/profiling.py)."""
+
+    def __init__(self, profile, memory):
+        self.profile = profile
+        self.memory = memory
+
+    @classmethod
+    def of(cls, run):
+        profile = run.kwargs.pop("profile", None)
+        memory = run.kwargs.pop("profile_memory", False)
+        if profile and not profiling.enabled():
+            return cls(profile, memory)
+
+    def start(self, run):
+        profiling.start(self.memory)
+
+    def close(self, run, failed):
+        recorded = profiling.stop()
+        print(recorded.summary())
+        if self.profile is not True:
+            recorded.write_trace(self.profile)
+
+
+class CheckpointHook(Hook):
+    """'checkpoint', 'checkpoint_every' and 'resume': saves the state of the run and
+    resumes it (see utils/checkpoint.py)."""
+
+    def __init__(self, path, every, resume):
+        self.path = path
+        self.every = every
+        self.resume = resume
+        self.arguments = None
+        self.writer = None
+
+    @classmethod
+    def of(cls, run):
+        path = run.kwargs.pop("checkpoint", None)
+        every = run.kwargs.pop("checkpoint_every", 100)
+        resume = run.kwargs.pop("resume", False)
+        if path is not None:
+            return cls(path, every, resume)
+
+    def start(self, run):
+        self.arguments = checkpoint.arguments(run.args, dict(run.kwargs, **run.options))
+        if self.resume and os.path.exists(self.path):
+            saved = checkpoint.read(self.path)
+            if (saved.header["flow"], saved.header["arguments"]) != (checkpoint.flow_name(run.flow_func),
+                                                                     self.arguments):
+                raise Exception("The checkpoint %s was written by another flow or with other arguments: %s %s"
+                                % (self.path, saved.header["flow"], saved.header["arguments"]))
+            run.shape = checkpoint.restore(saved, run.flow_func, run.controller, run.in_memory,
+                                           run.kwargs.get("topology_cache"))
+            run.done = saved.iteration
+            run.resumed = True
+        self.writer = checkpoint.Writer(self.path)
+
+    def after_step(self, run):
+        # NOTE: Called after the hooks following it in HOOKS, so the saved state of
+        #       the controller includes this iteration. On the last one, finish() saves.
+        if not run.stopped and run.done % self.every == 0:
+            self._save(run)
+
+    def finish(self, run):
+        if run.shape is not None:
+            self._save(run)
+
+    def close(self, run, failed):
+        # Waits for the last checkpoint to be written.
+        self.writer.close()
+
+    def _save(self, run):
+        with profiling.span("checkpoint"):
+            self.writer.save(checkpoint.capture(run.shape, run.done, run.flow_func, self.arguments,
+                                                run.controller))
+
+
+class ControllerHook(Hook):
+    """'controller' or its options (CONTROLLER_OPTIONS): adapts the step size and stops
+    the run on convergence (see utils/convergence.py)."""
+
+    def __init__(self, controller, step_argument):
+        self.controller = controller
+        self.step_argument = step_argument
+
+    @classmethod
+    def of(cls, run):
+        controller = run.kwargs.pop("controller", None)
+        run.options = dict((name, run.kwargs.pop(name)) for name in CONTROLLER_OPTIONS if name in run.kwargs)
+        if run.options:
+            controller = convergence.Controller(**run.options)
+        if controller is None:
+            return None
+        run.controller = controller
+        step_argument = "t" if accepts_argument(run.flow_func, "t") else "step"
+        if controller.step is None and step_argument in run.kwargs:
+            controller.step = run.kwargs[step_argument]
+        return cls(controller, step_argument)
+
+    def start(self, run):
+        if run.resumed:
+            # The state of the controller has been restored from the checkpoint.
+            run.stopped = self.controller.reason is not None
+        else:
+            # The controller measures the shape before the first iteration.
+            run.stopped = not self.controller.start(run.require_shape())
+
+    def before_step(self, run, i):
+        if self.controller.step is not None:
+            run.kwargs[self.step_argument] = self.controller.step
+
+    def after_step(self, run):
+        with profiling.span("convergence"):
+            if self.controller.update(run.shape):
+                run.stopped = True
+
+    def finish(self, run):
+        print(self.controller.summary())
+
+
+class TrajectoryHook(Hook):
+    """'trajectory': records the vertex positions of every iteration (see utils/trajectory.py)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.recorder = None
+
+    @classmethod
+    def of(cls, run):
+        path = run.kwargs.pop("trajectory", None)
+        if path is not None:
+            return cls(path)
+
+    def start(self, run):
+        # The first frame is the shape before the first iteration.
+        self.recorder = trajectory.Recorder.of(self.path, run.require_shape())
+
+    def after_step(self, run):
+        with profiling.span("trajectory"):
+            self.recorder.append(convergence.shape_vertices(run.shape))
+
+    def close(self, run, failed):
+        self.recorder.close()
+
+
+class InMemoryHook(Hook):
+    """'commit_every': runs a flow accepting a 'commit' argument in memory, updating
+    the object in the Rhino document only every k-th iteration and at the end."""
+
+    def __init__(self, commit_every):
+        self.commit_every = commit_every
+
+    @classmethod
+    def of(cls, run):
+        commit_every = run.kwargs.pop("commit_every", None)
+        if commit_every is not None and commit_every < 1:
+            raise Exception("commit_every should be at least 1, got %s." % commit_every)
+        if commit_every is not None and accepts_argument(run.flow_func, "commit"):
+            run.in_memory = True
+            run.kwargs["commit"] = False
+            return cls(commit_every)
+
+    def after_step(self, run):
+        if run.done % self.commit_every == 0:
+            run.shape.commit()
+
+    def finish(self, run):
+        if run.shape is not None:
+            # The flow results are kept in memory; return the id of the Rhino object.
+            run.shape = run.shape.commit()
+
+
+class GifHook(Hook):
+    """'gif_path' and 'gif_pipeline': captures a frame before every iteration and after
+    the last one, and makes the gif animation of them."""
+
+    def __init__(self, gif_path, pipeline):
+        self.gif_path = gif_path
+        self.pipeline = pipeline
+        self.encoder = None
+        self.temp_dir = None
+
+    @classmethod
+    def of(cls, run):
+        pipeline = run.kwargs.pop("gif_pipeline", False)
+        if run.gif_path is not None:
+            return cls(run.gif_path, pipeline)
+
+    def start(self, run):
+        if self.pipeline:
+            # The gif encoder gets the frames as they are captured.
+            self.encoder = gif_encoder.GifEncoder(self.gif_path)
+        else:
+            # Generate a temporary folder to store frames captured during each iteration.
+            self.temp_dir = tempfile.mkdtemp()
+
+    def before_step(self, run, i):
+        if run.in_memory and run.shape is not None:
+            run.shape.commit()
+        self._capture(i)
+
+    def finish(self, run):
+        # Don't forget to capture the last frame (the shape after 'done' iterations;
+        # the frame captured before iteration i is named after i).
+        self._capture(run.done)
+        if self.encoder is not None:
+            # The other frames are encoded already.
+            with profiling.span("gif"):
+                self.encoder.close()
+        else:
+            # NOTE(mikhaildubov): The Pillow (PIL) package should be installed to generate gif animation.
+            # NOTE(mikhaildubov): We make a system call to the python interpreter to launch the gif
+            #                     compilation script here. That's because Rhinoceros 5 uses its own
+            #                     IronPython interpreter, and it may be rather difficult to make 
+            #                     third-party libraries available to it.
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "create_gif.py")
+            with profiling.span("gif"):
+                os.system('python "%s" "%s" "%s"' % (script, self.gif_path, self.temp_dir))
+
+    def close(self, run, failed):
+        if self.encoder is not None and failed:
+            # Finish the animation with the frames captured so far.
+            self.encoder.close()
+        if self.temp_dir is not None:
+            # Delete the temporary folder with all the frames inside it, even after an error.
+            shutil.rmtree(self.temp_dir)
+
+    def _capture(self, number):
+        with profiling.span("capture frame"):
+            if self.encoder is not None:
+                self.encoder.capture()
+            else:
+                rs.Command("-ViewCaptureToFile %s _Enter" % os.path.join(self.temp_dir, "%08i.png" % number))
+
+
+# The options of iterate(), in the order in which their hooks are called (see Hook): e.g.
+# a checkpoint is restored before the controller and the trajectory recorder measure the
+# shape and saved after the controller has seen the iteration, and the in-memory shape
+# is committed before the last gif frame is captured.
+HOOKS = [RsTraceHook, ProfileHook, CheckpointHook, ControllerHook, TrajectoryHook, InMemoryHook, GifHook]
+
+
+def accepts_argument(func, name):
+    """Checks whether the given function has an argument with the given name.
+    For a wrapper of a flow (e.g. an acceleration.AndersonAcceleration), checks the flow.
+    """
+    while hasattr(func, "__wrapped__"):
+        func = func.__wrapped__
+    try:
+        args = inspect.getfullargspec(func).args
+    except AttributeError:
+        # Python 2 (e.g. IronPython in Rhinoceros)
+        args = inspect.getargspec(func).args
+    return name in args
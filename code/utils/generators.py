@@ -0,0 +1,225 @@
+from math import pi
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils.halfedge_mesh import fan_triangles
+
+""" Procedural shapes of any resolution (requires NumPy). """
+
+
+# NOTE: The meshes are returned as (vertices, face_offsets, face_indices) arrays, just like
+#       mesh_io.read() returns them, with the faces oriented counterclockwise as seen from
+#       the outside (see mesh_utils.add_cube()). Polylines are (n + 1, 3) arrays of points
+#       with the first point repeated at the end, as rs.PolylineVertices() returns them.
+#       Everything is computed on arrays, so that meshes with tens of millions of faces can
+#       be generated and written to a file (see mesh_io.write()) without any Python lists;
+#       mesh_utils.add_mesh() adds a generated mesh to the Rhino document.
+#       The random shapes are reproducible: they only depend on the given seed.
+
+
+def available():
+    """Returns True if NumPy is available."""
+    return np is not None
+
+
+def uv_sphere(segments, rings, radius=1.0):
+    """Returns a sphere made of 'segments' meridians and 'rings' parallel bands:
+    triangles around the poles and planar quads everywhere else.
+    """
+    theta = np.arange(1, rings) * pi / rings
+    phi = np.arange(segments) * 2 * pi / segments
+    sin_theta = np.outer(np.sin(theta), np.ones(segments))
+    ring_points = np.column_stack([(sin_theta * np.cos(phi)).ravel(),
+                                   (sin_theta * np.sin(phi)).ravel(),
+                                   np.repeat(np.cos(theta), segments)])
+    vertices = radius * np.vstack([[0.0, 0.0, 1.0], ring_points, [0.0, 0.0, -1.0]])
+    north, south = 0, len(vertices) - 1
+
+    grid = 1 + np.arange((rings - 1) * segments).reshape(rings - 1, segments)
+    following = np.roll(grid, -1, axis=1)
+    top = np.column_stack([np.full(segments, north), grid[0], following[0]])
+    quads = np.stack([grid[:-1], grid[1:], following[1:], following[:-1]], axis=-1).reshape(-1, 4)
+    bottom = np.column_stack([grid[-1], np.full(segments, south), following[-1]])
+    return _faces(vertices, [top, quads, bottom])
+
+
+def uv_sphere_with_vertices(vertex_count, radius=1.0):
+    """Returns a UV sphere with about the given number of vertices."""
+    segments = max(3, int(round((2 * vertex_count) ** 0.5)))
+    return uv_sphere(segments, max(2, segments // 2), radius)
+
+
+def torus(segments, rings, major_radius=1.0, minor_radius=0.25):
+    """Returns a torus made of segments x rings planar quads; 'segments' goes around
+    the axis of the torus and 'rings' around its tube.
+    """
+    u = np.arange(segments) * 2 * pi / segments
+    v = np.arange(rings) * 2 * pi / rings
+    distance = major_radius + minor_radius * np.cos(v)
+    vertices = np.column_stack([np.outer(np.cos(u), distance).ravel(),
+                                np.outer(np.sin(u), distance).ravel(),
+                                np.tile(minor_radius * np.sin(v), segments)])
+    grid = np.arange(segments * rings).reshape(segments, rings)
+    next_u = np.roll(grid, -1, axis=0)
+    quads = np.stack([grid, next_u, np.roll(next_u, -1, axis=1), np.roll(grid, -1, axis=1)],
+                     axis=-1).reshape(-1, 4)
+    return _faces(vertices, [quads])
+
+
+def torus_with_vertices(vertex_count, major_radius=1.0, minor_radius=0.25):
+    """Returns a torus with about the given number of vertices."""
+    segments = max(3, int(round((2 * vertex_count) ** 0.5)))
+    return torus(segments, max(3, segments // 2), major_radius, minor_radius)
+
+
+def icosphere(subdivisions, radius=1.0):
+    """Returns a sphere made of 20 * 4^subdivisions triangles of almost equal size,
+    obtained by subdividing an icosahedron and projecting the new vertices on the sphere.
+    """
+    t = (1 + 5 ** 0.5) / 2
+    vertices = np.array([(-1, t, 0), (1, t, 0), (-1, -t, 0), (1, -t, 0),
+                         (0, -1, t), (0, 1, t), (0, -1, -t), (0, 1, -t),
+                         (t, 0, -1), (t, 0, 1), (-t, 0, -1), (-t, 0, 1)], dtype=float)
+    triangles = np.array([(0, 11, 5), (0, 5, 1), (0, 1, 7), (0, 7, 10), (0, 10, 11),
+                          (1, 5, 9), (5, 11, 4), (11, 10, 2), (10, 7, 6), (7, 1, 8),
+                          (3, 9, 4), (3, 4, 2), (3, 2, 6), (3, 6, 8), (3, 8, 9),
+                          (4, 9, 5), (2, 4, 11), (6, 2, 10), (8, 6, 7), (9, 8, 1)], dtype=np.int64)
+    vertices /= np.sqrt((vertices ** 2).sum(axis=1))[:, None]
+    for _ in range(subdivisions):
+        edges, edge_ids, _ = _edges(triangles, len(vertices))
+        vertices = np.vstack([vertices, (vertices[edges[:, 0]] + vertices[edges[:, 1]]) / 2])
+        vertices /= np.sqrt((vertices ** 2).sum(axis=1))[:, None]
+        triangles = _split_triangles(triangles, edge_ids + len(vertices) - len(edges))
+    return _faces(radius * vertices, [triangles])
+
+
+def loop_subdivide(mesh, levels=1):
+    """Returns the mesh after the given number of steps of Loop subdivision: each
+    triangle is split into four, and the vertices are moved with the Loop weights
+    (the boundary is subdivided as a cubic B-spline curve). Faces with more than three
+    vertices are fan-triangulated first.
+
+    The mesh may be given as (vertices, face_offsets, face_indices) arrays or as a
+    HalfEdgeMesh, so the shapes loaded into Rhinoceros can be subdivided as well,
+    e.g. loop_subdivide(MeshSnapshot(mesh_id).mesh, 2).
+    """
+    if hasattr(mesh, "face_offsets"):
+        mesh = (mesh.vertices, mesh.face_offsets, mesh.face_indices)
+    vertices, face_offsets, face_indices = mesh
+    vertices = np.asarray(vertices, dtype=float)
+    triangles, _ = fan_triangles(np.asarray(face_offsets), np.asarray(face_indices))
+    for _ in range(levels):
+        n = len(vertices)
+        edges, edge_ids, edge_faces = _edges(triangles, n)
+        # Edge points: 3/8 of the edge ends plus 1/8 of the opposite vertices for the
+        # interior edges, the midpoint for the boundary (and non-manifold) edges.
+        opposite = np.roll(triangles, -2, axis=1)
+        opposite_sums = _sum_rows(edge_ids.ravel(), vertices[opposite.ravel()], len(edges))
+        interior = edge_faces == 2
+        edge_points = (vertices[edges[:, 0]] + vertices[edges[:, 1]]) / 2
+        edge_points[interior] = (3.0 / 8 * (vertices[edges[interior, 0]] + vertices[edges[interior, 1]]) +
+                                 1.0 / 8 * opposite_sums[interior])
+
+        # Vertex points: (1 - k * beta) * v + beta * (sum of the k neighbours) inside,
+        # 3/4 * v + 1/8 * (sum of the two boundary neighbours) on the boundary.
+        valences = np.bincount(edges.ravel(), minlength=n).astype(float)
+        neighbour_sums = _sum_rows(edges.ravel(), vertices[edges[:, ::-1].ravel()], n)
+        beta = (5.0 / 8 - (3.0 / 8 + np.cos(2 * pi / np.maximum(valences, 1)) / 4) ** 2) / np.maximum(valences, 1)
+        vertex_points = (1 - valences * beta)[:, None] * vertices + beta[:, None] * neighbour_sums
+        boundary_edges = edges[~interior]
+        if len(boundary_edges):
+            boundary_sums = _sum_rows(boundary_edges.ravel(), vertices[boundary_edges[:, ::-1].ravel()], n)
+            boundary = np.bincount(boundary_edges.ravel(), minlength=n) > 0
+            vertex_points[boundary] = 3.0 / 4 * vertices[boundary] + 1.0 / 8 * boundary_sums[boundary]
+
+        vertices = np.vstack([vertex_points, edge_points])
+        triangles = _split_triangles(triangles, edge_ids + n)
+    return _faces(vertices, [triangles])
+
+
+def circle(vertex_count, radius=1.0):
+    """Returns a closed counterclockwise polyline inscribed in a circle in the XY plane."""
+    angles = np.arange(vertex_count + 1) * 2 * pi / vertex_count
+    points = np.column_stack([radius * np.cos(angles), radius * np.sin(angles),
+                              np.zeros(vertex_count + 1)])
+    points[-1] = points[0]
+    return points
+
+
+def noisy_polygon(vertex_count, noise=0.2, radius=1.0, seed=None):
+    """Returns a closed counterclockwise polyline obtained from a regular polygon
+    by moving each vertex randomly along its ray and its circle. With a large noise
+    (e.g. 0.5) the polygon is non-convex, but as long as the noise is below 1,
+    it does not self-intersect.
+    """
+    random = np.random.RandomState(seed)
+    angles = (np.arange(vertex_count) + noise * random.uniform(-0.5, 0.5, vertex_count)) * \
+        2 * pi / vertex_count
+    radii = radius * (1 + noise * random.uniform(-1, 1, vertex_count))
+    return _polygon(angles, radii)
+
+
+def star_polygon(tips, inner_radius=0.5, outer_radius=1.0):
+    """Returns a regular (non-convex) star with the given number of tips as a closed
+    counterclockwise polyline with 2 * tips vertices.
+    """
+    angles = np.arange(2 * tips) * pi / tips
+    radii = np.where(np.arange(2 * tips) % 2 == 0, outer_radius, inner_radius)
+    return _polygon(angles, radii)
+
+
+def random_star_polygon(vertex_count, inner_radius=0.2, outer_radius=1.0, seed=None):
+    """Returns a random star-shaped polygon (every vertex is visible from the origin)
+    as a closed counterclockwise polyline: the vertices are taken at random angles
+    and at random distances between the given radii.
+    """
+    random = np.random.RandomState(seed)
+    angles = np.sort(random.uniform(0, 2 * pi, vertex_count))
+    radii = random.uniform(inner_radius, outer_radius, vertex_count)
+    return _polygon(angles, radii)
+
+
+def _polygon(angles, radii):
+    points = np.column_stack([radii * np.cos(angles), radii * np.sin(angles), np.zeros(len(angles))])
+    return np.vstack([points, points[:1]])
+
+
+def _edges(triangles, vertex_count):
+    """Returns (edges, edge_ids, edge_faces): the unique edges of the triangles as an
+    (e, 2) array of vertex indices, the (t, 3) array of the ids of the edges
+    (triangles[:, k], triangles[:, k + 1]) and the number of triangles of each edge.
+    """
+    a = triangles.ravel()
+    b = np.roll(triangles, -1, axis=1).ravel()
+    keys = np.minimum(a, b) * vertex_count + np.maximum(a, b)
+    unique_keys, edge_ids, edge_faces = np.unique(keys, return_inverse=True, return_counts=True)
+    edges = np.column_stack([unique_keys // vertex_count, unique_keys % vertex_count])
+    return edges, edge_ids.reshape(-1, 3), edge_faces
+
+
+def _split_triangles(triangles, midpoints):
+    """Splits each triangle (a, b, c) into four, given the indices of the vertices
+    inserted on its edges (a, b), (b, c) and (c, a).
+    """
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    ab, bc, ca = midpoints[:, 0], midpoints[:, 1], midpoints[:, 2]
+    return np.concatenate([np.column_stack([a, ab, ca]), np.column_stack([b, bc, ab]),
+                           np.column_stack([c, ca, bc]), np.column_stack([ab, bc, ca])])
+
+
+def _sum_rows(indices, values, count):
+    """Returns a (count, 3) array whose row i is the sum of values[k] for indices[k] == i."""
+    return np.column_stack([np.bincount(indices, weights=values[:, k], minlength=count)
+                            for k in range(3)])
+
+
+def _faces(vertices, blocks):
+    """Concatenates blocks of faces (each block being an array of equally sized faces)."""
+    sizes = np.concatenate([np.full(len(block), block.shape[1], dtype=np.int64) for block in blocks])
+    face_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=face_offsets[1:])
+    face_indices = np.concatenate([block.ravel() for block in blocks]).astype(np.int64)
+    return vertices, face_offsets, face_indices
@@ -0,0 +1,98 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from utils.rs_backend import rs
+
+try:
+    import Rhino
+    import scriptcontext as sc
+except ImportError:
+    Rhino = sc = None
+
+""" Encoding the gif animation of a flow while the flow runs (see flow_utils.iterate()).
+
+A GifEncoder starts the gif script (scripts/create_gif.py) once, in a separate Python
+process, and sends it every captured frame through a pipe as soon as it is captured,
+so the frames are encoded while the flow computes the next ones and the animation is
+complete right after the last iteration. In Rhinoceros, the view is captured to a bitmap
+in memory and its bytes are sent; elsewhere, the frames are captured to temporary files
+and their paths are sent instead (the encoder deletes each file once it has read it).
+If the encoder is slower than the flow, writing to the pipe blocks, so the frames
+waiting to be encoded never take more memory than the pipe buffer.
+"""
+
+
+class GifEncoder(object):
+    """Writes the gif animation made of the frames captured with capture().
+    If the encoder process cannot run (e.g. the Pillow package is missing),
+    the frames are dropped and no gif file is produced, as with the gif script.
+    """
+
+    def __init__(self, gif_path, python="python"):
+        # NOTE(mikhaildubov): As with the gif script itself, we run the system Python
+        #                     interpreter rather than the one of Rhinoceros.
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "create_gif.py")
+        self.frames = 0
+        self._temp_dir = None
+        self._stopped = False
+        try:
+            self._process = subprocess.Popen([python, script, gif_path, "-"], stdin=subprocess.PIPE)
+        except (IOError, OSError):
+            self._process = None
+
+    def capture(self):
+        """Captures the active view and sends it to the encoder."""
+        if self._process is None or self._stopped:
+            return
+        if sc is not None:
+            data = _capture_view()
+            self._send(("image %d\n" % len(data)).encode("ascii") + data)
+        else:
+            if self._temp_dir is None:
+                self._temp_dir = tempfile.mkdtemp()
+            path = os.path.join(self._temp_dir, "%08i.png" % self.frames)
+            rs.Command("-ViewCaptureToFile %s _Enter" % path)
+            if not os.path.exists(path):
+                # Nothing to capture (e.g. outside Rhinoceros).
+                return
+            self._send(("file %s\n" % path).encode("utf-8"))
+        self.frames += 1
+
+    def close(self):
+        """Waits for the encoder to write the animation. Returns its exit code
+        (None if it could not run)."""
+        if self._process is None:
+            code = None
+        else:
+            try:
+                self._process.stdin.close()
+            except (IOError, OSError):
+                pass
+            code = self._process.wait()
+        if self._temp_dir is not None:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+        return code
+
+    def _send(self, record):
+        try:
+            self._process.stdin.write(record)
+            self._process.stdin.flush()
+        except (IOError, OSError):
+            # The encoder has stopped (e.g. without Pillow): drop the remaining frames.
+            self._stopped = True
+
+
+def _capture_view():
+    """Returns the active Rhino view as the bytes of a BMP image."""
+    import System
+    bitmap = sc.doc.Views.ActiveView.CaptureToBitmap()
+    stream = System.IO.MemoryStream()
+    try:
+        # NOTE: BMP rather than PNG: it takes no time to encode, and the pipe is fast.
+        bitmap.Save(stream, System.Drawing.Imaging.ImageFormat.Bmp)
+        return bytes(bytearray(stream.ToArray()))
+    finally:
+        bitmap.Dispose()
+        stream.Dispose()
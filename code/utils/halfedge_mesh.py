@@ -0,0 +1,344 @@
+try:
+    import numpy as np
+except ImportError:
+    # NOTE(mikhaildubov): NumPy is not available in the IronPython interpreter shipped
+    #                     with Rhinoceros 5. In that case the flows fall back to their
+    #                     rhinoscriptsyntax-based implementations.
+    np = None
+
+from utils.topology_cache import faces_key
+
+""" Array-based half-edge mesh representation shared by the mesh flows. """
+
+
+def available():
+    """Returns True if the array-based mesh representation can be used."""
+    return np is not None
+
+
+class HalfEdgeMesh(object):
+    """Compact mesh representation built on NumPy arrays.
+
+    Vertex positions are stored in an (n, 3) float array. Faces are ragged: the
+    vertex indices of face f are face_indices[face_offsets[f]:face_offsets[f + 1]].
+    Half-edge h goes from face_indices[h] to face_indices[he_next[h]] and belongs
+    to face he_face[h]; he_twin[h] is the other half-edge of the same edge, or -1 on
+    the boundary. The twin runs in the opposite direction, unless the two faces are
+    oriented inconsistently (consistently_oriented is then False); the one-rings
+    are correct either way. An edge shared by more than two faces raises an exception.
+    Vertex-to-vertex and vertex-to-face incidence are stored in the CSR format:
+    the neighbours of vertex i are vv_indices[vv_offsets[i]:vv_offsets[i + 1]].
+
+    Everything except the vertex positions depends only on the connectivity,
+    so meshes that share their faces also share these arrays (see with_vertices()).
+    """
+
+    def __init__(self, vertices, face_offsets, face_indices, topology=None, topology_cache=None):
+        self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+        self.face_offsets = np.asarray(face_offsets, dtype=np.int64)
+        self.face_indices = np.asarray(face_indices, dtype=np.int64)
+        if topology is None:
+            n = len(self.vertices)
+            build = lambda: _build_topology(n, self.face_offsets, self.face_indices)
+            if topology_cache is None:
+                topology = build()
+            else:
+                # Reuse the connectivity arrays (and everything cached on them, e.g.
+                # Laplacian factorizations) if this topology has been seen already.
+                key = faces_key(n, (self.face_offsets, self.face_indices))
+                topology = topology_cache.get(key, "halfedge_mesh", build)
+        self._topology = topology
+        self.he_face = topology["he_face"]
+        self.he_next = topology["he_next"]
+        self.he_twin = topology["he_twin"]
+        self.consistently_oriented = topology["consistently_oriented"]
+        self.vv_offsets = topology["vv_offsets"]
+        self.vv_indices = topology["vv_indices"]
+        self.vf_offsets = topology["vf_offsets"]
+        self.vf_indices = topology["vf_indices"]
+        self._derived = {}
+
+    @classmethod
+    def from_faces(cls, vertices, faces, topology_cache=None):
+        """Builds the mesh from a vertex list and a list of faces, each face being
+        a sequence of vertex indices. Consecutive duplicate indices are dropped, so
+        Rhino triangles of the form (a, b, c, c) become proper triangles (a, b, c).
+        """
+        face_offsets, face_indices = _compact_faces(faces)
+        return cls(vertices, face_offsets, face_indices, topology_cache=topology_cache)
+
+    @classmethod
+    def from_rhino(cls, mesh_id, topology_cache=None):
+        """Builds the mesh from a Rhino mesh object, fetching its geometry only once.
+        If a TopologyCache is given, the connectivity is looked up there first.
+        """
+        from utils.rs_backend import rs
+        return cls.from_faces(rs.MeshVertices(mesh_id), rs.MeshFaceVertices(mesh_id),
+                              topology_cache)
+
+    def with_vertices(self, vertices):
+        """Returns a mesh with the same connectivity and new vertex positions.
+        No topology is recomputed: all the connectivity arrays are shared.
+        """
+        return HalfEdgeMesh(vertices, self.face_offsets, self.face_indices, self._topology)
+
+    def cached(self, name, builder, topological=True):
+        """Returns builder(self), computing it only once. Topological values (those that
+        depend only on the connectivity) are shared by all the meshes created through
+        with_vertices(); the other ones are bound to these particular vertex positions.
+        """
+        store = self._topology["derived"] if topological else self._derived
+        if name not in store:
+            store[name] = builder(self)
+        return store[name]
+
+    @property
+    def vertex_count(self):
+        return len(self.vertices)
+
+    @property
+    def face_count(self):
+        return len(self.face_offsets) - 1
+
+    @property
+    def halfedge_count(self):
+        return len(self.face_indices)
+
+    def face_sizes(self):
+        return np.diff(self.face_offsets)
+
+    def face(self, f):
+        """Returns the vertex indices of face f."""
+        return self.face_indices[self.face_offsets[f]:self.face_offsets[f + 1]]
+
+    def neighbors(self, i):
+        """Returns the indices of the vertices adjacent to vertex i."""
+        return self.vv_indices[self.vv_offsets[i]:self.vv_offsets[i + 1]]
+
+    def vertex_faces(self, i):
+        """Returns the indices of the faces incident to vertex i."""
+        return self.vf_indices[self.vf_offsets[i]:self.vf_offsets[i + 1]]
+
+    def one_rings(self):
+        """Returns the cyclically ordered one-rings of all the vertices as a triple of
+        arrays (ring_offsets, ring_vertices, ring_faces) in the CSR format: the ring of
+        vertex i is ring_vertices[ring_offsets[i]:ring_offsets[i + 1]], ordered
+        counterclockwise with respect to the face orientation, and ring_faces[k] is the
+        face containing vertex i and the ring vertices k and k + 1 (cyclically), or -1
+        if there is none, i.e. the ring of a boundary vertex is open after position k.
+        Computed in one pass over the half-edges and cached for the topology.
+        """
+        return self.cached("one_rings", _build_one_rings)
+
+    def one_ring(self, i):
+        """Returns the ordered one-ring of vertex i as a pair (vertices, faces),
+        see one_rings().
+        """
+        ring_offsets, ring_vertices, ring_faces = self.one_rings()
+        ring = slice(ring_offsets[i], ring_offsets[i + 1])
+        return ring_vertices[ring], ring_faces[ring]
+
+    def face_points(self, f):
+        """Returns an (k, 3) array with the vertices of face f."""
+        return self.vertices[self.face(f)]
+
+    def he_origin(self):
+        return self.face_indices
+
+    def he_target(self):
+        return self.face_indices[self.he_next]
+
+    def triangles(self):
+        """Returns a fan triangulation of the faces (see fan_triangles())."""
+        return fan_triangles(self.face_offsets, self.face_indices)
+
+    def face_vertex_lists(self):
+        """Returns the faces as lists of vertex indices, e.g. for rs.AddMesh()."""
+        indices = self.face_indices.tolist()
+        offsets = self.face_offsets.tolist()
+        return [indices[offsets[f]:offsets[f + 1]] for f in range(self.face_count)]
+
+    def vertex_list(self):
+        """Returns the vertex positions as a list of [x, y, z] lists, e.g. for rs.AddMesh()."""
+        return self.vertices.tolist()
+
+
+def _build_one_rings(mesh):
+    """Orders the neighbours of every vertex by walking from face to face across
+    the edges incident to the vertex: in the face of the corner h = (v -> a), the
+    walk enters through one of the two edges of v and leaves through the other one,
+    to the twin face. As the twin of an edge may run in the same direction as the
+    edge (inconsistently oriented faces), the walk keeps track of which edge of each
+    corner it entered through, rather than assuming the face orientation.
+    All the vertices are walked simultaneously, so the number of vectorized steps
+    is the maximum valence.
+    """
+    n, count = mesh.vertex_count, mesh.halfedge_count
+    origin, target, twin = mesh.he_origin(), mesh.he_target(), mesh.he_twin
+    prev = np.empty(count, dtype=np.int64)
+    prev[mesh.he_next] = np.arange(count)
+    # Skip degenerate half-edges (duplicate vertices in face representations).
+    remaining = origin != target
+    # A fan of a boundary vertex starts at a corner with a boundary edge.
+    boundary_corner = (twin < 0) | (twin[prev] < 0)
+
+    next_position = np.zeros(n, dtype=np.int64)
+    owners, positions, neighbors, faces = [], [], [], []
+    # Non-manifold vertices may have several fans, so start walks while there are
+    # unvisited corners.
+    while remaining.any():
+        candidates = np.nonzero(remaining)[0]
+        order = np.lexsort((candidates, ~boundary_corner[candidates], origin[candidates]))
+        candidates = candidates[order]
+        first = np.ones(len(candidates), dtype=bool)
+        first[1:] = origin[candidates][1:] != origin[candidates][:-1]
+        current = candidates[first]
+        # 'flipped': the walk entered the corner through its incoming edge prev(h)
+        # rather than through its outgoing edge h, and leaves through h.
+        flipped = (twin[current] >= 0) & (twin[prev[current]] < 0)
+        while len(current):
+            vertices = origin[current]
+            entered, left = np.where(flipped, prev[current], current), np.where(flipped, current, prev[current])
+            owners.append(vertices)
+            positions.append(next_position[vertices])
+            neighbors.append(np.where(flipped, origin[entered], target[entered]))
+            faces.append(mesh.he_face[current])
+            next_position[vertices] += 1
+            remaining[current] = False
+            following = twin[left]
+            open_end = following < 0
+            if open_end.any():
+                # The last neighbour of an open fan is reached through the boundary edge.
+                ends = vertices[open_end]
+                owners.append(ends)
+                positions.append(next_position[ends])
+                neighbors.append(np.where(flipped, target[left], origin[left])[open_end])
+                faces.append(np.full(len(ends), -1, dtype=np.int64))
+                next_position[ends] += 1
+            vertices, following = vertices[~open_end], following[~open_end]
+            # The twin either leaves the vertex (entered through its outgoing edge)
+            # or comes into it (the corner is the next one, entered through its incoming edge).
+            outgoing = origin[following] == vertices
+            current = np.where(outgoing, following, mesh.he_next[following])
+            flipped = ~outgoing
+            keep = remaining[current]
+            current, flipped = current[keep], flipped[keep]
+
+    ring_owner = np.concatenate(owners) if owners else np.zeros(0, dtype=np.int64)
+    ring_position = np.concatenate(positions) if owners else np.zeros(0, dtype=np.int64)
+    ring_vertices = np.concatenate(neighbors) if owners else np.zeros(0, dtype=np.int64)
+    ring_faces = np.concatenate(faces) if owners else np.zeros(0, dtype=np.int64)
+    order = np.lexsort((ring_position, ring_owner))
+    # A one-ring lists every neighbour once; a repeated one means that the faces
+    # around the vertex do not form fans (e.g. faces glued at a vertex only).
+    pairs = np.lexsort((ring_vertices, ring_owner))
+    repeated = ((ring_owner[pairs][1:] == ring_owner[pairs][:-1]) &
+                (ring_vertices[pairs][1:] == ring_vertices[pairs][:-1]))
+    if repeated.any():
+        k = pairs[1:][np.argmax(repeated)]
+        raise Exception("The one-ring of vertex %d contains vertex %d twice: "
+                        "the mesh is not manifold around it." % (ring_owner[k], ring_vertices[k]))
+    ring_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ring_owner, minlength=n), out=ring_offsets[1:])
+    return ring_offsets, ring_vertices[order], ring_faces[order]
+
+
+def fan_triangles(face_offsets, face_indices):
+    """Returns a fan triangulation of the faces given in the CSR layout as a pair
+    (triangles, tri_faces) where triangles is a (t, 3) array of vertex indices and
+    tri_faces maps each triangle to the face it comes from.
+    """
+    sizes = np.diff(face_offsets)
+    tri_faces = np.repeat(np.arange(len(sizes)), np.maximum(sizes - 2, 0))
+    # Position of each triangle inside its face fan: 0, 1, ..., size - 3
+    fan_starts = np.cumsum(np.maximum(sizes - 2, 0)) - np.maximum(sizes - 2, 0)
+    k = np.arange(len(tri_faces)) - fan_starts[tri_faces]
+    base = face_offsets[tri_faces]
+    triangles = np.column_stack([face_indices[base],
+                                 face_indices[base + k + 1],
+                                 face_indices[base + k + 2]])
+    return triangles, tri_faces
+
+
+def _compact_faces(faces):
+    """Converts a list of faces into (face_offsets, face_indices) arrays,
+    removing consecutive (cyclically) duplicate vertex indices.
+    """
+    faces = [list(face) for face in faces]
+    sizes = np.array([len(face) for face in faces], dtype=np.int64)
+    flat = np.array([i for face in faces for i in face], dtype=np.int64)
+    offsets = np.zeros(len(faces) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    face_of = np.repeat(np.arange(len(faces)), sizes)
+    position = np.arange(len(flat)) - offsets[face_of]
+    next_position = offsets[face_of] + (position + 1) % sizes[face_of]
+    keep = flat != flat[next_position]
+    new_sizes = np.bincount(face_of[keep], minlength=len(faces))
+    new_offsets = np.zeros(len(faces) + 1, dtype=np.int64)
+    np.cumsum(new_sizes, out=new_offsets[1:])
+    return new_offsets, flat[keep]
+
+
+def _csr(rows, cols, n):
+    """Builds (offsets, indices) of a CSR pattern from unique (row, col) pairs."""
+    order = np.lexsort((cols, rows))
+    rows, cols = rows[order], cols[order]
+    if len(rows):
+        unique = np.ones(len(rows), dtype=bool)
+        unique[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows, cols = rows[unique], cols[unique]
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=offsets[1:])
+    return offsets, cols
+
+
+def _build_topology(n, face_offsets, face_indices):
+    """Computes all the connectivity arrays of the mesh in a vectorized way."""
+    face_count = len(face_offsets) - 1
+    sizes = np.diff(face_offsets)
+    he_face = np.repeat(np.arange(face_count), sizes)
+    he_next = np.arange(len(face_indices)) + 1
+    last = face_offsets[1:] - 1
+    he_next[last[sizes > 0]] = face_offsets[:-1][sizes > 0]
+
+    # Twins: the half-edges of the same edge {a, b}, matched through sorted edge keys
+    # regardless of their direction, so that inconsistently oriented faces are still
+    # connected (the twin of (a -> b) is then (a -> b) rather than (b -> a)).
+    origin = face_indices
+    target = face_indices[he_next]
+    valid = origin != target
+    he_twin = np.full(len(face_indices), -1, dtype=np.int64)
+    edges = np.nonzero(valid)[0]
+    keys = np.minimum(origin, target)[edges] * n + np.maximum(origin, target)[edges]
+    order = np.argsort(keys, kind="mergesort")
+    edges, keys = edges[order], keys[order]
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = keys[1:] != keys[:-1]
+    multiplicity = np.diff(np.append(np.nonzero(starts)[0], len(keys)))
+    if (multiplicity > 2).any():
+        k = np.nonzero(starts)[0][np.argmax(multiplicity > 2)]
+        raise Exception("Non-manifold edge (%d, %d): it is shared by %d faces." %
+                        (origin[edges[k]], target[edges[k]], multiplicity.max()))
+    pairs = np.nonzero(~starts)[0]
+    he_twin[edges[pairs]] = edges[pairs - 1]
+    he_twin[edges[pairs - 1]] = edges[pairs]
+    paired = he_twin >= 0
+    consistently_oriented = bool((origin[he_twin[paired]] == target[paired]).all())
+
+    # NOTE: Rhinoceros occasionally has duplicate vertices in face representations,
+    #       so we should prevent vertices from being adjacent to themselves.
+    vv_offsets, vv_indices = _csr(np.concatenate([origin[valid], target[valid]]),
+                                  np.concatenate([target[valid], origin[valid]]), n)
+    vf_offsets, vf_indices = _csr(origin, he_face, n)
+
+    return {
+        "he_face": he_face,
+        "he_next": he_next,
+        "he_twin": he_twin,
+        "consistently_oriented": consistently_oriented,
+        "vv_offsets": vv_offsets,
+        "vv_indices": vv_indices,
+        "vf_offsets": vf_offsets,
+        "vf_indices": vf_indices,
+        "derived": {},
+    }
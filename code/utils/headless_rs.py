@@ -0,0 +1,305 @@
+import math
+import uuid
+
+import numpy as np
+
+""" A stand-in for the subset of rhinoscriptsyntax used by this project.
+
+All the modules get rhinoscriptsyntax from utils/rs_backend.py, which falls back
+to this one when rhinoscriptsyntax cannot be imported, i.e. outside Rhinoceros,
+so the flows can be run by a plain Python interpreter (with NumPy). The "document" is an in-memory table of objects keyed by their ids;
+points and vectors are returned as lists of three floats, planes as tuples
+(origin, x axis, y axis, z axis), as the Rhino Plane object is indexed.
+There are no viewports, so the commands are ignored and GetObject() picks the most
+recently added object of the requested type instead of asking the user.
+"""
+
+
+class filter(object):
+    """Object type filters, as in rhinoscriptsyntax."""
+    allobjects = 0
+    point = 1
+    curve = 4
+    mesh = 32
+
+
+# The document: object id -> (object type, geometry)
+_objects = {}
+
+
+def _add(object_type, geometry):
+    object_id = str(uuid.uuid4())
+    _objects[object_id] = (object_type, geometry)
+    return object_id
+
+
+def _geometry(object_id, object_type):
+    if object_id not in _objects or _objects[object_id][0] != object_type:
+        raise Exception("%s is not an object of type %d." % (object_id, object_type))
+    return _objects[object_id][1]
+
+
+def _points(points):
+    return np.array(points, dtype=float).reshape(-1, 3)
+
+
+# ===== Document =====
+
+def GetObject(message=None, filter=0, preselect=False, select=False):
+    """Returns the most recently added object of the given type, or None."""
+    for object_id in reversed(list(_objects)):
+        if not filter or _objects[object_id][0] & filter:
+            return object_id
+    return None
+
+
+def DeleteObject(object_id):
+    return _objects.pop(object_id, None) is not None
+
+
+def DeleteObjects(object_ids):
+    return sum(DeleteObject(object_id) for object_id in object_ids)
+
+
+def AllObjects():
+    return list(_objects)
+
+
+def IsObject(object_id):
+    return object_id in _objects
+
+
+def ObjectType(object_id):
+    return _objects[object_id][0]
+
+
+def IsMesh(object_id):
+    return IsObject(object_id) and ObjectType(object_id) == filter.mesh
+
+
+def IsCurve(object_id):
+    return IsObject(object_id) and ObjectType(object_id) == filter.curve
+
+
+def ScaleObject(object_id, origin, scale, copy=False):
+    object_type, geometry = _objects[object_id]
+    origin = np.array(origin, dtype=float)
+    scale = np.array(scale, dtype=float)
+    if object_type == filter.mesh:
+        vertices, faces = geometry
+        geometry = ((vertices - origin) * scale + origin, faces)
+    else:
+        geometry = (geometry - origin) * scale + origin
+    if copy:
+        return _add(object_type, geometry)
+    _objects[object_id] = (object_type, geometry)
+    return object_id
+
+
+def Command(command, echo=True):
+    """Commands (e.g. -ViewCaptureToFile) need Rhinoceros; they are ignored here."""
+    return False
+
+
+# ===== Points and curves =====
+
+def AddPoint(point):
+    return _add(filter.point, _points([point]))
+
+
+def AddLine(start, end):
+    return _add(filter.curve, _points([start, end]))
+
+
+def AddPolyline(points, replace_id=None):
+    points = _points(points)
+    if replace_id is not None and replace_id in _objects:
+        _objects[replace_id] = (filter.curve, points)
+        return replace_id
+    return _add(filter.curve, points)
+
+
+def PolylineVertices(curve_id, segment_index=-1):
+    return _geometry(curve_id, filter.curve).tolist()
+
+
+def CurveArrows(curve_id, arrow_style=None):
+    return True
+
+
+def CurveLength(curve_id, segment_index=-1, sub_domain=None):
+    points = _geometry(curve_id, filter.curve)
+    return float(np.sqrt(((points[1:] - points[:-1]) ** 2).sum(axis=1)).sum())
+
+
+def CurveArea(curve_id):
+    """Returns [area, absolute error] for a closed planar polyline."""
+    points = _geometry(curve_id, filter.curve)
+    return [float(np.linalg.norm(np.cross(points[:-1], points[1:]).sum(axis=0))) / 2, 0.0]
+
+
+# ===== Meshes =====
+
+def AddMesh(vertices, face_vertices, vertex_normals=None, texture_coordinates=None,
+            vertex_colors=None):
+    # Like Rhino, represent triangles as quads with the last vertex repeated.
+    faces = []
+    for index, face in enumerate(face_vertices):
+        if len(face) not in (3, 4):
+            # NOTE: Rhino meshes have only triangles and quads, and so does this document.
+            raise Exception("Face %d has %d vertices; a mesh face must be a triangle or a quad."
+                            % (index, len(face)))
+        faces.append(tuple(face) if len(face) == 4 else (face[0], face[1], face[2], face[2]))
+    return _add(filter.mesh, (_points(vertices), faces))
+
+
+def MeshVertices(object_id):
+    return _geometry(object_id, filter.mesh)[0].tolist()
+
+
+def MeshFaceVertices(object_id):
+    return list(_geometry(object_id, filter.mesh)[1])
+
+
+def MeshVertexCount(object_id):
+    return len(_geometry(object_id, filter.mesh)[0])
+
+
+def MeshFaceCount(object_id):
+    return len(_geometry(object_id, filter.mesh)[1])
+
+
+def MeshFaceNormals(object_id):
+    vertices, faces = _geometry(object_id, filter.mesh)
+    faces = np.array(faces, dtype=np.int64).reshape(-1, 4)
+    # As in Rhino, the normal of a quad is the cross product of its diagonals.
+    p = vertices[faces]
+    triangle = faces[:, 2] == faces[:, 3]
+    normals = np.cross(p[:, 2] - p[:, 0], p[:, 3] - p[:, 1])
+    normals[triangle] = np.cross(p[triangle, 1] - p[triangle, 0], p[triangle, 2] - p[triangle, 0])
+    lengths = np.sqrt((normals ** 2).sum(axis=1))
+    return (normals / np.where(lengths > 0, lengths, 1)[:, None]).tolist()
+
+
+def MeshFaceCenters(object_id):
+    vertices, faces = _geometry(object_id, filter.mesh)
+    faces = np.array(faces, dtype=np.int64).reshape(-1, 4)
+    triangle = faces[:, 2] == faces[:, 3]
+    sums = vertices[faces[:, :3]].sum(axis=1) + np.where(triangle[:, None], 0, vertices[faces[:, 3]])
+    return (sums / np.where(triangle, 3.0, 4.0)[:, None]).tolist()
+
+
+# ===== Vectors =====
+
+def VectorCreate(to_point, from_point):
+    return [float(a) - float(b) for a, b in zip(to_point, from_point)]
+
+
+def VectorAdd(vector1, vector2):
+    return [float(a) + float(b) for a, b in zip(vector1, vector2)]
+
+
+def VectorSubtract(vector1, vector2):
+    return VectorCreate(vector1, vector2)
+
+
+def PointAdd(point1, point2):
+    return VectorAdd(point1, point2)
+
+
+def VectorScale(vector, scale):
+    return [float(a) * scale for a in vector]
+
+
+def VectorReverse(vector):
+    return [-float(a) for a in vector]
+
+
+def VectorDotProduct(vector1, vector2):
+    return sum(float(a) * float(b) for a, b in zip(vector1, vector2))
+
+
+def VectorCrossProduct(vector1, vector2):
+    return [vector1[1] * vector2[2] - vector1[2] * vector2[1],
+            vector1[2] * vector2[0] - vector1[0] * vector2[2],
+            vector1[0] * vector2[1] - vector1[1] * vector2[0]]
+
+
+def VectorLength(vector):
+    return math.sqrt(VectorDotProduct(vector, vector))
+
+
+def VectorUnitize(vector):
+    """Returns the unit vector, or None for the zero vector (as rhinoscriptsyntax does)."""
+    length = VectorLength(vector)
+    if length == 0:
+        return None
+    return VectorScale(vector, 1.0 / length)
+
+
+def VectorAngle(vector1, vector2):
+    """Returns the angle between the vectors in degrees."""
+    vector1, vector2 = VectorUnitize(vector1), VectorUnitize(vector2)
+    if vector1 is None or vector2 is None:
+        return None
+    return math.degrees(math.acos(max(-1.0, min(1.0, VectorDotProduct(vector1, vector2)))))
+
+
+def VectorRotate(vector, angle_degrees, axis):
+    """Rotates the vector about the axis (Rodrigues' rotation formula)."""
+    axis = VectorUnitize(axis)
+    angle = math.radians(angle_degrees)
+    cos, sin = math.cos(angle), math.sin(angle)
+    cross = VectorCrossProduct(axis, vector)
+    dot = VectorDotProduct(axis, vector)
+    return [vector[k] * cos + cross[k] * sin + axis[k] * dot * (1 - cos) for k in range(3)]
+
+
+# ===== Planes and transformations =====
+
+def PlaneFitFromPoints(points):
+    """Returns the least squares plane through the points, or None if the points
+    do not define a plane (there are less than three of them or they are collinear).
+    """
+    points = _points(points)
+    if len(points) < 3:
+        return None
+    origin = points.mean(axis=0)
+    _, singular_values, axes = np.linalg.svd(points - origin)
+    if singular_values[1] <= 1e-12 * max(singular_values[0], 1e-300):
+        return None
+    return (origin.tolist(), axes[0].tolist(), axes[1].tolist(), np.cross(axes[0], axes[1]).tolist())
+
+
+def PlaneEquation(plane):
+    """Returns the coefficients (a, b, c, d) of the plane equation ax + by + cz + d = 0."""
+    origin, normal = plane[0], plane[3]
+    return (normal[0], normal[1], normal[2], -VectorDotProduct(normal, origin))
+
+
+def PlanePlaneIntersection(plane1, plane2):
+    """Returns the intersection line of the planes as a pair of points,
+    or None if the planes are parallel.
+    """
+    direction = VectorCrossProduct(plane1[3], plane2[3])
+    if VectorLength(direction) <= 1e-12:
+        return None
+    a1, b1, c1, d1 = PlaneEquation(plane1)
+    a2, b2, c2, d2 = PlaneEquation(plane2)
+    point = np.linalg.lstsq(np.array([[a1, b1, c1], [a2, b2, c2]]), np.array([-d1, -d2]),
+                            rcond=None)[0]
+    return (point.tolist(), (point + direction).tolist())
+
+
+def XformTranslation(vector):
+    return [[1.0, 0.0, 0.0, float(vector[0])],
+            [0.0, 1.0, 0.0, float(vector[1])],
+            [0.0, 0.0, 1.0, float(vector[2])],
+            [0.0, 0.0, 0.0, 1.0]]
+
+
+def PlaneTransform(plane, xform):
+    xform = np.array(xform, dtype=float)
+    origin = xform[:3, :3].dot(plane[0]) + xform[:3, 3]
+    axes = [xform[:3, :3].dot(axis).tolist() for axis in plane[1:]]
+    return (origin.tolist(), axes[0], axes[1], axes[2])
@@ -0,0 +1,208 @@
+try:
+    import numpy as np
+    import scipy.sparse as sparse
+    import scipy.sparse.linalg as sparse_linalg
+except ImportError:
+    np = sparse = sparse_linalg = None
+
+""" Sparse discrete Laplace operators of a HalfEdgeMesh. """
+
+
+def available():
+    """Returns True if NumPy and SciPy are available."""
+    return sparse is not None
+
+
+def uniform_laplacian(mesh):
+    """Returns the uniform (graph) Laplacian L of the mesh as a sparse CSR matrix,
+    so that (L * X)[i] = sum over the neighbours j of i of (X[j] - X[i]).
+    The matrix depends only on the connectivity and is assembled once per topology.
+    """
+    return mesh.cached("uniform_laplacian", _assemble_uniform_laplacian)
+
+
+def cotan_laplacian(mesh):
+    """Returns the cotangent Laplacian of the mesh as a sparse CSR matrix:
+    (L * X)[i] = sum over the edges (i, j) of (cot(alpha_ij) + cot(beta_ij)) / 2 * (X[j] - X[i]),
+    alpha_ij and beta_ij being the angles opposite to the edge (i, j).
+    Non-triangular faces are fan-triangulated first.
+    """
+    return mesh.cached("cotan_laplacian", _assemble_cotan_laplacian, topological=False)
+
+
+def laplacian(mesh, weights="uniform"):
+    """Returns the Laplacian of the mesh with the given weights ("uniform" or "cotan")."""
+    if weights == "uniform":
+        return uniform_laplacian(mesh)
+    elif weights == "cotan":
+        return cotan_laplacian(mesh)
+    raise Exception("Unknown Laplacian weights: %s" % weights)
+
+
+def motion_vectors(mesh, step, weights="uniform", normalize=True):
+    """Returns an (n, 3) array of Laplacian vectors L * X, computed with a single
+    sparse matrix-vector product and rescaled to the length 'step' in one batch
+    (or, if normalize is False, multiplied by 'step': an explicit Euler step).
+    Vertices with a zero Laplacian get a zero motion vector.
+    """
+    vectors = laplacian(mesh, weights).dot(mesh.vertices)
+    if not normalize:
+        return step * vectors
+    return resize_rows(vectors, step)
+
+
+def implicit_uniform_solver(mesh, t):
+    """Returns a function solving (I - t * L) * X = B for the uniform Laplacian L.
+    The matrix depends only on the connectivity and the time step, so it is
+    factorized once and the factorization is shared by all the meshes with the
+    same topology; every subsequent solve costs just a pair of triangular solves.
+    Only the factorization for the last t is kept: with an adaptive step, t changes
+    from one iteration to the next, and the older factorizations would pile up.
+    """
+    latest = mesh.cached("implicit_uniform_solver", lambda mesh: {})
+    if latest.get("t") != float(t):
+        n = mesh.vertex_count
+        system = (sparse.identity(n, format="csc") - t * uniform_laplacian(mesh)).tocsc()
+        # Release the previous factorization before computing the new one.
+        latest.clear()
+        latest["solve"] = sparse_linalg.factorized(system)
+        latest["t"] = float(t)
+    return latest["solve"]
+
+
+def implicit_uniform_step(mesh, t):
+    """Performs one backward Euler step of the uniform Laplacian (harmonic) flow,
+    i.e. solves (I - t * L) * X_new = X for the new (n, 3) vertex positions.
+    Unlike the explicit step, this one is unconditionally stable for any t > 0.
+    """
+    solve = implicit_uniform_solver(mesh, t)
+    return np.column_stack([solve(mesh.vertices[:, k]) for k in range(3)])
+
+
+def mass_matrix(mesh):
+    """Returns the lumped (barycentric) mass matrix of the mesh as a sparse diagonal
+    matrix: each vertex gets one third of the area of every incident triangle.
+    """
+    return mesh.cached("mass_matrix", _assemble_mass_matrix, topological=False)
+
+
+def mean_curvature_step(mesh, t, preconditioner="jacobi", tol=1e-8, maxiter=None):
+    """Performs one semi-implicit step of the mean curvature flow:
+    solves (M - t * L) * X_new = M * X with the cotangent Laplacian L and the lumped
+    mass matrix M, both assembled at the current positions X. The system is symmetric
+    positive definite, so it is solved with the preconditioned conjugate gradient
+    method, warm-started from X; as the matrix changes only slightly from one step
+    to the next, this usually takes just a few iterations.
+
+    The preconditioner may be "jacobi" or "ilu" (incomplete LU factorization, which
+    stands in for the incomplete Cholesky one missing in SciPy), or None.
+    Returns a pair (new_vertices, cg_iterations).
+    """
+    mass = mass_matrix(mesh)
+    system = (mass - t * cotan_laplacian(mesh)).tocsr()
+    rhs = mass.dot(mesh.vertices)
+    if preconditioner == "jacobi":
+        inverse_diagonal = 1.0 / system.diagonal()
+        precondition = lambda r: r * inverse_diagonal[:, None]
+    elif preconditioner == "ilu":
+        ilu = sparse_linalg.spilu(system.tocsc())
+        precondition = lambda r: np.column_stack([ilu.solve(r[:, k]) for k in range(r.shape[1])])
+    elif preconditioner is None:
+        precondition = lambda r: r
+    else:
+        raise Exception("Unknown preconditioner: %s" % preconditioner)
+    return conjugate_gradient(system, rhs, mesh.vertices, precondition, tol, maxiter)
+
+
+def conjugate_gradient(A, B, X0, precondition, tol=1e-8, maxiter=None):
+    """Solves A * X = B for a symmetric positive definite sparse matrix A and several
+    right-hand sides at once (the columns of B), starting from X0. Each column runs its
+    own preconditioned CG recurrence, but all of them share a single sparse product
+    per iteration. Stops once every residual norm drops below tol * |B[:, k]|.
+    Returns a pair (X, iterations).
+    """
+    maxiter = maxiter or 10 * A.shape[0]
+    X = np.array(X0, dtype=float)
+    R = B - A.dot(X)
+    Z = precondition(R)
+    P = Z.copy()
+    rz = np.einsum("ij,ij->j", R, Z)
+    thresholds = tol * np.maximum(np.sqrt(np.einsum("ij,ij->j", B, B)), 1e-300)
+    iterations = 0
+    while iterations < maxiter:
+        active = np.sqrt(np.einsum("ij,ij->j", R, R)) > thresholds
+        if not active.any():
+            break
+        AP = A.dot(P)
+        pap = np.einsum("ij,ij->j", P, AP)
+        alpha = np.where(active, rz / np.where(pap != 0, pap, 1), 0)
+        X += P * alpha
+        R -= AP * alpha
+        Z = precondition(R)
+        rz_new = np.einsum("ij,ij->j", R, Z)
+        beta = np.where(active, rz_new / np.where(rz != 0, rz, 1), 0)
+        P = Z + P * beta
+        rz = rz_new
+        iterations += 1
+    return X, iterations
+
+
+def resize_rows(vectors, length):
+    """Rescales each row of the (n, 3) array to the given length (zero rows stay zero)."""
+    norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+    scale = np.zeros_like(norms)
+    nonzero = norms > 0
+    scale[nonzero] = length / norms[nonzero]
+    return vectors * scale[:, None]
+
+
+def cotan_weights(vertices, triangles):
+    """Returns the cotangents of the three corner angles of each triangle as a (t, 3) array;
+    column k corresponds to the angle at triangles[:, k], i.e. opposite to the edge
+    (triangles[:, k + 1], triangles[:, k + 2]).
+    """
+    p = vertices[triangles]
+    cots = np.empty((len(triangles), 3))
+    for k in range(3):
+        u = p[:, (k + 1) % 3] - p[:, k]
+        v = p[:, (k + 2) % 3] - p[:, k]
+        dot = np.einsum("ij,ij->i", u, v)
+        cross = np.sqrt(np.maximum(np.einsum("ij,ij->i", np.cross(u, v), np.cross(u, v)), 0))
+        # Degenerate (zero-area) triangles do not contribute.
+        cots[:, k] = np.where(cross > 0, dot / np.where(cross > 0, cross, 1), 0)
+    return cots
+
+
+def _assemble_mass_matrix(mesh):
+    triangles, _ = mesh.triangles()
+    p = mesh.vertices[triangles]
+    cross = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    areas = np.sqrt(np.einsum("ij,ij->i", cross, cross)) / 2
+    masses = np.bincount(triangles.ravel(), weights=np.repeat(areas / 3, 3),
+                         minlength=mesh.vertex_count)
+    return sparse.diags(masses).tocsr()
+
+
+def _assemble_uniform_laplacian(mesh):
+    n = mesh.vertex_count
+    adjacency = sparse.csr_matrix((np.ones(len(mesh.vv_indices)), mesh.vv_indices, mesh.vv_offsets),
+                                  shape=(n, n))
+    degrees = np.diff(mesh.vv_offsets).astype(float)
+    return (adjacency - sparse.diags(degrees)).tocsr()
+
+
+def _assemble_cotan_laplacian(mesh):
+    n = mesh.vertex_count
+    triangles, _ = mesh.triangles()
+    cots = cotan_weights(mesh.vertices, triangles)
+    rows, cols, data = [], [], []
+    for k in range(3):
+        i = triangles[:, (k + 1) % 3]
+        j = triangles[:, (k + 2) % 3]
+        w = cots[:, k] / 2
+        rows.extend([i, j])
+        cols.extend([j, i])
+        data.extend([w, w])
+    weights = sparse.coo_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                                shape=(n, n)).tocsr()
+    return (weights - sparse.diags(np.asarray(weights.sum(axis=1)).ravel())).tocsr()
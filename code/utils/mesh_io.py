@@ -0,0 +1,363 @@
+import os
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils.halfedge_mesh import HalfEdgeMesh, fan_triangles
+from utils.mesh_snapshot import MeshSnapshot
+from utils.topology_cache import TopologyCache
+
+""" Reading and writing meshes in the PLY, STL and OBJ formats (requires NumPy). """
+
+
+# PLY property types
+_PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+
+# A binary STL triangle record: the normal, the three vertices and the attribute count.
+_STL_RECORD = [("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attributes", "<u2")]
+
+# Large meshes are written in chunks of this many faces, to bound the memory overhead.
+_CHUNK_SIZE = 1 << 20
+
+
+def available():
+    """Returns True if NumPy is available."""
+    return np is not None
+
+
+def read(path):
+    """Reads a mesh from a PLY (binary or ASCII), STL (binary or ASCII) or OBJ file.
+    Returns a tuple (vertices, face_offsets, face_indices) of NumPy arrays in the
+    layout of HalfEdgeMesh: the vertex indices of face f are
+    face_indices[face_offsets[f]:face_offsets[f + 1]].
+
+    Binary files are memory-mapped rather than read, so the vertex and face records are
+    turned into these arrays by a single vectorized conversion each, without building
+    any intermediate Python objects; text files are streamed line by line.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".ply":
+        return _read_ply(path)
+    elif extension == ".stl":
+        return _read_stl(path)
+    elif extension == ".obj":
+        return _read_obj(path)
+    raise Exception("Unsupported mesh file format: %s" % path)
+
+
+def write(path, mesh):
+    """Writes a mesh to a binary PLY or STL file. The mesh may be a HalfEdgeMesh,
+    a MeshSnapshot or a tuple of arrays (vertices, face_offsets, face_indices), as
+    returned from read() and the generators; in the latter case no mesh topology is
+    built. Faces with more than three vertices are fan-triangulated for STL.
+    """
+    if isinstance(mesh, MeshSnapshot):
+        mesh = mesh.mesh
+    if isinstance(mesh, HalfEdgeMesh):
+        mesh = (mesh.vertices, mesh.face_offsets, mesh.face_indices)
+    vertices, face_offsets, face_indices = mesh
+    vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+    face_offsets = np.asarray(face_offsets, dtype=np.int64)
+    face_indices = np.asarray(face_indices, dtype=np.int64)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".ply":
+        _write_ply(path, vertices, face_offsets, face_indices)
+    elif extension == ".stl":
+        _write_stl(path, vertices, face_offsets, face_indices)
+    else:
+        raise Exception("Unsupported mesh file format for writing: %s" % path)
+
+
+def load(path, topology_cache=None):
+    """Reads a mesh file into a MeshSnapshot which is not in the Rhino document.
+    The flows accept it in place of a mesh id (see flow_file()).
+    """
+    vertices, face_offsets, face_indices = read(path)
+    mesh = HalfEdgeMesh(vertices, face_offsets, face_indices, topology_cache=topology_cache)
+    return MeshSnapshot(None, topology_cache, mesh)
+
+
+def add_mesh(path):
+    """Adds the mesh stored in the given file to the Rhino document and returns its id."""
+    return load(path).commit()
+
+
+def flow_file(flow_func, iterations, input_path, output_path, *args, **kwargs):
+    """Performs the given number of iterations of a mesh flow (e.g. face_flow.flow)
+    on the mesh stored in input_path and writes the result to output_path.
+    The flow runs entirely in memory (with commit=False), so neither Rhinoceros nor
+    its document is involved. Returns the resulting MeshSnapshot.
+    """
+    if "topology_cache" not in kwargs:
+        kwargs["topology_cache"] = TopologyCache()
+    kwargs["commit"] = False
+    snapshot = load(input_path, kwargs["topology_cache"])
+    for i in range(iterations):
+        snapshot = flow_func(snapshot, *args, **kwargs)
+    write(output_path, snapshot)
+    return snapshot
+
+
+def _read_ply(path):
+    with open(path, "rb") as f:
+        if f.readline().strip() != b"ply":
+            raise Exception("Not a PLY file: %s" % path)
+        file_format = None
+        elements = []
+        while True:
+            line = f.readline()
+            if not line:
+                raise Exception("Unexpected end of the PLY header: %s" % path)
+            tokens = line.decode("ascii").split()
+            if not tokens or tokens[0] in ("comment", "obj_info"):
+                continue
+            if tokens[0] == "end_header":
+                break
+            elif tokens[0] == "format":
+                file_format = tokens[1]
+            elif tokens[0] == "element":
+                elements.append((tokens[1], int(tokens[2]), []))
+            elif tokens[0] == "property":
+                if tokens[1] == "list":
+                    elements[-1][2].append((tokens[4], _PLY_TYPES[tokens[2]], _PLY_TYPES[tokens[3]]))
+                else:
+                    elements[-1][2].append((tokens[2], _PLY_TYPES[tokens[1]], None))
+        header_size = f.tell()
+
+    if file_format == "ascii":
+        return _read_ply_ascii(path, header_size, elements)
+    if file_format not in ("binary_little_endian", "binary_big_endian"):
+        raise Exception("Unsupported PLY format: %s" % file_format)
+    endian = "<" if file_format == "binary_little_endian" else ">"
+
+    vertices = face_offsets = face_indices = None
+    offset = header_size
+    for name, count, properties in elements:
+        if name == "vertex":
+            dtype = np.dtype([(prop, endian + kind) for prop, kind, _ in properties])
+            records = _memmap(path, dtype, offset, count)
+            vertices = np.column_stack([records["x"], records["y"], records["z"]]).astype(float)
+            offset += dtype.itemsize * count
+        elif name == "face":
+            face_offsets, face_indices, offset = _read_ply_faces(path, offset, count, properties, endian)
+        elif any(list_type is not None for _, _, list_type in properties):
+            if vertices is not None and face_offsets is not None:
+                break
+            raise Exception("Unsupported PLY element with list properties: %s" % name)
+        else:
+            offset += np.dtype([(prop, endian + kind) for prop, kind, _ in properties]).itemsize * count
+    if vertices is None or face_offsets is None:
+        raise Exception("The PLY file has no vertices or no faces: %s" % path)
+    return vertices, face_offsets, face_indices
+
+
+def _read_ply_faces(path, offset, count, properties, endian):
+    lists = [k for k, (_, _, list_type) in enumerate(properties) if list_type is not None]
+    if len(lists) != 1:
+        raise Exception("Unsupported PLY face element: %s" % (properties,))
+    k = lists[0]
+    size_dtype = np.dtype(endian + properties[k][1])
+    index_dtype = np.dtype(endian + properties[k][2])
+    before = [(prop, endian + kind) for prop, kind, _ in properties[:k]]
+    after = [(prop, endian + kind) for prop, kind, _ in properties[k + 1:]]
+    if count == 0:
+        return np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64), offset
+    data = _memmap(path, np.dtype("u1"), offset, os.path.getsize(path) - offset)
+    before_size = np.dtype(before).itemsize if before else 0
+    after_size = np.dtype(after).itemsize if after else 0
+
+    # NOTE: Most meshes have faces of the same size, so first try to map all the faces
+    #       as fixed-size records with the size of the first face.
+    first_size = int(data[before_size:before_size + size_dtype.itemsize].view(size_dtype)[0])
+    dtype = np.dtype(before + [("size", size_dtype), ("indices", index_dtype, (first_size,))] + after)
+    if dtype.itemsize * count <= len(data):
+        records = data[:dtype.itemsize * count].view(dtype)
+        if (records["size"] == first_size).all():
+            face_offsets = np.arange(count + 1, dtype=np.int64) * first_size
+            face_indices = records["indices"].astype(np.int64).ravel()
+            return face_offsets, face_indices, offset + dtype.itemsize * count
+
+    # Faces of different sizes: find where each record starts, then gather all the
+    # indices at once. A record starts where the previous one ends, so compute for every
+    # byte where a record starting there would end, and follow these links from the first
+    # byte by pointer jumping: each round doubles both the number of the record starts
+    # found and the length of the jump, so the starts are found in log2(count) rounds.
+    length = len(data)
+    head_size = before_size + size_dtype.itemsize
+    candidates = max(length - head_size + 1, 0)
+    size_bytes = data[np.arange(candidates)[:, None] + before_size + np.arange(size_dtype.itemsize)]
+    record_ends = (np.arange(candidates, dtype=np.int64) + head_size + after_size +
+                   np.ascontiguousarray(size_bytes).view(size_dtype).ravel().astype(np.int64) *
+                   index_dtype.itemsize)
+    # The records ending past the data lead to length + 1, and the end of the data
+    # (length) and length + 1 both lead to themselves.
+    next_record = np.empty(length + 2, dtype=np.int32 if length < 2 ** 31 - 2 else np.int64)
+    next_record[:candidates] = np.minimum(record_ends, length + 1)
+    next_record[candidates:] = length + 1
+    next_record[length] = length
+    record_starts = np.zeros(1, dtype=next_record.dtype)
+    jump = next_record
+    while True:
+        record_starts = np.concatenate([record_starts, jump[record_starts]])
+        if len(record_starts) >= count:
+            break
+        jump = jump[jump]
+    record_starts = record_starts[:count]
+    position = int(next_record[record_starts[-1]])
+    if record_starts[-1] >= length or position > length:
+        raise Exception("The PLY file is truncated: %s" % path)
+    starts = record_starts.astype(np.int64) + head_size
+    sizes = (next_record[record_starts] - starts - after_size) // index_dtype.itemsize
+    face_offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(sizes, out=face_offsets[1:])
+    byte_positions = (np.repeat(starts - face_offsets[:-1] * index_dtype.itemsize, sizes) +
+                      np.arange(face_offsets[-1]) * index_dtype.itemsize)
+    index_bytes = data[byte_positions[:, None] + np.arange(index_dtype.itemsize)]
+    face_indices = np.ascontiguousarray(index_bytes).view(index_dtype).ravel().astype(np.int64)
+    return face_offsets, face_indices, offset + position
+
+
+def _read_ply_ascii(path, header_size, elements):
+    vertices = array("d")
+    sizes, indices = array("l"), array("l")
+    with open(path, "rb") as f:
+        f.seek(header_size)
+        for name, count, properties in elements:
+            if name == "vertex":
+                names = [prop for prop, _, _ in properties]
+                columns = [names.index("x"), names.index("y"), names.index("z")]
+                for _ in range(count):
+                    values = f.readline().split()
+                    vertices.extend(float(values[c]) for c in columns)
+            elif name == "face":
+                k = [list_type is not None for _, _, list_type in properties].index(True)
+                for _ in range(count):
+                    values = f.readline().split()
+                    # Scalar properties before the list take one value each.
+                    size = int(values[k])
+                    sizes.append(size)
+                    indices.extend(int(i) for i in values[k + 1:k + 1 + size])
+            else:
+                for _ in range(count):
+                    f.readline()
+    return _arrays(vertices, sizes, indices)
+
+
+def _read_stl(path):
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = f.read(84)
+    if len(header) == 84 and 84 + 50 * int(np.frombuffer(header[80:84], "<u4")[0]) == size:
+        count = int(np.frombuffer(header[80:84], "<u4")[0])
+        corners = _memmap(path, np.dtype(_STL_RECORD), 84, count)["vertices"].reshape(-1, 3)
+    else:
+        coordinates = array("d")
+        with open(path, "rb") as f:
+            for line in f:
+                values = line.split()
+                if values and values[0] == b"vertex":
+                    coordinates.extend(float(v) for v in values[1:4])
+        corners = np.frombuffer(coordinates, dtype=float).reshape(-1, 3)
+    # STL stores the corners of each triangle separately: weld the identical ones
+    # (adding 0.0 turns -0.0 into 0.0, so that they are welded as well).
+    # The corners are sorted by the bit patterns of their coordinates, which is much
+    # faster than np.unique() on rows.
+    corners = np.ascontiguousarray(corners + corners.dtype.type(0))
+    bits = corners.view("u%d" % corners.dtype.itemsize)
+    order = np.lexsort((bits[:, 2], bits[:, 1], bits[:, 0]))
+    sorted_bits = bits[order]
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = (sorted_bits[1:] != sorted_bits[:-1]).any(axis=1)
+    face_indices = np.empty(len(order), dtype=np.int64)
+    face_indices[order] = np.cumsum(new) - 1
+    vertices = corners[order[new]].astype(float)
+    face_offsets = np.arange(len(corners) // 3 + 1, dtype=np.int64) * 3
+    return vertices, face_offsets, face_indices
+
+
+def _read_obj(path):
+    vertices = array("d")
+    sizes, indices = array("l"), array("l")
+    with open(path, "rb") as f:
+        for line in f:
+            values = line.split()
+            if not values:
+                continue
+            if values[0] == b"v":
+                vertices.extend(float(v) for v in values[1:4])
+            elif values[0] == b"f":
+                n = len(vertices) // 3
+                # Indices are 1-based; negative ones are relative to the last vertex.
+                face = [int(v.split(b"/")[0]) for v in values[1:]]
+                indices.extend(i - 1 if i > 0 else n + i for i in face)
+                sizes.append(len(face))
+    return _arrays(vertices, sizes, indices)
+
+
+def _write_ply(path, vertices, face_offsets, face_indices):
+    count = len(face_offsets) - 1
+    header = ("ply\nformat binary_little_endian 1.0\n"
+              "element vertex %d\nproperty double x\nproperty double y\nproperty double z\n"
+              "element face %d\nproperty list uchar int vertex_indices\nend_header\n" %
+              (len(vertices), count))
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        np.ascontiguousarray(vertices, dtype="<f8").tofile(f)
+        for start in range(0, count, _CHUNK_SIZE):
+            end = min(start + _CHUNK_SIZE, count)
+            offsets = face_offsets[start:end + 1]
+            _ply_face_records(offsets - offsets[0], face_indices[offsets[0]:offsets[-1]]).tofile(f)
+
+
+def _ply_face_records(face_offsets, face_indices):
+    """Returns the bytes of the PLY face records: the size byte followed by the indices."""
+    sizes = np.diff(face_offsets)
+    if len(sizes) and (sizes == sizes[0]).all():
+        records = np.empty(len(sizes), dtype=[("size", "u1"), ("indices", "<i4", (sizes[0],))])
+        records["size"] = sizes[0]
+        records["indices"] = face_indices.reshape(-1, sizes[0])
+        return records
+    starts = np.arange(len(sizes)) + 4 * face_offsets[:-1]
+    records = np.empty(len(sizes) + 4 * len(face_indices), dtype=np.uint8)
+    records[starts] = sizes
+    byte_positions = (np.repeat(starts + 1 - 4 * face_offsets[:-1], sizes) +
+                      4 * np.arange(len(face_indices)))
+    records[byte_positions[:, None] + np.arange(4)] = \
+        face_indices.astype("<i4").view(np.uint8).reshape(-1, 4)
+    return records
+
+
+def _write_stl(path, vertices, face_offsets, face_indices):
+    triangles, _ = fan_triangles(face_offsets, face_indices)
+    with open(path, "wb") as f:
+        f.write(b"binary STL".ljust(80, b" "))
+        f.write(np.array([len(triangles)], dtype="<u4").tobytes())
+        for start in range(0, len(triangles), _CHUNK_SIZE):
+            corners = vertices[triangles[start:start + _CHUNK_SIZE]]
+            records = np.zeros(len(corners), dtype=np.dtype(_STL_RECORD))
+            normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+            lengths = np.sqrt((normals ** 2).sum(axis=1))
+            records["normal"] = normals / np.where(lengths > 0, lengths, 1)[:, None]
+            records["vertices"] = corners
+            records.tofile(f)
+
+
+def _memmap(path, dtype, offset, count):
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+def _arrays(vertices, sizes, indices):
+    face_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(np.frombuffer(sizes, dtype=sizes.typecode), out=face_offsets[1:])
+    return (np.frombuffer(vertices, dtype=float).reshape(-1, 3).copy(), face_offsets,
+            np.frombuffer(indices, dtype=indices.typecode).astype(np.int64))
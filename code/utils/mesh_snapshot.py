@@ -0,0 +1,194 @@
+from utils.rs_backend import rs
+
+try:
+    import Rhino
+    import scriptcontext as sc
+except ImportError:
+    Rhino = sc = None
+
+from utils import halfedge_mesh as hem
+from utils import profiling
+
+""" Geometry snapshot of a Rhino mesh shared by the checks, the flows and the drawing. """
+
+
+class MeshSnapshot(object):
+    """Fetches the vertices and faces of a Rhino mesh once, in bulk, and lazily derives
+    everything else (face normals, centers, points, planes, the HalfEdgeMesh), memoizing
+    each attribute on first use. All the helpers in mesh_utils, face_flow and
+    harmonic_flow accept a snapshot in place of a mesh id, so a flow step fetches
+    the mesh from Rhino only once.
+
+    The derived geometry is invalidated by set_vertices(); the connectivity-derived
+    structures live in the (optional) TopologyCache and survive it. After that, the
+    snapshot no longer matches the Rhino object, so the face normals and centers are
+    computed from the new vertices instead of being fetched from Rhino.
+    A detached snapshot is written back to the document with commit().
+
+    A snapshot may also be taken of a HalfEdgeMesh which is not in the document (e.g.
+    one read from a file, see mesh_io.load()); it is then detached from the start, and
+    mesh_id is None until the first commit() adds the mesh to the document.
+
+    'residuals' may be set by the flow step which computed the vertices (e.g. the
+    per-vertex residuals of the face flow, see face_flow.flow()); set_vertices() resets it.
+    """
+
+    def __init__(self, mesh_id, topology_cache=None, mesh=None):
+        self.mesh_id = mesh_id
+        self.topology_cache = topology_cache
+        self.residuals = None
+        self._memo = {}
+        if mesh is None:
+            self.vertices = rs.MeshVertices(mesh_id)
+            self._face_vertices = rs.MeshFaceVertices(mesh_id)
+            self._detached = False
+            self._modified = False
+        else:
+            self.vertices = mesh.vertices
+            self._face_vertices = None
+            self._memo["mesh"] = mesh
+            self._detached = True
+            self._modified = True
+
+    @classmethod
+    def of(cls, mesh, topology_cache=None):
+        """Returns the given snapshot as is, or takes a snapshot of the given mesh id."""
+        if isinstance(mesh, MeshSnapshot):
+            return mesh
+        return cls(mesh, topology_cache)
+
+    def set_vertices(self, vertices):
+        """Replaces the vertex positions, invalidating all the derived geometry."""
+        mesh = self._memo.get("mesh")
+        self.vertices = vertices
+        self.residuals = None
+        self._memo = {}
+        self._detached = True
+        self._modified = True
+        if mesh is not None:
+            self._memo["mesh"] = mesh.with_vertices(vertices)
+
+    def commit(self):
+        """Writes the vertices set with set_vertices() to the Rhino document (if they have
+        not been written yet) and returns the id of the mesh object. In Rhinoceros, the
+        geometry of the existing object is replaced in place; otherwise, the object is
+        replaced by a new one.
+        """
+        if not self._modified:
+            return self.mesh_id
+        with profiling.span("commit"):
+            self._write()
+        self._modified = False
+        return self.mesh_id
+
+    def _write(self):
+        vertices = self.vertices
+        if hasattr(vertices, "tolist"):
+            vertices = vertices.tolist()
+        if sc is not None and self.mesh_id is not None:
+            mesh = Rhino.Geometry.Mesh()
+            for vertex in vertices:
+                mesh.Vertices.Add(vertex[0], vertex[1], vertex[2])
+            for face in _rhino_faces(self.face_vertices):
+                if len(face) == 3:
+                    mesh.Faces.AddFace(face[0], face[1], face[2])
+                else:
+                    mesh.Faces.AddFace(face[0], face[1], face[2], face[3])
+            mesh.Normals.ComputeNormals()
+            mesh.Compact()
+            sc.doc.Objects.Replace(self.mesh_id, mesh)
+            sc.doc.Views.Redraw()
+        else:
+            faces = self.face_vertices if sc is None else list(_rhino_faces(self.face_vertices))
+            new_mesh_id = rs.AddMesh(vertices, faces)
+            if self.mesh_id is not None:
+                rs.DeleteObject(self.mesh_id)
+            self.mesh_id = new_mesh_id
+
+    def _get(self, name, builder):
+        if name not in self._memo:
+            self._memo[name] = builder()
+        return self._memo[name]
+
+    @property
+    def face_vertices(self):
+        """Vertex indices of each face, as returned from rs.MeshFaceVertices()."""
+        if self._face_vertices is None:
+            self._face_vertices = self.mesh.face_vertex_lists()
+        return self._face_vertices
+
+    @property
+    def vertex_count(self):
+        return len(self.vertices)
+
+    @property
+    def face_count(self):
+        return len(self.face_vertices)
+
+    @property
+    def face_normals(self):
+        """Face normals, as returned from rs.MeshFaceNormals()."""
+        if self._detached:
+            return self._get("face_normals", lambda: [_newell_normal(points)
+                                                       for points in self.face_points])
+        return self._get("face_normals", lambda: rs.MeshFaceNormals(self.mesh_id))
+
+    @property
+    def face_centers(self):
+        """Face centers, as returned from rs.MeshFaceCenters()."""
+        if self._detached:
+            return self._get("face_centers", lambda: [_center(points)
+                                                       for points in self.face_points])
+        return self._get("face_centers", lambda: rs.MeshFaceCenters(self.mesh_id))
+
+    @property
+    def face_points(self):
+        """For each face, the list of its vertices."""
+        return self._get("face_points", lambda: [[self.vertices[i] for i in face]
+                                                  for face in self.face_vertices])
+
+    @property
+    def face_planes(self):
+        """For each face, the plane fitted through its vertices (None if there is none)."""
+        return self._get("face_planes", lambda: [rs.PlaneFitFromPoints(points)
+                                                  for points in self.face_points])
+
+    @property
+    def mesh(self):
+        """The HalfEdgeMesh of this snapshot (requires NumPy)."""
+        return self._get("mesh", lambda: hem.HalfEdgeMesh.from_faces(
+            self.vertices, self.face_vertices, self.topology_cache))
+
+
+def _rhino_faces(faces):
+    """Yields the faces as triangles and quads, the only faces a Rhino mesh can have:
+    the faces with more than four vertices (e.g. of a mesh read from a file) are
+    fan-triangulated rather than cut down to their first four vertices.
+    """
+    for face in faces:
+        if len(face) <= 4:
+            yield face
+        else:
+            for k in range(1, len(face) - 1):
+                yield [face[0], face[k], face[k + 1]]
+
+
+def _distinct_points(points):
+    # Rhino represents triangles as quads with the last vertex repeated.
+    return [p for i, p in enumerate(points) if i == 0 or list(p) != list(points[i - 1])]
+
+
+def _center(points):
+    points = _distinct_points(points)
+    return [sum(p[k] for p in points) / float(len(points)) for k in range(3)]
+
+
+def _newell_normal(points):
+    points = _distinct_points(points)
+    normal = [0.0, 0.0, 0.0]
+    for i in range(len(points)):
+        p, q = points[i], points[(i + 1) % len(points)]
+        normal[0] += (p[1] - q[1]) * (p[2] + q[2])
+        normal[1] += (p[2] - q[2]) * (p[0] + q[0])
+        normal[2] += (p[0] - q[0]) * (p[1] + q[1])
+    return rs.VectorUnitize(normal)
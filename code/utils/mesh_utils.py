@@ -1,23 +1,77 @@
-import rhinoscriptsyntax as rs
+from utils.rs_backend import rs
 
-def get_and_check_mesh(mesh_id=None):
+from utils import mesh_validation
+from utils import profiling
+from utils.halfedge_mesh import HalfEdgeMesh
+from utils.mesh_snapshot import MeshSnapshot
+
+def get_and_check_mesh(mesh_id=None, tolerance=None, topology_cache=None):
     """If mesh_id is None, retrieves the mesh from the user.
     Checks that all its faces are correctly set up.
     """
     mesh_id = mesh_id or rs.GetObject("Select a mesh")
-    check_mesh(mesh_id)
+    check_mesh(mesh_id, tolerance, topology_cache)
     return mesh_id
 
 
-def check_mesh(mesh_id):
-    """Checks that all the faces are "flat" i.e. each face defines a plane."""
+def get_and_check_snapshot(mesh_id=None, tolerance=None, topology_cache=None):
+    """Same as get_and_check_mesh(), but returns a MeshSnapshot of the mesh, which
+    the flows then use instead of fetching the geometry from Rhino again.
+    """
+    with profiling.span("snapshot"):
+        snapshot = MeshSnapshot.of(mesh_id or rs.GetObject("Select a mesh"), topology_cache)
+    with profiling.span("validation"):
+        check_mesh(snapshot, tolerance, topology_cache)
+    return snapshot
+
+
+def check_mesh(mesh_id, tolerance=None, topology_cache=None):
+    """Checks that all the faces are "flat" i.e. each face defines a plane.
+    If a tolerance is given, also checks that no vertex of a face deviates from the
+    plane of that face by more than tolerance times the size of the face.
+
+    With NumPy, all the faces are checked at once (see mesh_validation.validate(),
+    which also returns a per-face report) and the result is cached for unchanged
+    meshes. The mesh may be given as a Rhino object id, a MeshSnapshot or a HalfEdgeMesh.
+    """
     # TODO(mikhaildubov): Consider adding a check for the normals orientation consistency.
     #                     This seems to be not a trivial problem; see e.g.
     #                     http://jcgt.org/published/0003/04/02/paper.pdf
+    if mesh_validation.available():
+        if not isinstance(mesh_id, HalfEdgeMesh):
+            with profiling.span("half-edge mesh"):
+                mesh_id = MeshSnapshot.of(mesh_id, topology_cache).mesh
+        report = mesh_validation.validate(mesh_id, tolerance)
+        if report.degenerate.any():
+            raise Exception("There is an invalid face which does not represent any plane.")
+        if not report.is_valid:
+            face = report.invalid_faces[0]
+            raise Exception("Face %d is not planar (relative deviation %g)." %
+                            (face, report.residuals[face]))
+        return
+    if tolerance is not None:
+        raise Exception("The planarity tolerance check requires NumPy.")
     if any(plane is None for plane in get_face_planes(mesh_id)):
         raise Exception("There is an invalid face which does not represent any plane.")
 
 
+def update_mesh(snapshot, vertices, commit=True):
+    """Replaces the mesh of the given snapshot with a new one having the same faces
+    and the given vertices, and returns the id of the new mesh. If commit is False, the Rhino document
+    is left untouched: the new vertices are only set in the snapshot, which is returned
+    (see MeshSnapshot.commit()). The vertices may be given as an (n, 3) NumPy array.
+    """
+    if not commit:
+        snapshot.set_vertices(vertices)
+        return snapshot
+    with profiling.span("commit"):
+        if hasattr(vertices, "tolist"):
+            vertices = vertices.tolist()
+        new_mesh_id = rs.AddMesh(vertices, snapshot.face_vertices)
+        rs.DeleteObject(snapshot.mesh_id)
+    return new_mesh_id
+
+
 def add_cube(side=1):
     """Adds a cube with the given side to Rhinoceros."""
     vertices = [(0, 0, 0), (side, 0, 0), (side, side, 0), (0, side, 0),
@@ -27,19 +81,33 @@ def add_cube(side=1):
     return rs.AddMesh(vertices, face_vertices)
 
 
+def add_mesh(vertices, face_offsets, face_indices):
+    """Adds a mesh given by arrays in the layout of HalfEdgeMesh (e.g. one returned from
+    the generators or from mesh_io.read()) to Rhinoceros.
+    """
+    indices = face_indices.tolist()
+    offsets = face_offsets.tolist()
+    faces = [indices[offsets[f]:offsets[f + 1]] for f in range(len(offsets) - 1)]
+    return rs.AddMesh(vertices.tolist(), faces)
+
+
 def get_face_points(mesh_id, face_index):
     """Returns a list of vertices that define the given face. The face_index argument
     should correspond to the order of faces as returned from rs.MeshFaceVertices().
+    The mesh may be given as a Rhino object id, a MeshSnapshot or a HalfEdgeMesh.
     """
-    vertices = rs.MeshVertices(mesh_id)
-    face_vertices = rs.MeshFaceVertices(mesh_id)
-    return [vertices[i] for i in face_vertices[face_index]]
+    if isinstance(mesh_id, HalfEdgeMesh):
+        return mesh_id.face_points(face_index).tolist()
+    return MeshSnapshot.of(mesh_id).face_points[face_index]
 
 
 def get_face_planes(mesh_id):
     """Returns a list of planes corresponding to the faces of the given mesh.
     The elements of the list are Plane objects and come in the same order as
-    the faces returned from rs.MeshFaceVertices().
+    the faces returned from rs.MeshFaceVertices(). For a MeshSnapshot, the planes
+    are fitted only once and then reused.
     """
-    f = rs.MeshFaceCount(mesh_id)
-    return [rs.PlaneFitFromPoints(get_face_points(mesh_id, i)) for i in xrange(f)]
+    if isinstance(mesh_id, HalfEdgeMesh):
+        return [rs.PlaneFitFromPoints(mesh_id.face_points(i).tolist())
+                for i in range(mesh_id.face_count)]
+    return MeshSnapshot.of(mesh_id).face_planes
@@ -0,0 +1,78 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils import planes
+
+""" Vectorized validation of mesh faces. """
+
+
+def available():
+    """Returns True if NumPy is available."""
+    return np is not None
+
+
+class PlanarityReport(object):
+    """Per-face result of validate(). residuals[f] is the largest distance from a vertex
+    of face f to the plane of that face, relative to the size of the face; degenerate[f]
+    is True if the face has (almost) zero area and thus does not define any plane.
+    A face is non-planar if its residual exceeds the tolerance (if one is given).
+    """
+
+    def __init__(self, residuals, degenerate, tolerance=None):
+        self.residuals = residuals
+        self.degenerate = degenerate
+        self.tolerance = tolerance
+        if tolerance is None:
+            self.nonplanar = np.zeros(len(residuals), dtype=bool)
+        else:
+            self.nonplanar = residuals > tolerance
+
+    @property
+    def invalid_faces(self):
+        """Indices of the degenerate or non-planar faces."""
+        return np.nonzero(self.degenerate | self.nonplanar)[0]
+
+    @property
+    def is_valid(self):
+        return not (self.degenerate.any() or self.nonplanar.any())
+
+
+def validate(mesh, tolerance=None, degenerate_tolerance=1e-12):
+    """Checks all the faces of a HalfEdgeMesh in one vectorized pass and returns
+    a PlanarityReport. The report is kept with the mesh (see HalfEdgeMesh.cached()),
+    so validating the same mesh again with the same tolerances costs nothing.
+    NOTE: It depends on the vertex positions, so the mesh of every flow step is validated anew.
+    """
+    return mesh.cached(("planarity", tolerance, degenerate_tolerance),
+                       lambda mesh: _validate(mesh, tolerance, degenerate_tolerance), topological=False)
+
+
+def _validate(mesh, tolerance, degenerate_tolerance):
+    points = mesh.vertices[mesh.face_indices]
+    sizes = np.maximum(mesh.face_sizes(), 1)
+    centers = planes.group_sum(points, mesh.face_offsets) / sizes[:, None]
+    normals, _ = planes.face_planes(mesh)
+
+    # The Newell vector length is twice the area of the face (for planar faces).
+    target = mesh.vertices[mesh.he_target()]
+    doubled_areas = np.sqrt((planes.group_sum(np.cross(points, target), mesh.face_offsets) ** 2).sum(axis=1))
+    offsets_from_center = points - centers[mesh.he_face]
+    radii = np.sqrt(_group_max(np.einsum("ij,ij->i", offsets_from_center, offsets_from_center),
+                               mesh.face_offsets))
+    degenerate = doubled_areas <= degenerate_tolerance * np.maximum(radii, 1e-300) ** 2
+    degenerate |= radii == 0
+
+    distances = np.abs(np.einsum("ij,ij->i", offsets_from_center, normals[mesh.he_face]))
+    residuals = _group_max(distances, mesh.face_offsets) / np.where(radii > 0, radii, 1)
+    return PlanarityReport(residuals, degenerate, tolerance)
+
+
+def _group_max(values, offsets):
+    counts = np.diff(offsets)
+    result = np.zeros(len(counts))
+    nonempty = counts > 0
+    if nonempty.any():
+        result[nonempty] = np.maximum.reduceat(values, offsets[:-1][nonempty])
+    return result
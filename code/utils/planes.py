@@ -0,0 +1,126 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+""" Batched computations on planes given by their equations ax + by + cz + d = 0. """
+
+
+def available():
+    """Returns True if NumPy is available."""
+    return np is not None
+
+
+def face_planes(mesh):
+    """Returns the planes of all the faces of a HalfEdgeMesh as a pair (normals, offsets)
+    of arrays, so that the plane of face f is normals[f] . x + offsets[f] = 0.
+    The unit normals are computed with Newell's method, which is robust for
+    non-triangular faces and follows the orientation of the face.
+    """
+    origin = mesh.vertices[mesh.face_indices]
+    target = mesh.vertices[mesh.face_indices[mesh.he_next]]
+    newell = np.column_stack([(origin[:, 1] - target[:, 1]) * (origin[:, 2] + target[:, 2]),
+                              (origin[:, 2] - target[:, 2]) * (origin[:, 0] + target[:, 0]),
+                              (origin[:, 0] - target[:, 0]) * (origin[:, 1] + target[:, 1])])
+    normals = group_sum(newell, mesh.face_offsets)
+    lengths = np.sqrt(np.einsum("ij,ij->i", normals, normals))
+    normals /= np.where(lengths > 0, lengths, 1)[:, None]
+    centers = group_sum(origin, mesh.face_offsets) / np.maximum(mesh.face_sizes(), 1)[:, None]
+    return normals, -np.einsum("ij,ij->i", normals, centers)
+
+
+def coplanar_groups(normals, offsets, angle_tolerance=1e-6, distance_tolerance=1e-6):
+    """Groups the planes normals[i] . x + offsets[i] = 0 into sets of coincident planes
+    (regardless of their orientation) in O(m log m) time, without pairwise plane
+    comparisons: the planes are sorted by each coordinate of (normal, offset) in turn,
+    within the groups found so far, and a group is split wherever two consecutive values
+    differ by more than the tolerance. So planes closer than the tolerances in every
+    coordinate always get the same group (unlike with rounding to a grid, which splits
+    nearly equal values on both sides of a rounding boundary); a chain of close planes
+    may end up in one group, but distinct planes of a mesh are much farther apart.
+    Returns an (m,) array of group ids: coincident planes get the same id.
+    """
+    normals = np.asarray(normals, dtype=float)
+    offsets = np.asarray(offsets, dtype=float)
+    if not len(normals):
+        return np.zeros(0, dtype=np.int64)
+    # Orient the normals canonically (largest component positive), so that opposite
+    # normals of the same plane give the same coordinates. The largest component of
+    # a unit normal is far from zero, so its sign is the same for nearly equal normals.
+    largest = np.abs(normals).argmax(axis=1)
+    signs = np.where(normals[np.arange(len(normals)), largest] < 0, -1.0, 1.0)
+    coordinates = np.column_stack([normals * signs[:, None], offsets * signs])
+    tolerances = [angle_tolerance] * 3 + [distance_tolerance]
+    group_ids = np.zeros(len(normals), dtype=np.int64)
+    for k in range(4):
+        order = np.lexsort((coordinates[:, k], group_ids))
+        values, groups = coordinates[order, k], group_ids[order]
+        starts = np.ones(len(order), dtype=bool)
+        starts[1:] = (groups[1:] != groups[:-1]) | (np.diff(values) > tolerances[k])
+        group_ids[order] = np.cumsum(starts) - 1
+    return group_ids
+
+
+def intersect_planes(equations, offsets, indices, reference=None, rcond=1e-10):
+    """Computes the intersection points of many groups of planes at once.
+
+    The planes are given as an (m, 4) array of equations [a, b, c, d]; group i is made
+    of the planes indices[offsets[i]:offsets[i + 1]] (CSR layout). The groups of exactly
+    three planes are solved as 3x3 systems, all in one vectorized call; the groups of
+    more planes are solved in the least squares sense via the normal equations, which
+    are also solved in one call. Groups whose planes do not define a point (fewer than
+    three independent normals) get the point closest to the corresponding row of
+    'reference' (the origin by default) among the least squares solutions.
+
+    Returns a pair (points, residuals): an (n, 3) array of points and an (n,) array
+    with the root of the sum of squared plane equation values at each point.
+    """
+    offsets = np.asarray(offsets)
+    indices = np.asarray(indices)
+    equations = np.asarray(equations, dtype=float)
+    n = len(offsets) - 1
+    counts = np.diff(offsets)
+    groups = np.repeat(np.arange(n), counts)
+    normals = equations[indices, :3]
+    d = equations[indices, 3]
+
+    # Normal equations: A = sum(n_k * n_k^T), b = -sum(d_k * n_k)
+    A = group_sum((normals[:, :, None] * normals[:, None, :]).reshape(-1, 9), offsets).reshape(-1, 3, 3)
+    b = group_sum(-d[:, None] * normals, offsets)
+
+    singular_values = np.linalg.svd(A, compute_uv=False)
+    regular = singular_values[:, 2] > rcond * np.maximum(singular_values[:, 0], 1e-300)
+    points = np.zeros((n, 3))
+
+    exact = regular & (counts == 3)
+    if exact.any():
+        rows = offsets[:-1][exact][:, None] + np.arange(3)
+        points[exact] = np.linalg.solve(normals[rows], -d[rows][:, :, None])[:, :, 0]
+
+    least_squares = regular & (counts > 3)
+    if least_squares.any():
+        points[least_squares] = np.linalg.solve(A[least_squares], b[least_squares][:, :, None])[:, :, 0]
+
+    degenerate = ~regular
+    if degenerate.any():
+        if reference is None:
+            ref = np.zeros((degenerate.sum(), 3))
+        else:
+            ref = np.asarray(reference, dtype=float)[degenerate]
+        A_pinv = np.linalg.pinv(A[degenerate], rcond=rcond)
+        correction = b[degenerate] - np.einsum("ijk,ik->ij", A[degenerate], ref)
+        points[degenerate] = ref + np.einsum("ijk,ik->ij", A_pinv, correction)
+
+    values = np.einsum("ij,ij->i", normals, points[groups]) + d
+    residuals = np.sqrt(group_sum(values ** 2, offsets))
+    return points, residuals
+
+
+def group_sum(values, offsets):
+    """Sums the rows of 'values' over the CSR groups given by 'offsets' (empty groups give 0)."""
+    counts = np.diff(offsets)
+    result = np.zeros((len(counts),) + values.shape[1:])
+    nonempty = counts > 0
+    if nonempty.any():
+        result[nonempty] = np.add.reduceat(values, offsets[:-1][nonempty], axis=0)
+    return result
@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 (e.g. IronPython in Rhinoceros)
+    tracemalloc = None
+
+""" Named timing spans and per-iteration memory peaks of the flows.
+
+The flows mark their phases with
+
+    with profiling.span("adjacency"):
+        ...
+
+which does nothing (beyond one function call) unless a profile has been started, so
+the spans can stay in the code. flow_utils.iterate() starts one if it is given
+a 'profile' argument; it can also be done by hand:
+
+    profile = profiling.start(memory=True)
+    ...
+    profiling.stop()
+    print(profile.summary())
+    profile.write_trace("trace.json")  # open it in chrome://tracing or ui.perfetto.dev
+"""
+
+
+# NOTE: time.perf_counter() does not exist in Python 2, where time.clock() is the precise
+#       clock on Windows (i.e. in Rhinoceros).
+clock = getattr(time, "perf_counter", None) or (time.clock if os.name == "nt" else time.time)
+
+# The profile being recorded, if any.
+_profile = None
+
+
+class _NoSpan(object):
+    """The span returned while profiling is off: entering and leaving it costs nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span(object):
+
+    def __init__(self, profile, name, args):
+        self.profile = profile
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profile.events.append((self.name, self.start, clock(), threading.current_thread().ident,
+                                    self.args))
+        return False
+
+
+class _Iteration(_Span):
+    """A span around one iteration, which also records the peak of the memory traced during it."""
+
+    def __enter__(self):
+        if self.profile.memory:
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+        return _Span.__enter__(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _Span.__exit__(self, exc_type, exc_value, traceback)
+        if self.profile.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            self.profile.memory_peaks.append((self.args["index"], self.start, current, peak,
+                                              peak - self.memory_start))
+        return False
+
+
+class Profile(object):
+    """The spans (name, start, end, thread, args) recorded between start() and stop(),
+    with the times in seconds, and the memory traced during each iteration
+    (index, start, current, peak, peak increase) in bytes.
+    """
+
+    def __init__(self, memory=False):
+        self.events = []
+        self.memory_peaks = []
+        self.memory = memory and tracemalloc is not None
+        self.started_tracemalloc = False
+        self.start = clock()
+        self.end = None
+
+    def totals(self):
+        """Returns a dictionary: span name -> (count, total time, max time) in seconds."""
+        totals = {}
+        for name, start, end, _, _ in self.events:
+            count, total, longest = totals.get(name, (0, 0.0, 0.0))
+            totals[name] = (count + 1, total + end - start, max(longest, end - start))
+        return totals
+
+    def summary(self):
+        """Returns a table of the total, mean and maximum time of each span (sorted by
+        the total time) and their share of the profiled time; the spans are nested,
+        so the shares do not sum up to 100%.
+        """
+        elapsed = (self.end if self.end is not None else clock()) - self.start
+        lines = ["%-24s %8s %12s %12s %12s %7s" % ("Span", "Calls", "Total (ms)", "Mean (ms)",
+                                                   "Max (ms)", "Share")]
+        totals = sorted(self.totals().items(), key=lambda item: -item[1][1])
+        for name, (count, total, longest) in totals:
+            lines.append("%-24s %8d %12.2f %12.3f %12.3f %6.1f%%" %
+                         (name, count, 1000 * total, 1000 * total / count, 1000 * longest,
+                          100 * total / elapsed if elapsed > 0 else 0))
+        lines.append("%-24s %8s %12.2f" % ("(profiled time)", "", 1000 * elapsed))
+        if self.memory_peaks:
+            peaks = [peak for _, _, _, peak, _ in self.memory_peaks]
+            increases = [increase for _, _, _, _, increase in self.memory_peaks]
+            lines.append("Traced memory peak per iteration: max %.2f MB, mean %.2f MB "
+                         "(max %.2f MB above the memory at the start of the iteration)" %
+                         (max(peaks) / 2.0 ** 20, sum(peaks) / 2.0 ** 20 / len(peaks),
+                          max(increases) / 2.0 ** 20))
+        return "\n".join(lines)
+
+    def trace(self):
+        """Returns the profile in the Chrome trace event format: a complete event per span
+        and a counter of the traced memory per iteration.
+        """
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                   "args": {"name": "flows"}}]
+        for name, start, end, thread, args in self.events:
+            event = {"name": name, "ph": "X", "pid": pid, "tid": thread,
+                     "ts": 1e6 * (start - self.start), "dur": 1e6 * (end - start)}
+            if args:
+                event["args"] = args
+            events.append(event)
+        for index, start, current, peak, _ in self.memory_peaks:
+            events.append({"name": "traced memory (MB)", "ph": "C", "pid": pid, "tid": 0,
+                           "ts": 1e6 * (start - self.start),
+                           "args": {"peak": peak / 2.0 ** 20, "current": current / 2.0 ** 20}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, path):
+        """Writes the profile to a JSON file that chrome://tracing and ui.perfetto.dev open."""
+        with open(path, "w") as f:
+            json.dump(self.trace(), f)
+
+
+def start(memory=False):
+    """Starts recording the spans (and, if memory is True, the memory peaks of the
+    iterations via tracemalloc, which slows Python code down noticeably) and returns the Profile.
+    """
+    global _profile
+    if _profile is not None:
+        raise Exception("A profile is already being recorded.")
+    _profile = Profile(memory)
+    if _profile.memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _profile.started_tracemalloc = True
+    return _profile
+
+
+def stop():
+    """Stops recording and returns the recorded Profile (None if there was none)."""
+    global _profile
+    profile, _profile = _profile, None
+    if profile is not None:
+        profile.end = clock()
+        if profile.started_tracemalloc:
+            tracemalloc.stop()
+    return profile
+
+
+def enabled():
+    return _profile is not None
+
+
+def span(name, **args):
+    """Returns a context manager timing the enclosed block under the given name
+    (with optional arguments shown in the trace), or a no-op one if profiling is off.
+    """
+    if _profile is None:
+        return _NO_SPAN
+    return _Span(_profile, name, args)
+
+
+def iteration(index):
+    """Same as span("iteration"), also recording the memory peak of the iteration."""
+    if _profile is None:
+        return _NO_SPAN
+    return _Iteration(_profile, "iteration", {"index": index})
@@ -0,0 +1,16 @@
+try:
+    import rhinoscriptsyntax as rs
+except ImportError:
+    from utils import headless_rs as rs
+
+""" The rhinoscriptsyntax module used by all the scripts:
+
+    from utils.rs_backend import rs
+
+In Rhinoceros, this is rhinoscriptsyntax itself; elsewhere (e.g. in a plain Python
+interpreter), it is the in-memory stand-in from utils/headless_rs.py.
+"""
+
+
+# True outside Rhinoceros, i.e. when rs is utils/headless_rs.py.
+headless = rs.__name__ == "utils.headless_rs"
@@ -0,0 +1,146 @@
+import os
+import sys
+from utils.rs_backend import rs
+
+from utils.profiling import clock
+
+""" Tracing of the calls to rhinoscriptsyntax, to find out which of them to batch or avoid.
+
+install() replaces rhinoscriptsyntax, wherever a loaded module refers to it (as 'rs' or
+as an alias of one of its functions, e.g. 'unit = rs.VectorUnitize'), by a proxy which
+counts the calls of each function from each source line and their cumulative time:
+
+    rs_trace.install()
+    ...
+    print(rs_trace.uninstall().report())
+
+flow_utils.iterate() does this if it is given 'trace_rs=True'. Modules imported after
+install() are not traced. The calls that rhinoscriptsyntax makes internally are not
+counted separately, so the times are those seen by the project code.
+"""
+
+
+# The installed tracer, if any, and the module attributes it replaced: (module, name, value).
+_tracer = None
+_replaced = []
+
+
+class Tracer(object):
+    """The calls recorded by the proxy: (function, file, line, caller) -> [count, total time]."""
+
+    def __init__(self):
+        self.calls = {}
+        self.start = clock()
+        self.end = None
+
+    def wrap(self, name, function):
+        """Returns a version of the rs function recording its calls."""
+        calls = self.calls
+
+        def traced(*args, **kwargs):
+            caller = sys._getframe(1)
+            key = (name, caller.f_code.co_filename, caller.f_lineno, caller.f_code.co_name)
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                record = calls.get(key)
+                if record is None:
+                    calls[key] = [1, elapsed]
+                else:
+                    record[0] += 1
+                    record[1] += elapsed
+        traced.__name__ = name
+        traced.__doc__ = function.__doc__
+        return traced
+
+    def totals(self):
+        """Returns a dictionary: rs function name -> (count, total time in seconds)."""
+        totals = {}
+        for (name, _, _, _), (count, total) in self.calls.items():
+            previous_count, previous_total = totals.get(name, (0, 0.0))
+            totals[name] = (previous_count + count, previous_total + total)
+        return totals
+
+    def report(self, limit=20):
+        """Returns the call sites ranked by the time spent in rs calls (the first 'limit'
+        ones), followed by the totals per rs function.
+        """
+        elapsed = (self.end if self.end is not None else clock()) - self.start
+        count = sum(record[0] for record in self.calls.values())
+        total = sum(record[1] for record in self.calls.values())
+        lines = ["%d rs calls, %.2f ms (%.1f%% of the traced time)" %
+                 (count, 1000 * total, 100 * total / elapsed if elapsed > 0 else 0),
+                 "%-24s %9s %12s %11s  %s" % ("rs function", "Calls", "Total (ms)", "Mean (us)",
+                                             "Call site")]
+        ranked = sorted(self.calls.items(), key=lambda item: -item[1][1])
+        for (name, filename, line, caller), (calls, time) in ranked[:limit]:
+            lines.append("%-24s %9d %12.2f %11.2f  %s:%d (%s)" %
+                         (name, calls, 1000 * time, 1e6 * time / calls,
+                          os.path.basename(filename), line, caller))
+        if len(ranked) > limit:
+            lines.append("... %d more call sites" % (len(ranked) - limit))
+        lines.append("")
+        lines.append("%-24s %9s %12s %11s" % ("rs function", "Calls", "Total (ms)", "Mean (us)"))
+        for name, (calls, time) in sorted(self.totals().items(), key=lambda item: -item[1][1]):
+            lines.append("%-24s %9d %12.2f %11.2f" % (name, calls, 1000 * time, 1e6 * time / calls))
+        return "\n".join(lines)
+
+
+class _Proxy(object):
+    """Stands for the rs module: its functions are wrapped by the tracer on first access,
+    everything else (e.g. rs.filter) is returned as is.
+    """
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        value = getattr(rs, name)
+        if callable(value) and not isinstance(value, type):
+            value = self._tracer.wrap(name, value)
+            setattr(self, name, value)
+        return value
+
+
+def install():
+    """Starts tracing the rs calls of all the loaded modules and returns the Tracer."""
+    global _tracer
+    if _tracer is not None:
+        raise Exception("The rs calls are already being traced.")
+    _tracer = Tracer()
+    proxy = _Proxy(_tracer)
+    functions = dict((id(value), name) for name, value in vars(rs).items()
+                     if callable(value) and not isinstance(value, type))
+    for module in list(sys.modules.values()):
+        if module is None or module is rs or getattr(module, "__name__", None) == __name__:
+            continue
+        for name, value in list(vars(module).items()):
+            if value is rs:
+                replacement = proxy
+            elif id(value) in functions and getattr(rs, functions[id(value)]) is value:
+                replacement = getattr(proxy, functions[id(value)])
+            else:
+                continue
+            _replaced.append((module, name, value))
+            setattr(module, name, replacement)
+    return _tracer
+
+
+def uninstall():
+    """Stops tracing, restoring the rs module everywhere, and returns the Tracer (None if
+    the calls were not being traced).
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    while _replaced:
+        module, name, value = _replaced.pop()
+        setattr(module, name, value)
+    if tracer is not None:
+        tracer.end = clock()
+    return tracer
+
+
+def installed():
+    return _tracer is not None
@@ -1,15 +1,56 @@
+import io
 import os
 import sys
 
 from PIL import Image
-from images2gif import writeGif
+from images2gif import readImages, writeGif
+
+
+def read_stream(stream):
+    """Yields the frames sent by utils/gif_encoder.py as PIL images, as they arrive.
+    Each frame is either a line "image N" followed by the N bytes of an image file,
+    or a line "file PATH" naming an image file, which is deleted once read.
+    """
+    while True:
+        line = stream.readline()
+        if not line:
+            return
+        kind, value = line.decode("utf-8").rstrip("\r\n").split(" ", 1)
+        if kind == "image":
+            yield Image.open(io.BytesIO(stream.read(int(value)))).convert("RGB")
+        elif kind == "file":
+            image = Image.open(value)
+            frame = image.convert("RGB")
+            if hasattr(image, "close"):
+                image.close()
+            os.remove(value)
+            yield frame
+        else:
+            raise Exception("Unexpected frame record: %s" % line)
+
+
+def binary_stdin():
+    if hasattr(sys.stdin, "buffer"):
+        return sys.stdin.buffer
+    if sys.platform == "win32":
+        # Python 2 opens stdin in text mode on Windows.
+        import msvcrt
+        msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+    return sys.stdin
+
 
 # This script generates a gif file from a folder containing single frames in png format.
+# The frames are decoded ahead on a few threads and written one by one as they come,
+# so only a couple of them are in memory at any time, however long the animation.
+# With "-" instead of the folder, the frames are read from the standard input as they
+# are captured (see utils/gif_encoder.py), and the gif is complete right after the last one.
 # Usage example:
 #    > python create_gif.py path/to/your/animation.gif path/to/the/frames
 if __name__ == '__main__':
     gif_path = sys.argv[1]
     frames_path = sys.argv[2]
-    file_names = sorted((os.path.join(frames_path, fn) for fn in os.listdir(frames_path) if fn.endswith('.png')))
-    images = [Image.open(fn) for fn in file_names]
-    writeGif(gif_path, images, duration=0.1)
+    if frames_path == '-':
+        writeGif(gif_path, read_stream(binary_stdin()), duration=0.1)
+    else:
+        file_names = sorted((os.path.join(frames_path, fn) for fn in os.listdir(frames_path) if fn.endswith('.png')))
+        writeGif(gif_path, readImages(file_names), duration=0.1)
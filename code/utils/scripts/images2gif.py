@@ -30,7 +30,10 @@
 Provides functionality for reading and writing animated GIF images.
 Use writeGif to write a series of numpy arrays or PIL images as an
 animated GIF. Use readGif to read an animated gif as a series of numpy
-arrays.
+arrays. Long animations can be written one frame at a time with
+GifStreamWriter (or by passing an iterator to writeGif), so that only
+a couple of frames are in memory at any time; readImages decodes image
+files (e.g. PNG frames) ahead of the writer on a few threads.
 
 Note that since July 2004, all patents on the LZW compression patent have
 expired. Therefore the GIF format may now be used freely.
@@ -64,7 +67,8 @@ Usefull links
 
 """
 
-import os, time
+import os, struct, time
+from collections import deque
 
 def encode(x):
   if False:
@@ -497,10 +501,12 @@ def writeGif(filename, images, duration=0.1, repeat=True, dither=False,
     ----------
     filename : string
         The name of the file to write the image to.
-    images : list
+    images : list or iterator
         Should be a list consisting of PIL images or numpy arrays.
         The latter should be between 0 and 255 for integer types, and
-        between 0 and 1 for float types.
+        between 0 and 1 for float types. If an iterator (e.g. a generator)
+        is given instead, the frames are written one at a time as they
+        are produced (see GifStreamWriter).
     duration : scalar or list of scalars
         The duration for all frames, or (if a list) for each frame.
     repeat : bool or integer
@@ -533,6 +539,17 @@ def writeGif(filename, images, duration=0.1, repeat=True, dither=False,
     if PIL is None:
         raise RuntimeError("Need PIL to write animated gif files.")
 
+    # An iterator (e.g. a generator of frames): write the frames as they come
+    if not isinstance(images, (list, tuple)):
+        gifStreamWriter = GifStreamWriter(filename, duration, repeat, dither,
+                                          nq, subRectangles, dispose)
+        try:
+            for im in images:
+                gifStreamWriter.addFrame(im)
+        finally:
+            gifStreamWriter.close()
+        return
+
     # Check images
     images = checkImages(images)
 
@@ -587,6 +604,202 @@ def writeGif(filename, images, duration=0.1, repeat=True, dither=False,
 
 
 
+class GifStreamWriter:
+    """ GifStreamWriter(filename, duration=0.1, repeat=True, dither=False,
+                        nq=0, subRectangles=True, dispose=None)
+
+    Writes an animated gif one frame at a time: each frame given to
+    addFrame() is compared with the previous one only, cropped to the
+    sub-rectangle that changed, quantized and written to the file at once,
+    so memory use does not grow with the number of frames. close()
+    finishes the file. The parameters are those of writeGif (duration,
+    subRectangles and dispose may be lists, indexed by frame number).
+
+    The palette of the first frame is the global one; the frames with
+    another palette get a local one.
+
+    """
+
+    def __init__(self, filename, duration=0.1, repeat=True, dither=False,
+                 nq=0, subRectangles=True, dispose=None):
+
+        # Check PIL and Numpy
+        if PIL is None:
+            raise RuntimeError("Need PIL to write animated gif files.")
+        if subRectangles is True and np is None:
+            raise RuntimeError("Need Numpy to use auto-subRectangles.")
+
+        # Check loops
+        if repeat is False:
+            loops = 1
+        elif repeat is True:
+            loops = 0 # zero means infinite
+        else:
+            loops = int(repeat)
+        if loops == 0:
+            loops = 2**16-1
+
+        if dispose is None:
+            dispose = 1 if subRectangles else 2
+
+        self._fp = open(filename, 'wb')
+        self._loops = loops
+        self._duration = duration
+        self._dither = dither
+        self._nq = nq
+        self._subRectangles = subRectangles
+        self._dispose = dispose
+        self._gifWriter = GifWriter()
+        self._globalPalette = None
+        self._previous = None
+        self.frames = 0
+
+
+    def addFrame(self, im):
+        """ addFrame(im)
+
+        Writes the next frame (a PIL image or a numpy array, see writeGif).
+
+        """
+
+        im = checkImages([im])[0]
+        xy = (0,0)
+
+        if self._subRectangles is True:
+            # Compare with the previous frame only
+            if isinstance(im, Image.Image):
+                im = np.asarray(im.convert('RGB'))
+            previous, self._previous = self._previous, im
+            if previous is not None:
+                diff = im != previous
+                if diff.ndim == 3:
+                    diff = diff.any(2)
+                X = np.argwhere(diff.any(0))
+                Y = np.argwhere(diff.any(1))
+                if X.size and Y.size:
+                    x0, x1 = int(X[0, 0]), int(X[-1, 0])+1
+                    y0, y1 = int(Y[0, 0]), int(Y[-1, 0])+1
+                else: # No change ... make it minimal
+                    x0, x1 = 0, 2
+                    y0, y1 = 0, 2
+                im = im[y0:y1,x0:x1]
+                xy = (x0,y0)
+        elif isinstance(self._subRectangles, (tuple,list)) and self.frames:
+            xy = self._subRectangles[self.frames]
+
+        im = self._gifWriter.convertImagesToPIL([im], self._dither, self._nq)[0]
+        palette = _paletteBytes(im)
+        duration = _frameValue(self._duration, self.frames)
+        dispose = _frameValue(self._dispose, self.frames)
+
+        fp = self._fp
+        if self._globalPalette is None:
+            # Header, global color table and application extension
+            self._globalPalette = palette
+            fp.write(b'GIF89a' + struct.pack('<HHBBB', im.size[0], im.size[1], 0x87, 0, 0))
+            fp.write(palette)
+            fp.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01' + struct.pack('<H', self._loops) + b'\x00')
+
+        # Graphics control extension and image descriptor
+        fp.write(struct.pack('<BBBBHBB', 0x21, 0xF9, 4, (dispose & 3) << 2,
+                             int(duration*100), 0, 0))
+        local = palette != self._globalPalette
+        fp.write(struct.pack('<BHHHHB', 0x2C, xy[0], xy[1], im.size[0], im.size[1],
+                             0x87 if local else 0))
+        if local:
+            fp.write(palette)
+
+        # LZW minimum code size and image data
+        fp.write(_imageData(im))
+        self.frames += 1
+
+
+    def close(self):
+        """ close()
+
+        Finishes the gif file.
+
+        """
+        if self._fp is not None:
+            if self._globalPalette is not None:
+                self._fp.write(b';')  # end gif
+            self._fp.close()
+            self._fp = None
+
+
+def _frameValue(value, index):
+    if hasattr(value, '__len__'):
+        return value[index]
+    return value
+
+
+def _paletteBytes(im):
+    """ The 256-color palette of a paletted PIL image as 768 bytes. """
+    palette = list(im.getpalette() or [])[:768]
+    palette += [0] * (768 - len(palette))
+    return struct.pack('768B', *palette)
+
+
+def _imageData(im):
+    """ The LZW minimum code size and the image data of a paletted PIL
+    image, as written by PIL (skipping the extensions, image descriptor
+    and local color table which PIL may write before them).
+    """
+    data = b''.join(getdata(im))
+    i = 0
+    while data[i:i+1] == b'!':
+        # Extension: introducer, label, then sub-blocks up to an empty one
+        i += 2
+        while ord(data[i:i+1]) != 0:
+            i += ord(data[i:i+1]) + 1
+        i += 1
+    if data[i:i+1] == b',':
+        flags = ord(data[i+9:i+10])
+        i += 10
+        if flags & 0x80:
+            i += 3 << ((flags & 7) + 1)
+    return data[i:]
+
+
+def _loadImage(filename):
+    im = Image.open(filename)
+    rgb = im.convert('RGB')
+    if hasattr(im, 'close'):
+        im.close()
+    if np is not None:
+        return np.asarray(rgb)
+    return rgb
+
+
+def readImages(filenames, threads=2, ahead=2):
+    """ readImages(filenames, threads=2, ahead=2)
+
+    Yields the images stored in the given files (e.g. the PNG frames of an
+    animation), in order, as RGB numpy arrays (PIL images without Numpy).
+    Up to 'ahead' images are decoded in advance on a pool of 'threads'
+    threads, so that decoding overlaps with the processing of the images
+    (e.g. by writeGif) while only a few of them are in memory.
+
+    """
+
+    # Check PIL
+    if PIL is None:
+        raise RuntimeError("Need PIL to read image files.")
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(threads)
+    pending = deque()
+    try:
+        for filename in filenames:
+            pending.append(pool.apply_async(_loadImage, (filename,)))
+            if len(pending) > ahead:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
 def readGif(filename, asNumpy=True):
     """ readGif(filename, asNumpy=True)
 
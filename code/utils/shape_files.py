@@ -0,0 +1,74 @@
+import os
+from utils.rs_backend import rs, headless
+
+try:
+    import rhino3dm
+except ImportError:
+    rhino3dm = None
+
+""" Adding the shapes stored in .3dm files and polyline point files to the document.
+(For the mesh files, see mesh_io.py.)
+"""
+
+
+def import_3dm(path, kind):
+    """Adds the meshes (kind "mesh") or the polylines (kind "curve": curves with at least
+    three vertices) stored in a .3dm file to the document and returns their ids.
+    Outside Rhinoceros, this requires the rhino3dm package; returns None without it.
+    """
+    if not headless:
+        rs.Command('_-Import "%s" _Enter' % path)
+        object_type = rs.filter.mesh if kind == "mesh" else rs.filter.curve
+        ids = rs.LastCreatedObjects() or []
+        rs.DeleteObjects([object_id for object_id in ids if rs.ObjectType(object_id) != object_type])
+        return [object_id for object_id in ids if rs.ObjectType(object_id) == object_type]
+    if rhino3dm is None:
+        return None
+    ids = []
+    for obj in rhino3dm.File3dm.Read(path).Objects:
+        geometry = obj.Geometry
+        if kind == "mesh" and isinstance(geometry, rhino3dm.Mesh):
+            vertices = [(p.X, p.Y, p.Z) for p in geometry.Vertices]
+            faces = [geometry.Faces[i] for i in range(len(geometry.Faces))]
+            ids.append(rs.AddMesh(vertices, faces))
+        elif kind == "curve" and isinstance(geometry, rhino3dm.Curve):
+            points = geometry.ToNurbsCurve().Points
+            if geometry.ToNurbsCurve().Degree == 1 and len(points) > 3:
+                ids.append(rs.AddPolyline([(p.X, p.Y, p.Z) for p in points]))
+    return ids
+
+
+def read_polyline(path):
+    """Reads the points of a polyline from a text file with one point per line,
+    the coordinates being separated by spaces or commas (e.g. a .txt, .xyz or .csv file).
+    Lines starting with '#' are skipped. A closed polyline repeats its first point at the end.
+    """
+    points = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            coordinates = [float(x) for x in line.replace(",", " ").split()]
+            if len(coordinates) == 2:
+                coordinates.append(0.0)
+            if len(coordinates) != 3:
+                raise Exception("Expected 2 or 3 coordinates per line in %s: %s" % (path, line))
+            points.append(coordinates)
+    return points
+
+
+def write_polyline(path, points):
+    """Writes the points of a polyline to a text file readable by read_polyline()."""
+    with open(path, "w") as f:
+        for point in points:
+            f.write("%r %r %r\n" % (float(point[0]), float(point[1]), float(point[2])))
+
+
+def add_polyline(path):
+    """Adds the polyline stored in the given point file to the document and returns its id."""
+    return rs.AddPolyline(read_polyline(path))
+
+
+def is_polyline_file(path):
+    return os.path.splitext(path)[1].lower() in (".txt", ".xyz", ".csv")
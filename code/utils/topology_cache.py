@@ -0,0 +1,67 @@
+import hashlib
+from collections import OrderedDict
+
+""" LRU cache of the structures derived from the connectivity of a mesh. """
+
+
+class TopologyCache(object):
+    """Keeps the connectivity-derived structures (adjacency lists, half-edge arrays,
+    Laplacians, factorizations etc.) of the last few mesh topologies seen.
+
+    The flows replace the mesh with a new one having exactly the same faces on each
+    step, so flow_utils.iterate() passes one cache to all the steps of a run and every
+    such structure is computed once per run instead of once per iteration.
+    Each topology gets a dict of its own (see entry()); the least recently used
+    topologies are evicted once there are more than max_entries of them.
+    """
+
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def entry(self, key):
+        """Returns the dict of derived structures for the topology with the given key
+        (see faces_key()), creating an empty one if this topology is new.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            entry = {}
+        else:
+            self.hits += 1
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def get(self, key, name, builder):
+        """Returns the structure 'name' of the topology with the given key,
+        building it with builder() if it is not cached yet.
+        """
+        entry = self.entry(key)
+        if name not in entry:
+            entry[name] = builder()
+        return entry[name]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def faces_key(vertex_count, faces):
+    """Returns a hashable key identifying the topology given by the number of vertices
+    and the faces: either a list of vertex index sequences (as returned from
+    rs.MeshFaceVertices()) or a sequence of NumPy arrays (e.g. face offsets and indices).
+    """
+    digest = hashlib.sha1()
+    if faces and all(hasattr(array, "tobytes") for array in faces):
+        for array in faces:
+            digest.update(str(len(array)).encode("ascii"))
+            digest.update(array.tobytes())
+    else:
+        digest.update(repr([tuple(face) for face in faces]).encode("ascii"))
+    return (vertex_count, digest.hexdigest())
@@ -0,0 +1,235 @@
+import json
+import os
+import struct
+import zlib
+from utils.rs_backend import rs
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils import convergence
+from utils.mesh_snapshot import MeshSnapshot
+
+""" Recording the vertex positions of every iteration of a flow to a file, and reading
+any of them back (requires NumPy; see flow_utils.iterate()).
+
+A trajectory is stored in two files. The data file holds, after the magic bytes and
+the length of the header, a JSON header (the vertex count, the precision, the face count)
+and the faces of a mesh (face_offsets, face_indices, as in HalfEdgeMesh) followed by
+the frames. Every 'keyframe_every'-th frame is a keyframe: the vertex positions as raw
+little-endian doubles, read straight from the memory-mapped file. The other frames are
+deltas from the last keyframe, quantized to multiples of 'precision' and stored in the
+narrowest integer type they fit, split into byte planes (all the lowest bytes first, etc.)
+and compressed with zlib. So reading any frame takes at most two blocks (its keyframe
+and its delta), and the error of a frame is at most precision / 2, not accumulated
+from frame to frame.
+
+The index file (the path with ".idx" appended) holds a fixed-size record per frame:
+its offset and size in the data file, the frame number of its keyframe and the size
+of its integers (0 for a keyframe), so seeking to a frame takes O(1).
+"""
+
+
+MAGIC = b"FLOWTRAJ"
+VERSION = 1
+
+# A frame in the index file: see the module docstring.
+_INDEX_RECORD = [("offset", "<i8"), ("size", "<i8"), ("keyframe", "<i8"), ("width", "<i8")]
+
+# Delta integer types by size, from the narrowest.
+_WIDTHS = [(1, "<i1"), (2, "<i2"), (4, "<i4")]
+
+
+def available():
+    """Returns True if NumPy is available."""
+    return np is not None
+
+
+class Recorder(object):
+    """Appends frames (the (n, 3) vertex arrays of a shape) to a new trajectory file:
+
+        recorder = Recorder("path/to/flow.traj", face_offsets, face_indices)
+        for ...:
+            recorder.append(vertices)
+        recorder.close()
+
+    The faces are optional (None for a polyline). If 'precision' is not given, it is
+    1e-6 times the size (the diagonal of the bounding box) of the first frame.
+    A frame is also stored as a keyframe when its delta does not fit in 32-bit integers
+    of that precision (e.g. after a vertex has moved far away) or is not finite.
+    """
+
+    def __init__(self, path, face_offsets=None, face_indices=None, keyframe_every=50,
+                 precision=None, compression=1):
+        self.path = path
+        self.keyframe_every = keyframe_every
+        self.precision = precision
+        self.compression = compression
+        self.frame_count = 0
+        self._faces = (face_offsets, face_indices)
+        self._data = None
+        self._index = None
+        self._keyframe = None
+        self._keyframe_number = None
+
+    @classmethod
+    def of(cls, path, shape, **kwargs):
+        """Returns a Recorder of the given shape (a mesh or polyline id, or a MeshSnapshot),
+        with its faces and its current vertices as the first frame.
+        """
+        face_offsets = face_indices = None
+        if isinstance(shape, MeshSnapshot) or rs.IsMesh(shape):
+            mesh = MeshSnapshot.of(shape).mesh
+            face_offsets, face_indices = mesh.face_offsets, mesh.face_indices
+        recorder = cls(path, face_offsets, face_indices, **kwargs)
+        recorder.append(convergence.shape_vertices(shape))
+        return recorder
+
+    def append(self, vertices):
+        """Appends the vertex positions of the next frame."""
+        vertices = np.ascontiguousarray(vertices, dtype="<f8").reshape(-1, 3)
+        if self._data is None:
+            self._start(vertices)
+        elif len(vertices) != self._vertex_count:
+            raise Exception("A trajectory has %d vertices in every frame, got %d." %
+                            (self._vertex_count, len(vertices)))
+        offset = self._data.tell()
+        block, width = None, 0
+        if self.frame_count % self.keyframe_every != 0:
+            block, width = self._delta(vertices)
+        if block is None:
+            block = vertices.tobytes()
+            self._keyframe = vertices.copy()
+            self._keyframe_number = self.frame_count
+        self._data.write(block)
+        record = np.array([(offset, len(block), self._keyframe_number, width)], dtype=_INDEX_RECORD)
+        self._index.write(record.tobytes())
+        self.frame_count += 1
+
+    def close(self):
+        """Closes the files (a trajectory can be read only after that)."""
+        if self._data is not None:
+            self._data.close()
+            self._index.close()
+            self._data = self._index = None
+
+    def _start(self, vertices):
+        self._vertex_count = len(vertices)
+        if self.precision is None:
+            size = float(np.sqrt(((vertices.max(axis=0) - vertices.min(axis=0)) ** 2).sum())) if len(vertices) else 0
+            self.precision = 1e-6 * size if size > 0 and np.isfinite(size) else 1e-9
+        face_offsets, face_indices = self._faces
+        header = {"version": VERSION, "vertex_count": self._vertex_count, "precision": self.precision,
+                  "keyframe_every": self.keyframe_every,
+                  "face_count": None if face_offsets is None else len(face_offsets) - 1,
+                  "face_index_count": None if face_indices is None else len(face_indices)}
+        header_bytes = json.dumps(header, sort_keys=True).encode("utf-8")
+        self._data = open(self.path, "wb")
+        self._index = open(_index_path(self.path), "wb")
+        self._data.write(MAGIC)
+        self._data.write(struct.pack("<I", len(header_bytes)))
+        self._data.write(header_bytes)
+        if face_offsets is not None:
+            self._data.write(np.asarray(face_offsets, dtype="<i8").tobytes())
+            self._data.write(np.asarray(face_indices, dtype="<i8").tobytes())
+
+    def _delta(self, vertices):
+        """Returns the compressed delta of the vertices from the keyframe and the size of its
+        integers, or (None, 0) if the frame should be a keyframe."""
+        with np.errstate(invalid="ignore"):
+            quanta = np.rint((vertices - self._keyframe) / self.precision)
+        if not np.isfinite(quanta).all():
+            return None, 0
+        largest = float(np.abs(quanta).max()) if quanta.size else 0
+        for width, dtype in _WIDTHS:
+            if largest < 2 ** (8 * width - 1):
+                # Coordinate-major, then byte planes: similar bytes end up next to each other.
+                data = np.ascontiguousarray(quanta.T, dtype=dtype).view(np.uint8).reshape(-1, width)
+                planes = np.empty((width, len(data)), dtype=np.uint8)
+                for k in range(width):
+                    planes[k] = data[:, k]
+                return zlib.compress(planes.tobytes(), self.compression), width
+        return None, 0
+
+
+class Trajectory(object):
+    """A trajectory file written by a Recorder, memory-mapped for reading:
+
+        trajectory = Trajectory("path/to/flow.traj")
+        vertices = trajectory.frame(100)            # an (n, 3) array
+        positions = trajectory.frames(0, 1000, 10)  # a (100, n, 3) array
+
+    'face_offsets' and 'face_indices' are the faces of the mesh (None for a polyline),
+    so e.g. mesh_utils.add_mesh(trajectory.frame(i), trajectory.face_offsets,
+    trajectory.face_indices) adds frame i to the document.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise Exception("Not a trajectory file: %s" % path)
+            header_size, = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_size).decode("utf-8"))
+        if header["version"] != VERSION:
+            raise Exception("Unsupported trajectory version: %s" % path)
+        self.vertex_count = header["vertex_count"]
+        self.precision = header["precision"]
+        self.keyframe_every = header["keyframe_every"]
+        self._data = np.memmap(path, dtype=np.uint8, mode="r")
+        offset = len(MAGIC) + 4 + header_size
+        self.face_offsets = self.face_indices = None
+        if header["face_count"] is not None:
+            self.face_offsets = self._data[offset:offset + 8 * (header["face_count"] + 1)].view("<i8")
+            offset += self.face_offsets.nbytes
+            self.face_indices = self._data[offset:offset + 8 * header["face_index_count"]].view("<i8")
+        index_path = _index_path(path)
+        count = os.path.getsize(index_path) // np.dtype(_INDEX_RECORD).itemsize
+        self._index = (np.memmap(index_path, dtype=_INDEX_RECORD, mode="r", shape=(count,))
+                       if count else np.zeros(0, dtype=_INDEX_RECORD))
+
+    def __len__(self):
+        return len(self._index)
+
+    def frame(self, number):
+        """Returns the vertex positions of the given frame (0 being the first one,
+        negative numbers counting from the end) as an (n, 3) array. A keyframe is
+        returned as a read-only view of the memory-mapped file.
+        """
+        if number < 0:
+            number += len(self)
+        if not 0 <= number < len(self):
+            raise IndexError("Frame %d of a trajectory with %d frames" % (number, len(self)))
+        offset, size, keyframe, width = self._index[number].tolist()
+        if width == 0:
+            return self._block(offset, size).view("<f8").reshape(-1, 3)
+        keyframe_vertices = self.frame(keyframe)
+        planes = np.frombuffer(zlib.decompress(self._block(offset, size)), dtype=np.uint8).reshape(width, -1)
+        data = np.empty((planes.shape[1], width), dtype=np.uint8)
+        for k in range(width):
+            data[:, k] = planes[k]
+        quanta = data.view(dict(_WIDTHS)[width]).reshape(3, -1)
+        return keyframe_vertices + quanta.T * self.precision
+
+    def frames(self, start=0, stop=None, step=1):
+        """Returns the vertex positions of the frames range(start, stop, step)
+        as a (k, n, 3) array.
+        """
+        numbers = range(*slice(start, stop, step).indices(len(self)))
+        result = np.empty((len(numbers), self.vertex_count, 3))
+        for k, number in enumerate(numbers):
+            result[k] = self.frame(number)
+        return result
+
+    def close(self):
+        """Releases the memory-mapped files."""
+        self._data = self._index = None
+
+    def _block(self, offset, size):
+        return self._data[offset:offset + size]
+
+
+def _index_path(path):
+    return path + ".idx"
@@ -1,5 +1,5 @@
 from math import radians
-import rhinoscriptsyntax as rs
+from utils.rs_backend import rs
 
 
 def VectorDraw(vecdir, base_point=[0,0,0]):